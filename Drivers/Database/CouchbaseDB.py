@@ -12,6 +12,8 @@ from couchbase.cluster import PasswordAuthenticator
 from couchbase.exceptions import NotFoundError, KeyExistsError, QueueEmpty, TemporaryFailError
 from couchbase.bucket import LOCKMODE_WAIT
 
+import json
+import socket
 import threading
 import time
 
@@ -25,6 +27,193 @@ def get_lap(time_interval):
     '''
     return int(time.time() // time_interval)
 
+# %% Release Notifications ====================================================
+
+QUEUE_MIN_WAIT = 0.001 # s
+QUEUE_MAX_WAIT = 0.01 # s, polling interval while releases are not signaled
+QUEUE_SIGNALED_WAIT = 0.5 # s, polling interval while releases are signaled
+RELEASE_PORT = 8091 # Couchbase port used to find the local interface
+RELEASE_NOTIFIERS = {} # (host, bucket, queue_ID):ReleaseNotifier
+RELEASE_NOTIFIERS_LOCK = threading.Lock()
+RELEASE_LISTENER = None # (address, port) of this process's release socket
+RELEASE_SOCKET = None
+
+class ReleaseNotifier():
+    def __init__(self, bucket, queue_ID):
+        '''Notifies the threads that are waiting on a queue when an item is
+        removed from it. Each removal increments a counter, so that removals
+        that occur between checking the queue and waiting are not missed.
+        Threads in this process are notified directly. Other processes are
+        sent a release datagram at the address recorded in their queue items,
+        which their release listener passes on to their notifiers. Pushes are
+        counted and signaled in the same way to the threads waiting for new
+        items (see PriorityQueue.wait_for_push).
+        '''
+        self.condition = threading.Condition()
+        self.count = 0
+        self.pushed = 0
+        self.signaled = False
+        self.datagram = json.dumps([bucket, queue_ID]).encode()
+        self.push_datagram = json.dumps([bucket, queue_ID, 'push']).encode()
+
+    def notify(self):
+        with self.condition:
+            self.count += 1
+            self.condition.notify_all()
+
+    def signal(self, items):
+        '''Notifies the waiting threads of this process and of every other
+        process with an item in the given queue items. Datagrams that cannot
+        be sent are ignored, the receivers then find the release by polling.
+        '''
+        self.notify()
+        addresses = set([tuple(item['notify']) for item in items if ('notify' in item)])
+        addresses.discard(RELEASE_LISTENER)
+        for address in addresses:
+            try:
+                RELEASE_SOCKET.sendto(self.datagram, address)
+            except OSError:
+                pass
+
+    def wait(self, count, timeout):
+        '''Blocks until a removal after the given count, or until the timeout
+        has passed. Returns the current count.
+        '''
+        with self.condition:
+            self.condition.wait_for(lambda: self.count != count, timeout)
+            return self.count
+
+    def notify_push(self):
+        with self.condition:
+            self.pushed += 1
+            self.condition.notify_all()
+
+    def signal_push(self, address):
+        '''Notifies the threads of this process that wait for pushes, and the
+        process listening at the given address if it is another process.
+        '''
+        self.notify_push()
+        if (address is not None) and (tuple(address) != RELEASE_LISTENER):
+            try:
+                RELEASE_SOCKET.sendto(self.push_datagram, tuple(address))
+            except OSError:
+                pass
+
+    def wait_for_push(self, count, timeout):
+        '''Blocks until a push after the given count, or until the timeout has
+        passed. Returns the current push count, which is returned immediately
+        if the count is None.
+        '''
+        with self.condition:
+            if (count is not None):
+                self.condition.wait_for(lambda: self.pushed != count, timeout)
+            return self.pushed
+
+def get_release_notifier(host, bucket, queue_ID):
+    '''Returns the notifier shared by all queue objects in this process that
+    use the same queue. The release listener of this process is started with
+    the first notifier.
+    '''
+    start_release_listener(host)
+    with RELEASE_NOTIFIERS_LOCK:
+        key = (host, bucket, queue_ID)
+        if not(key in RELEASE_NOTIFIERS):
+            RELEASE_NOTIFIERS[key] = ReleaseNotifier(bucket, queue_ID)
+        return RELEASE_NOTIFIERS[key]
+
+def start_release_listener(host):
+    '''Opens the UDP socket on which this process receives release datagrams
+    and starts the daemon thread that serves it. The socket is advertised at
+    the address of the interface that routes to the Couchbase host, so that
+    it is reachable by the other clients of that server. Returns the
+    advertised (address, port).
+    '''
+    global RELEASE_LISTENER, RELEASE_SOCKET
+    with RELEASE_NOTIFIERS_LOCK:
+        if (RELEASE_LISTENER is None):
+            probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                # No packets are sent when connecting a UDP socket
+                probe.connect((host, RELEASE_PORT))
+                address = probe.getsockname()[0]
+            except OSError:
+                address = '127.0.0.1'
+            finally:
+                probe.close()
+            RELEASE_SOCKET = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            RELEASE_SOCKET.bind(('', 0))
+            RELEASE_LISTENER = (address, RELEASE_SOCKET.getsockname()[1])
+            thread = threading.Thread(target=_listen_for_releases, args=[RELEASE_SOCKET], name='release listener', daemon=True)
+            thread.start()
+        return RELEASE_LISTENER
+
+def _listen_for_releases(sock):
+    '''Passes the release and push datagrams received by this process on to
+    the notifiers of their queue.
+    '''
+    while True:
+        try:
+            signal = json.loads(sock.recv(1024).decode())
+            (bucket, queue_ID) = signal[:2]
+        except (OSError, ValueError, TypeError):
+            continue
+        with RELEASE_NOTIFIERS_LOCK:
+            notifiers = [notifier for (key, notifier) in RELEASE_NOTIFIERS.items() if (key[1:] == (bucket, queue_ID))]
+        for notifier in notifiers:
+            if (signal[2:] == ['push']):
+                notifier.notify_push()
+            else:
+                notifier.notify()
+
+def wait_for_queue(queue, position, message=None, **push_kwargs):
+    '''Blocks until the calling thread's item is at the top of the queue,
+    pushing a new item if it is not in the queue. Removals wake the waiting
+    thread through the queue's release notifier, whether they are made in
+    this process or signaled by another (see ReleaseNotifier), so the queue
+    is only read again after a release. The queue is also polled in case a
+    release datagram is lost. While releases are found by polling, the
+    interval starts at QUEUE_MIN_WAIT and doubles up to QUEUE_MAX_WAIT while
+    the position in the queue does not change. Once releases are seen to be
+    signaled, the queue is only polled every QUEUE_SIGNALED_WAIT. Returns
+    False if a new item had to be pushed.
+    '''
+    released = queue.released
+    lap = get_lap(10)
+    start_lap = lap
+    queued = True
+    wait = QUEUE_MIN_WAIT
+    polled = False
+    last_position = None
+    while True:
+        count = released.count
+        queue_position = position()
+        if (queue_position == 0):
+        # Item is at the top of the queue
+            break
+        elif (queue_position < 0):
+        # Enter item into queue
+            queued = False
+            queue.push(message=message, **push_kwargs)
+        else:
+        # Wait for queue
+            if (queue_position != last_position):
+                if (last_position != None):
+                    # A release found by polling was not signaled, unless its
+                    # signal follows shortly
+                    released.signaled = not(polled) or (released.wait(count, QUEUE_MIN_WAIT) != count)
+                last_position = queue_position
+                wait = (QUEUE_SIGNALED_WAIT if released.signaled else QUEUE_MIN_WAIT)
+            new_lap = get_lap(10)
+            if new_lap > lap:
+                lap = new_lap
+                print(" waiting for {:} queue, {:}s".format(queue.q_ID, (lap-start_lap)*10))
+            polled = (released.wait(count, wait) == count)
+            if polled:
+                wait = min(2*wait, (QUEUE_SIGNALED_WAIT if released.signaled else QUEUE_MAX_WAIT))
+    if lap > start_lap:
+        print(" {:} queue complete, {:}".format(queue.q_ID, time.strftime('%c')))
+    return queued
+
 # %% Priority Queue ===========================================================
 
 class PriorityQueue():
@@ -41,11 +230,14 @@ class PriorityQueue():
         authenticator = PasswordAuthenticator(username, password)
         self.cluster.authenticate(authenticator)
         self.cb = self.cluster.open_bucket(bucket, lockmode=LOCKMODE_WAIT)
+        self.released = get_release_notifier(host, bucket, queue_ID)
         # Create id counter (if it does not exist)
         self.c_ID = 'id_counter'
         self.cb.counter(self.c_ID, initial=0)
         # Create the queue (if it does not exist)
         self.q_ID = queue_ID
+        self.l_ID = queue_ID+'_listener'
+        self.registered = None
         try:
             self.cb.insert(self.q_ID, [])
         except (KeyExistsError, TemporaryFailError):
@@ -67,7 +259,7 @@ class PriorityQueue():
         '''
         id_int = self.cb.counter(self.c_ID).value
         priority = bool(priority)
-        new_item = {'id':id_int, 'priority':priority, 'message':message}
+        new_item = {'id':id_int, 'priority':priority, 'message':message, 'notify':list(RELEASE_LISTENER)}
         loop_for_cas = True
         while loop_for_cas:
             try:
@@ -103,6 +295,8 @@ class PriorityQueue():
                 pass
             else:
                 loop_for_cas = False
+        # Signal the process that waits for messages
+        self.released.signal_push(self._listener() if message else None)
         # Clean up old thread identifiers
         if remove_old_id:
             queue = self.get_queue()
@@ -161,12 +355,15 @@ class PriorityQueue():
                     if index >= 0:
                         queue.pop(index)
                         self.cb.upsert(self.q_ID, queue, cas=cas,ttl=self.timeout)
+                    else:
+                        queue = []
                 except KeyExistsError:
                     pass
                 else:
                     loop_for_cas = False
         except NotFoundError:
-            pass
+            queue = []
+        self.released.signal(queue)
         # Clear last_ids
         id_keys = [key for (key,value) in self.last_id.items() if (value==id_int)]
         for key in id_keys:
@@ -187,6 +384,8 @@ class PriorityQueue():
             item = {}
         except NotFoundError:
             item = {}
+        if 'id' in item:
+            self.released.signal(self.get_queue())
         # Clear last_ids
         if 'id' in item:
             id_keys = [key for (key,value) in self.last_id.items() if (value==item['id'])]
@@ -219,30 +418,40 @@ class PriorityQueue():
             pass
     
     @log.log_this()
-    def queue_and_wait(self, priority=False, message=''):
-        lap = get_lap(10)
-        start_lap = lap
-        queued = True
-        wait_for_queue = True
-        while wait_for_queue:
-            queue_position = self.position()
-            if (queue_position == 0):
-            # Item is at the top of the queue
-                wait_for_queue = False
-            elif (queue_position < 0):
-            # Enter item into queue
-                queued = False
-                self.push(priority=priority, message=message)
+    def wait_for_push(self, count=None, timeout=None):
+        '''Blocks until an item is pushed into the queue after the given push
+        count, or until the timeout (s) has passed. Returns the current push
+        count. Call without a count to get the current count. The release
+        listener of this process is registered with the queue, so that other
+        processes signal it when they push an item with a message. Pushes
+        without a message, i.e. by `queue_and_wait`, are only signaled within
+        the pushing process.
+        '''
+        now = time.monotonic()
+        if (self.registered is None) or ((now - self.registered) > self.timeout/2):
+            try:
+                self.cb.upsert(self.l_ID, list(RELEASE_LISTENER), ttl=self.timeout)
+            except TemporaryFailError:
+                pass
             else:
-            # Wait for queue
-                new_lap = get_lap(10)
-                if new_lap > lap:
-                    lap = new_lap
-                    print(" waiting for {:} queue, {:}s".format(self.q_ID, (lap-start_lap)*10))
-                time.sleep(0.01)
-        if lap > start_lap:
-            print(" {:} queue complete, {:}".format(self.q_ID, time.strftime('%c')))
-        return queued
+                self.registered = now
+        return self.released.wait_for_push(count, timeout)
+
+    def _listener(self):
+        '''Returns the address registered by the process that waits for
+        pushes, see `wait_for_push`.
+        '''
+        try:
+            return self.cb.get(self.l_ID).value
+        except NotFoundError:
+            return None
+
+    @log.log_this()
+    def queue_and_wait(self, priority=False, message=''):
+        '''Blocks until this thread's item is at the top of the queue, see
+        `wait_for_queue`.
+        '''
+        return wait_for_queue(self, self.position, message=message, priority=priority)
 
 
 # %% FIFO Queue ===============================================================
@@ -261,6 +470,7 @@ class FIFOQueue():
         authenticator = PasswordAuthenticator(username, password)
         self.cluster.authenticate(authenticator)
         self.cb = self.cluster.open_bucket(bucket)
+        self.released = get_release_notifier(host, bucket, queue_ID)
         # Create id counter (if it does not exist)
         self.c_ID = 'id_counter'
         self.cb.counter(self.c_ID, initial=0)
@@ -283,7 +493,7 @@ class FIFOQueue():
         last_id.
         '''
         id_int = self.cb.counter(self.c_ID).value
-        new_item = {'id':id_int, 'message':message}
+        new_item = {'id':id_int, 'message':message, 'notify':list(RELEASE_LISTENER)}
         try:
             self.cb.queue_push(self.q_ID, new_item, ttl=self.timeout)
         except NotFoundError:
@@ -347,12 +557,15 @@ class FIFOQueue():
                     if index >= 0:
                         queue.pop(index)
                         self.cb.upsert(self.q_ID, queue, cas=cas, ttl=self.timeout)
+                    else:
+                        queue = []
                 except KeyExistsError:
                     pass
                 else:
                     loop_for_cas = False
         except NotFoundError:
-            pass
+            queue = []
+        self.released.signal(queue)
         # Clear last_ids
         id_keys = [key for (key,value) in self.last_id.items() if (value==id_int)]
         for key in id_keys:
@@ -366,6 +579,8 @@ class FIFOQueue():
             item = {}
         except NotFoundError:
             item = {}
+        if 'id' in item:
+            self.released.signal(self.get_queue())
         # Clear last_ids
         if 'id' in item:
             id_keys = [key for (key,value) in self.last_id.items() if (value==item['id'])]
@@ -392,20 +607,9 @@ class FIFOQueue():
     
     @log.log_this()
     def queue_and_wait(self, message=''):
-        queued = True
-        wait_for_queue = True
-        while wait_for_queue:
-            queue_position = self.position()
-            if (queue_position == 0):
-            # Item is at the top of the queue
-                wait_for_queue = False
-            elif (queue_position < 0):
-            # Enter item into queue
-                queued = False
-                self.push(message=message)
-            else:
-            # Wait for queue
-                pass
-        return queued
+        '''Blocks until this thread's item is at the top of the queue, see
+        `wait_for_queue`.
+        '''
+        return wait_for_queue(self, self.position, message=message)
 
 
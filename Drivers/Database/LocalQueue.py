@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-ins for the CouchbaseDB queues, for arbitrating device access on a
+single host or within a single process without a Couchbase server.
+"""
+# %% Modules ==================================================================
+
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+
+# %% Queue State ==============================================================
+
+if sys.platform == 'win32':
+    DEFAULT_ADDRESS = r'\\.\pipe\device_queues'
+else:
+    DEFAULT_ADDRESS = os.path.join(tempfile.gettempdir(), 'device_queues.sock')
+DEFAULT_AUTHKEY = b'device_queues'
+
+ID_COUNTER = itertools.count(1)
+QUEUE_STATES = {} # queue_ID:QueueState
+QUEUE_STATES_LOCK = threading.Lock()
+
+class QueueState():
+    def __init__(self, queue_ID, timeout=50):
+        '''
+        The items of a single queue, ordered from the top of the queue. All
+            methods are threadsafe. Threads waiting for their item to reach
+            the top of the queue block on a condition that is notified
+            whenever the queue changes, so hand-off requires no polling.
+        As with the Couchbase queues, the queue is emptied if it has not been
+            modified or touched within the timeout (s).
+        '''
+        self.queue_ID = queue_ID
+        self.timeout = timeout
+        self.items = []
+        self.pushed = 0
+        self.condition = threading.Condition()
+        self.touched = time.monotonic()
+
+    def _expire(self):
+        if (time.monotonic() - self.touched) > self.timeout:
+            self.items = []
+            self.touched = time.monotonic()
+
+    def _position(self, id_int):
+        for (index, item) in enumerate(self.items):
+            if item['id'] == id_int:
+                return index
+        return -1
+
+    def _changed(self):
+        self.touched = time.monotonic()
+        self.condition.notify_all()
+
+    def push(self, priority=False, message=''):
+        '''
+        Adds an item to the queue and returns its id. Priority items are
+            placed behind the top of the queue and any earlier priority items,
+            ahead of all other items.
+        '''
+        with self.condition:
+            self._expire()
+            item = {'id':next(ID_COUNTER), 'priority':bool(priority), 'message':message}
+            if priority and len(self.items):
+                index = 1
+                while (index < len(self.items)) and self.items[index]['priority']:
+                    index += 1
+                self.items.insert(index, item)
+            else:
+                self.items.append(item)
+            self.pushed += 1
+            self._changed()
+            return item['id']
+
+    def position(self, id_int):
+        with self.condition:
+            self._expire()
+            return self._position(id_int)
+
+    def remove(self, id_int):
+        with self.condition:
+            index = self._position(id_int)
+            if index >= 0:
+                self.items.pop(index)
+            self._changed()
+
+    def pop(self):
+        with self.condition:
+            self._expire()
+            item = self.items.pop(0) if len(self.items) else {}
+            self._changed()
+            return item
+
+    def touch(self):
+        with self.condition:
+            self.touched = time.monotonic()
+
+    def get_queue(self):
+        with self.condition:
+            self._expire()
+            return [dict(item) for item in self.items]
+
+    def wait(self, id_int, timeout=None):
+        '''
+        Blocks until the item is at the top of the queue, is no longer in the
+            queue, or until the timeout (s) has passed. Returns the position
+            of the item.
+        '''
+        start = time.monotonic()
+        with self.condition:
+            while True:
+                self._expire()
+                position = self._position(id_int)
+                if position <= 0:
+                    return position
+                # Wake up in time to expire a stale queue
+                wait = self.touched + self.timeout - time.monotonic()
+                if timeout is not None:
+                    remaining = start + timeout - time.monotonic()
+                    if remaining <= 0:
+                        return position
+                    wait = min(wait, remaining)
+                self.condition.wait(max(wait, 0.01))
+
+    def wait_for_push(self, count=None, timeout=None):
+        '''
+        Blocks until an item is pushed after the given push count, or until
+            the timeout (s) has passed. Returns the current push count, which
+            is returned immediately if no count is given.
+        '''
+        with self.condition:
+            if count is not None:
+                self.condition.wait_for(lambda: self.pushed != count, timeout)
+            return self.pushed
+
+def get_queue_state(queue_ID, timeout=50):
+    '''Returns the state of the queue in this process, creating it if necessary.'''
+    with QUEUE_STATES_LOCK:
+        if not(queue_ID in QUEUE_STATES):
+            QUEUE_STATES[queue_ID] = QueueState(queue_ID, timeout=timeout)
+        return QUEUE_STATES[queue_ID]
+
+
+# %% Queue Server =============================================================
+
+class QueueManager(BaseManager):
+    pass
+QueueManager.register('get_queue_state', callable=get_queue_state)
+
+def serve(address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY):
+    '''
+    Serves the queues of this process to LocalQueue objects in other processes
+        on the same host. Blocks until the process is terminated. The address
+        is a Unix socket path, or a named pipe on Windows.
+    '''
+    if isinstance(address, str) and os.path.exists(address) and (sys.platform != 'win32'):
+        # Remove a stale socket
+        os.remove(address)
+    manager = QueueManager(address=address, authkey=authkey)
+    manager.get_server().serve_forever()
+
+def start_server(address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY):
+    '''
+    Starts a queue server in a child process and returns its manager. Call
+        "shutdown" on the manager to stop the server.
+    '''
+    if isinstance(address, str) and os.path.exists(address) and (sys.platform != 'win32'):
+        os.remove(address)
+    manager = QueueManager(address=address, authkey=authkey)
+    manager.start()
+    return manager
+
+
+# %% Local Queue ==============================================================
+
+class LocalQueue():
+    def __init__(self, queue_ID, address=None, authkey=DEFAULT_AUTHKEY, timeout=50):
+        '''
+        A drop-in replacement for CouchbaseDB.PriorityQueue with the same
+            push, position, remove, pop, get_queue, touch, queue_and_wait and
+            wait_for_push semantics. Each thread of execution enters the queue as a unique
+            item.
+        If an address is given, the queue is shared through the queue server
+            at that address (see "serve"), so that processes on the same host
+            can arbitrate access to their devices. Otherwise the queue is only
+            shared within this process.
+        Use functools.partial to bind an address, i.e. as the queue backend of
+            a state machine:
+            Machine(queue_backend=partial(LocalQueue, address=DEFAULT_ADDRESS))
+        '''
+        self.q_ID = queue_ID
+        self.timeout = int(timeout)
+        if address is None:
+            self.state = get_queue_state(queue_ID, timeout=self.timeout)
+        else:
+            manager = QueueManager(address=address, authkey=authkey)
+            manager.connect()
+            self.state = manager.get_queue_state(queue_ID, self.timeout)
+        self.last_id = {}
+
+    def push(self, priority=False, message='', remove_old_id=False):
+        '''Set the "remove_old_id" keyword to True if other interpreter
+        sessions are liable to remove queue items entered by the current
+        session. Old thread identifiers will be removed from the "local"
+        last_id.
+        '''
+        id_int = self.state.push(priority, message)
+        # Clean up old thread identifiers
+        if remove_old_id:
+            current_id_ints = [item['id'] for item in self.get_queue()]
+            id_keys = [key for (key, value) in self.last_id.items() if not(value in current_id_ints)]
+            for key in id_keys:
+                self.last_id.pop(key)
+        # Return the new item's id
+        self.last_id[threading.get_ident()] = id_int
+        return id_int
+
+    def _id(self, id_int):
+        if id_int is None:
+            id_int = self.last_id.get(threading.get_ident(), -1)
+        return id_int
+
+    def position(self, id_int=None):
+        return self.state.position(self._id(id_int))
+
+    def remove(self, id_int=None):
+        id_int = self._id(id_int)
+        self.state.remove(id_int)
+        # Clear last_ids
+        id_keys = [key for (key,value) in self.last_id.items() if (value==id_int)]
+        for key in id_keys:
+            self.last_id.pop(key)
+
+    def pop(self):
+        item = self.state.pop()
+        # Clear last_ids
+        if 'id' in item:
+            id_keys = [key for (key,value) in self.last_id.items() if (value==item['id'])]
+            for key in id_keys:
+                self.last_id.pop(key)
+        return item
+
+    def get_queue(self):
+        return self.state.get_queue()
+
+    def touch(self):
+        self.state.touch()
+
+    def wait_for_push(self, count=None, timeout=None):
+        '''
+        Blocks until an item is pushed into the queue after the given push
+            count, or until the timeout (s) has passed. Returns the current
+            push count. Call without a count to get the current count.
+        '''
+        return self.state.wait_for_push(count, timeout)
+
+    def queue_and_wait(self, priority=False, message=''):
+        '''
+        Blocks until this thread's item is at the top of the queue, pushing a
+            new item if it is not in the queue. Returns False if a new item
+            had to be pushed.
+        '''
+        queued = True
+        while True:
+            if self.state.wait(self._id(None)) == 0:
+                return queued
+            # Enter item into queue
+            queued = False
+            self.push(priority=priority, message=message)
@@ -7,18 +7,48 @@ Created on Sun Nov 12 12:00:00 2017
 # %% Modules ==================================================================
 
 import pymongo
+import pymongo.errors
+import bson
+import bson.errors
+import bson.json_util
+from bson.binary import Binary, USER_DEFINED_SUBTYPE
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
+import numpy as np
 import datetime
 import logging
+import logging.handlers
 import copy
+import gzip
+import json
+import os
+import re
+import struct
+import time
+import zlib
+import queue
+import socket
+import atexit
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # %% Sync Mongo
 
-def sync_to_local_buffer(local_client, remote_client, database, sync_stop_time=None):
+SYNC_BATCH_SIZE = 1000 # documents per insert_many
+SYNC_MAX_WORKERS = 8 # concurrent collection syncs
+SYNC_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+DUPLICATE_KEY_ERROR = 11000
+
+def sync_to_local_buffer(local_client, remote_client, database, sync_stop_time=None, batch_size=SYNC_BATCH_SIZE):
     '''
     Update a local record with new entries from remote
     '''
     local = DatabaseMaster(local_client, database)
-    remote = DatabaseRead(remote_client, database)
+    remote = DatabaseRead(remote_client, database, decode_arrays=False)
 
     # Get Start Time
     cursor = local.read_buffer(number_of_documents=0, sort_ascending=False) # return newest entry first
@@ -29,27 +59,16 @@ def sync_to_local_buffer(local_client, remote_client, database, sync_stop_time=N
         sync_start_time = None
 
     # Sync
-    cursor = remote.read_buffer(number_of_documents=0, sort_ascending=True)
-    for doc in cursor:
-        timestamp = doc['_timestamp']
-        if sync_start_time and sync_stop_time:
-            if (timestamp > sync_start_time) and (timestamp <= sync_stop_time):
-                local.write_document_to_buffer(doc)
-        elif sync_start_time:
-            if timestamp > sync_start_time:
-                local.write_document_to_buffer(doc)
-        elif sync_stop_time:
-            if timestamp <= sync_stop_time:
-                local.write_document_to_buffer(doc)
-        else:
-            local.write_document_to_buffer(doc)
+    cursor = remote.read_buffer(start=sync_start_time, stop=sync_stop_time, number_of_documents=0, sort_ascending=True)
+    cursor.batch_size(batch_size)
+    return local.write_documents_to_buffer(cursor, batch_size=batch_size, keep_id=True)
 
-def sync_to_local_record(local_client, remote_client, database, sync_stop_time=None):
+def sync_to_local_record(local_client, remote_client, database, sync_stop_time=None, batch_size=SYNC_BATCH_SIZE):
     '''
     Update a local record with new entries from remote
     '''
     local = DatabaseMaster(local_client, database)
-    remote = DatabaseRead(remote_client, database)
+    remote = DatabaseRead(remote_client, database, decode_arrays=False)
 
     # Get Start Time
     cursor = local.read_record(sort_ascending=False) # return newest entry first
@@ -61,10 +80,10 @@ def sync_to_local_record(local_client, remote_client, database, sync_stop_time=N
 
     # Sync
     cursor = remote.read_record(start=sync_start_time, stop=sync_stop_time)
-    for doc in cursor:
-        local.write_document_to_record(doc)
+    cursor.batch_size(batch_size)
+    return local.write_documents_to_record(cursor, batch_size=batch_size, keep_id=True)
 
-def sync_to_local_log(local_client, remote_client, database, sync_stop_time=None):
+def sync_to_local_log(local_client, remote_client, database, sync_stop_time=None, batch_size=SYNC_BATCH_SIZE):
     '''
     Update a local log with new entries from remote
     '''
@@ -81,26 +100,853 @@ def sync_to_local_log(local_client, remote_client, database, sync_stop_time=None
 
     # Sync
     cursor = remote.read_log(start=sync_start_time, stop=sync_stop_time, log_level=logging.DEBUG)
-    for doc in cursor:
-        local.write_document_to_log(doc)
+    cursor.batch_size(batch_size)
+    return local.write_documents_to_log(cursor, batch_size=batch_size, keep_id=True)
+
+def sync_to_local(local_client, remote_client, records=None, buffers=None, logs=None, sync_stop_time=None, batch_size=SYNC_BATCH_SIZE, max_workers=SYNC_MAX_WORKERS, checkpoint_file=None):
+    '''
+    Concurrently syncs many record, buffer, and log databases from remote to
+        local. Each database is synced by one of a bounded pool of worker
+        threads, all of which share the given clients' connection pools.
+        Progress is logged at the INFO level as each database completes.
+    If a checkpoint file is given, the names of completed databases are saved
+        to it as the sync progresses. An interrupted sync that is restarted
+        with the same checkpoint file resumes with the original stop time and
+        skips the completed databases. The checkpoint file is removed once
+        every database has been synced. Returns a dictionary of the number of
+        documents inserted into each database.
+
+    *args
+    local_client: a MongoClient object connected to the local server
+    remote_client: a MongoClient object connected to the remote server
+
+    **kwargs
+    records: list of str, databases whose record should be synced
+    buffers: list of str, databases whose buffer should be synced
+    logs: list of str, databases whose log should be synced
+    sync_stop_time: a datetime.datetime instance, the end of the sync period.
+        Defaults to the current time.
+    batch_size: int, the maximum number of documents per insert.
+    max_workers: int, the maximum number of concurrent syncs.
+    checkpoint_file: str, path to the checkpoint file.
+    '''
+    logger = logging.getLogger(__name__)
+    records = ([] if (records is None) else records)
+    buffers = ([] if (buffers is None) else buffers)
+    logs = ([] if (logs is None) else logs)
+    sync_start_time = datetime.datetime.utcnow()
+    if sync_stop_time is None:
+        sync_stop_time = sync_start_time
+# Resume from checkpoint
+    completed = []
+    if (checkpoint_file is not None) and os.path.exists(checkpoint_file):
+        with open(checkpoint_file, 'r') as f:
+            checkpoint = json.load(f)
+        sync_stop_time = datetime.datetime.strptime(checkpoint['sync_stop_time'], SYNC_TIME_FORMAT)
+        completed = checkpoint['completed']
+        logger.info('Resuming sync, {:} complete, Stop Time = {:}'.format(len(completed), sync_stop_time))
+    checkpoint_lock = threading.Lock()
+    def save_checkpoint():
+        if checkpoint_file is not None:
+            with open(checkpoint_file, 'w') as f:
+                json.dump({'sync_stop_time':sync_stop_time.strftime(SYNC_TIME_FORMAT),
+                           'completed':completed}, f)
+# Tasks
+    sync_functions = {'record':sync_to_local_record,
+                      'buffer':sync_to_local_buffer,
+                      'log':sync_to_local_log}
+    tasks = [('record', database) for database in records] \
+        + [('buffer', database) for database in buffers] \
+        + [('log', database) for database in logs]
+    tasks = [task for task in tasks if not('{:}:{:}'.format(*task) in completed)]
+    total = len(completed) + len(tasks)
+    save_checkpoint()
+# Sync
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for (kind, database) in tasks:
+            future = executor.submit(sync_functions[kind], local_client, remote_client, database, sync_stop_time=sync_stop_time, batch_size=batch_size)
+            futures[future] = (kind, database)
+        for future in as_completed(futures):
+            (kind, database) = futures[future]
+            task_name = '{:}:{:}'.format(kind, database)
+            results[task_name] = future.result()
+            with checkpoint_lock:
+                completed.append(task_name)
+                save_checkpoint()
+            logger.info('Synced {:}, {:} documents, {:}/{:}, Elapsed Time = {:}'.format(
+                task_name, results[task_name], len(completed), total, datetime.datetime.utcnow()-sync_start_time))
+# Clean up checkpoint
+    if (checkpoint_file is not None) and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    return results
+
+def insert_documents(collection, documents, batch_size=SYNC_BATCH_SIZE, keep_id=False):
+    '''
+    Inserts an iterable of documents into a collection in unordered batches.
+        Documents that already exist in the collection (duplicate "_id"s) are
+        skipped, all other write errors are raised. Returns the number of
+        documents inserted.
+
+    *args
+    collection: a pymongo collection object
+    documents: an iterable of documents, such as a cursor.
+
+    **kwargs
+    batch_size: int, the maximum number of documents sent per insert_many.
+    keep_id: bool, selects to keep or drop the "_id" of the given documents.
+        Keep the "_id" to make repeated inserts of the same documents
+        idempotent.
+    '''
+    inserted = 0
+    batch = []
+    for document in documents:
+        if not keep_id:
+            document = copy.copy(document)
+            document.pop('_id', None)
+        batch.append(document)
+        if len(batch) >= batch_size:
+            inserted += _insert_batch(collection, batch)
+            batch = []
+    if len(batch):
+        inserted += _insert_batch(collection, batch)
+    return inserted
+
+def timestamp_filter(start=None, stop=None):
+    '''
+    Returns a query filter that selects documents with a "_timestamp" in the
+        half open interval (start, stop]. Returns None if neither bound is
+        given.
+    '''
+    if (start is not None) and (stop is not None):
+        ranged_filter = {'_timestamp':{'$gt':start, '$lte':stop}}
+    elif (start is not None):
+        ranged_filter = {'_timestamp':{'$gt':start}}
+    elif (stop is not None):
+        ranged_filter = {'_timestamp':{'$lte':stop}}
+    else:
+        ranged_filter = None
+    return ranged_filter
+
+def _insert_batch(collection, batch):
+    '''
+    A helper function for insert_documents. Inserts a single batch, ignoring
+        duplicate key errors.
+    '''
+    try:
+        result = collection.insert_many(batch, ordered=False)
+    except pymongo.errors.BulkWriteError as bwe:
+        write_errors = bwe.details['writeErrors']
+        if len([error for error in write_errors if error['code'] != DUPLICATE_KEY_ERROR]):
+            raise
+        return bwe.details['nInserted']
+    else:
+        return len(result.inserted_ids)
+
+
+# %% Live Replication =========================================================
+
+REPLICATION_BATCH_SIZE = 1000 # maximum documents per insert_many
+REPLICATION_AWAIT_TIME = 500 # ms, maximum wait for new change events
+REPLICATION_EVENTS = ['insert', 'drop', 'rename', 'dropDatabase']
+SYSTEM_DATABASES = ['admin', 'local', 'config']
+
+def replicate_to_local(local_client, remote_client, database_names=None, resume_token_file=None, stop_event=None, batch_size=REPLICATION_BATCH_SIZE):
+    '''
+    Continuously mirrors inserts on the remote server into the local server
+        by following a change stream. This requires the remote server to run
+        as a replica set (a single node replica set is sufficient) of MongoDB
+        4.2 or later. New documents are inserted locally, in batches, as soon
+        as they are available.
+    The change stream's resume token is saved to the resume token file once
+        the events it covers have been applied locally. If the replicator is
+        restarted with the same file, it resumes from the saved token.
+        Documents keep their remote "_id", so replaying a batch after an
+        interruption does not create duplicates. Without a saved token, the
+        change stream is opened and the existing documents are then
+        backfilled with sync_to_local, so that nothing written before or
+        during the backfill is missed.
+    Local buffers and logs are initialized with DatabaseMaster and LogMaster
+        before their first insert, so they have the same capped sizes and
+        indexes as those created by the control scripts. Remote drops and
+        renames are logged and the affected collections are initialized again
+        before their next insert, but local documents are never deleted. If
+        the change stream is invalidated it is reopened after the
+        invalidating event.
+    This function blocks until the stop event is set.
+
+    *args
+    local_client: a MongoClient object connected to the local server
+    remote_client: a MongoClient object connected to the remote server
+
+    **kwargs
+    database_names: list of str, the names of the mongoDB databases to mirror,
+        i.e. "mll_fR". All non-system databases are mirrored if unspecified.
+    resume_token_file: str, path to the resume token file.
+    stop_event: a threading.Event object that stops replication when set.
+    batch_size: int, the maximum number of documents per insert.
+    '''
+    logger = logging.getLogger(__name__)
+# Change stream filter
+    if database_names is None:
+        ns_filter = {'$nin':SYSTEM_DATABASES}
+    else:
+        ns_filter = {'$in':list(database_names)}
+    pipeline = [{'$match':{'$or':[
+        {'operationType':{'$in':REPLICATION_EVENTS}, 'ns.db':ns_filter},
+        {'operationType':'invalidate'}]}}]
+# Resume token
+    resume_token = None
+    if (resume_token_file is not None) and os.path.exists(resume_token_file):
+        with open(resume_token_file, 'r') as f:
+            resume_token = bson.json_util.loads(f.read())
+    def save_resume_token(token):
+        if (resume_token_file is not None) and (token is not None):
+            with open(resume_token_file, 'w') as f:
+                f.write(bson.json_util.dumps(token))
+    def stopped():
+        return (stop_event is not None) and stop_event.is_set()
+# Replicate
+    backfill = (resume_token is None)
+    initialized = set()
+    while not(stopped()):
+        # "start_after" also resumes after an invalidate event
+        with remote_client.client.watch(pipeline, start_after=resume_token, max_await_time_ms=REPLICATION_AWAIT_TIME) as stream:
+            if backfill:
+                # The stream is opened first so that it covers the backfill
+                logger.info('No resume token, backfilling from remote')
+                _backfill_to_local(local_client, remote_client, database_names, batch_size)
+                backfill = False
+            invalidated = False
+            while not(stopped() or invalidated):
+                # Collect the available inserts, up to the next other event
+                batch = {}
+                count = 0
+                event = None
+                while count < batch_size:
+                    change = stream.try_next()
+                    if change is None:
+                        break
+                    if change['operationType'] != 'insert':
+                        event = change
+                        break
+                    namespace = (change['ns']['db'], change['ns']['coll'])
+                    if not(namespace in batch):
+                        batch[namespace] = []
+                    batch[namespace].append(change['fullDocument'])
+                    count += 1
+                token = stream.resume_token
+                # Insert into local
+                for (namespace, documents) in batch.items():
+                    if not(namespace in initialized):
+                        _initialize_local_namespace(local_client, *namespace)
+                        initialized.add(namespace)
+                    collection = local_client.client[namespace[0]][namespace[1]]
+                    insert_documents(collection, documents, batch_size=batch_size, keep_id=True)
+                # Apply the event that ended the batch
+                if event is not None:
+                    invalidated = _apply_replication_event(event, initialized)
+                # The token is saved only once its events have been applied
+                if (token is not None) and (token != resume_token):
+                    save_resume_token(token)
+                    resume_token = token
+
+def _apply_replication_event(change, initialized):
+    '''
+    A helper function for replicate_to_local. Handles a change event other
+        than an insert. Dropped and renamed collections are initialized again
+        before their next insert. Returns True if the change stream was
+        invalidated.
+    '''
+    logger = logging.getLogger(__name__)
+    operation = change['operationType']
+    if operation == 'invalidate':
+        logger.warning('Change stream invalidated, reopening')
+        return True
+    database = change['ns']['db']
+    if operation == 'dropDatabase':
+        for namespace in [namespace for namespace in initialized if namespace[0] == database]:
+            initialized.discard(namespace)
+        logger.warning('Remote database {:} dropped, local documents are kept'.format(database))
+    else:
+        namespace = (database, change['ns']['coll'])
+        initialized.discard(namespace)
+        if operation == 'rename':
+            initialized.discard((change['to']['db'], change['to']['coll']))
+        logger.warning('Remote collection {:}.{:} {:}, local documents are kept'.format(
+            namespace[0], namespace[1], 'dropped' if (operation == 'drop') else 'renamed'))
+    return False
+
+def _backfill_to_local(local_client, remote_client, database_names, batch_size):
+    '''
+    A helper function for replicate_to_local. Syncs every record, buffer, and
+        log of the given remote databases to local with sync_to_local.
+    '''
+    if database_names is None:
+        database_names = [name for name in remote_client.client.list_database_names() if not(name in SYSTEM_DATABASES)]
+    paths = {'record':set(), 'buffer':set(), 'log':set()}
+    for database in database_names:
+        for collection in remote_client.client[database].list_collection_names():
+            (path, kind) = _namespace_path(local_client, database, collection)
+            if kind is not None:
+                paths[kind].add(path)
+    return sync_to_local(local_client, remote_client,
+                         records=sorted(paths['record']),
+                         buffers=sorted(paths['buffer']),
+                         logs=sorted(paths['log']),
+                         batch_size=batch_size)
+
+def _namespace_path(mongo_client, database, collection):
+    '''
+    A helper function for replicate_to_local. Returns the path of the
+        database object that owns the given collection, i.e. "mll_fR" or
+        "monitor_DAQ/cavity", and the kind of that collection ("record",
+        "buffer", or "log"). Returns (None, None) for unrelated collections.
+    '''
+    match = PARTITION_PATTERN.search(collection)
+    if match:
+        (prefix, kind) = (collection[:match.start()], 'record')
+    else:
+        for suffix in sorted(mongo_client.COLLECTION_KEYS, key=len, reverse=True):
+            if collection.endswith(suffix):
+                (prefix, kind) = (collection[:-len(suffix)], suffix.split('_')[0])
+                break
+        else:
+            return (None, None)
+    if prefix == '':
+        return (database, kind)
+    elif prefix.endswith('_'):
+        return (database+'/'+prefix[:-1], kind)
+    else:
+        return (None, None)
+
+def _initialize_local_namespace(local_client, database, collection):
+    '''
+    A helper function for replicate_to_local. Initializes the local database
+        object that owns the given collection so that capped collections and
+        indexes are created before the first insert.
+    '''
+    (path, kind) = _namespace_path(local_client, database, collection)
+    if kind == 'log':
+        LogMaster(local_client, path)
+    elif kind is not None:
+        DatabaseMaster(local_client, path)
+        if PARTITION_PATTERN.search(collection):
+            # Partitions are indexed as they are created
+            local_client.client[database][collection].create_index([('_timestamp', pymongo.DESCENDING)])
+
+
+# %% Time Buckets =============================================================
+
+BUCKET_SIZE = 1000 # maximum samples per bucket
+BUCKET_INTERVAL = 3600 # seconds spanned by a bucket
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def bucket_start(timestamp, interval):
+    '''
+    Returns the start time of the bucket interval that contains the given
+        timestamp. Bucket intervals are aligned to the unix epoch.
+    '''
+    seconds = (timestamp - EPOCH).total_seconds()
+    return EPOCH + datetime.timedelta(seconds=(seconds // interval)*interval)
+
+def bucket_projection(projection):
+    '''
+    Converts a find projection into the equivalent aggregation $project
+        stage. This is used to apply projections to documents unwound from
+        time buckets.
+    '''
+    if not isinstance(projection, dict):
+        projection = dict([(key, True) for key in projection])
+    stage = {}
+    for (key, value) in projection.items():
+        if isinstance(value, dict) and ('$slice' in value):
+            args = value['$slice']
+            if not isinstance(args, list):
+                args = [args]
+            stage[key] = {'$slice':['$'+key]+list(args)}
+        else:
+            stage[key] = value
+    return {'$project':stage}
+
+
+# %% Rollups ==================================================================
+
+ROLLUP_RESOLUTIONS = [('1min', 60), ('1h', 3600), ('1d', 86400)] # finest first
+ROLLUP_SERVER_VERSION = (4, 4) # minimum MongoDB version for $merge, $isNumber and $unionWith
+
+def rollup_merge_stages(keys, new):
+    '''
+    Returns the aggregation stages that combine the statistics of a rollup
+        interval with those of a partial interval, i.e. as the "whenMatched"
+        pipeline of a $merge or as an update pipeline. "new" is a function
+        that returns the expression of a field of the partial interval given
+        its dotted path, i.e. "_stats.<key>.sum". The counts, sums and sums
+        of squares are added, the minima and maxima are combined, and the
+        mean and standard deviation are recomputed from the sums. Rollup
+        documents without sums are converted from their mean and deviation.
+    '''
+    def old(path):
+        return {'$ifNull':['$'+path, 0]}
+    combine = {
+        '_count':{'$add':[old('_count'), new('_count')]},
+        '_timestamp_max':{'$max':['$_timestamp_max', new('_timestamp_max')]}}
+    finish = {}
+    for key in keys:
+        stats = '_stats.'+key+'.'
+        (count, mean, std) = (old(stats+'count'), old(key), old(stats+'std'))
+        combine[stats+'count'] = {'$add':[count, new(stats+'count')]}
+        combine[stats+'sum'] = {'$add':[
+            {'$ifNull':['$'+stats+'sum', {'$multiply':[mean, count]}]},
+            new(stats+'sum')]}
+        combine[stats+'sum_sq'] = {'$add':[
+            {'$ifNull':['$'+stats+'sum_sq', {'$multiply':[count, {'$add':[{'$multiply':[std, std]}, {'$multiply':[mean, mean]}]}]}]},
+            new(stats+'sum_sq')]}
+        combine[stats+'min'] = {'$min':['$'+stats+'min', new(stats+'min')]}
+        combine[stats+'max'] = {'$max':['$'+stats+'max', new(stats+'max')]}
+        (count, total, total_sq) = ('$'+stats+'count', '$'+stats+'sum', '$'+stats+'sum_sq')
+        mean = {'$divide':[total, count]}
+        finish[key] = {'$cond':[{'$gt':[count, 0]}, mean, None]}
+        finish[stats+'std'] = {'$cond':[{'$gt':[count, 0]},
+            {'$sqrt':{'$max':[0, {'$subtract':[{'$divide':[total_sq, count]}, {'$multiply':[mean, mean]}]}]}},
+            None]}
+    return [{'$set':combine}, {'$set':finish}]
+
+def rollup_partial(document, keys):
+    '''
+    Returns the statistics of a single document as a partial rollup
+        interval, keyed by the dotted paths used by rollup_merge_stages.
+    '''
+    partial = {'_count':1, '_timestamp_max':document['_timestamp']}
+    for key in keys:
+        stats = '_stats.'+key+'.'
+        value = document.get(key)
+        if isinstance(value, (int, float)) and not(isinstance(value, bool)):
+            partial.update({stats+'count':1, stats+'sum':value, stats+'sum_sq':value*value,
+                            stats+'min':value, stats+'max':value})
+        else:
+            partial.update({stats+'count':0, stats+'sum':0, stats+'sum_sq':0,
+                            stats+'min':None, stats+'max':None})
+    return partial
+
+def start_rollup_compactor(database, interval=60., keys=None):
+    '''
+    Starts a daemon thread that periodically updates the rollups of a
+        DatabaseMaster object. Returns the thread and a threading.Event
+        object that stops the thread when set.
+
+    *args
+    database: a DatabaseMaster object
+
+    **kwargs
+    interval: float, the time in seconds between updates.
+    keys: list of str, the keys to roll up. See DatabaseMaster.update_rollups
+    '''
+    database.check_server_version(ROLLUP_SERVER_VERSION, 'Rollups')
+    stop_event = threading.Event()
+    def compact():
+        while not(stop_event.is_set()):
+            try:
+                database.update_rollups(keys=keys)
+            except pymongo.errors.PyMongoError:
+                logging.getLogger(__name__).exception('Rollup update failed for {:}'.format(database.database_name+'/'+database.collection_name))
+            stop_event.wait(interval)
+    thread = threading.Thread(target=compact, name='rollup_compactor', daemon=True)
+    thread.start()
+    return (thread, stop_event)
+
+
+# %% Array Encoding ===========================================================
+
+ARRAY_SUBTYPE = USER_DEFINED_SUBTYPE # BSON binary subtype of array blobs
+ARRAY_DELTA = 0x01 # header flags
+ARRAY_ZLIB = 0x02
+ARRAY_ZSTD = 0x04
+
+def encode_array(array, dtype=None, compression=None, delta=False):
+    '''
+    Returns a numpy array encoded as a BSON binary blob. A blob starts with a
+        small header (flags, dtype, shape), followed by the raw array data.
+        The data may be delta encoded and compressed with zlib or zstd.
+    Delta encoding takes the difference of consecutive elements of the
+        unsigned integer view of the data. This is lossless for any dtype and
+        makes slowly varying data much more compressible.
+    Blobs are decoded back into numpy arrays by the ArrayDecoder when read.
+
+    *args
+    array: a numpy array
+
+    **kwargs
+    dtype: the dtype stored in the database, i.e. "float32". The dtype of the
+        array is kept if unspecified.
+    compression: None, "zlib", or "zstd". zstd requires the zstandard package.
+    delta: bool, selects to delta encode the array data before compression.
+    '''
+    array = np.ascontiguousarray(array, dtype=dtype)
+    flags = 0
+    data = array.reshape(-1)
+    if delta and (data.size > 1) and (data.dtype.itemsize in [1, 2, 4, 8]):
+        flags |= ARRAY_DELTA
+        view = data.view('<u{:}'.format(data.dtype.itemsize))
+        data = np.concatenate((view[:1], np.diff(view)))
+    data = data.tobytes()
+    if compression == 'zlib':
+        flags |= ARRAY_ZLIB
+        data = zlib.compress(data)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd compression requires the zstandard package')
+        flags |= ARRAY_ZSTD
+        data = zstandard.ZstdCompressor().compress(data)
+    elif compression is not None:
+        raise ValueError('unknown compression {:}'.format(compression))
+    dtype_str = array.dtype.str.encode()
+    header = struct.pack('<BB', flags, len(dtype_str)) + dtype_str
+    header += struct.pack('<B{:}Q'.format(array.ndim), array.ndim, *array.shape)
+    return Binary(header+data, ARRAY_SUBTYPE)
+
+def decode_array(blob):
+    '''Returns the numpy array stored in a blob created by encode_array.'''
+    (flags, dtype_length) = struct.unpack_from('<BB', blob, 0)
+    dtype = np.dtype(bytes(blob[2:2+dtype_length]).decode())
+    offset = 2+dtype_length
+    ndim = struct.unpack_from('<B', blob, offset)[0]
+    shape = struct.unpack_from('<{:}Q'.format(ndim), blob, offset+1)
+    data = bytes(blob[offset+1+8*ndim:])
+    if flags & ARRAY_ZLIB:
+        data = zlib.decompress(data)
+    elif flags & ARRAY_ZSTD:
+        if zstandard is None:
+            raise ImportError('zstd compressed arrays require the zstandard package')
+        data = zstandard.ZstdDecompressor().decompress(data)
+    if flags & ARRAY_DELTA:
+        view = np.frombuffer(data, dtype='<u{:}'.format(dtype.itemsize))
+        array = np.cumsum(view, dtype=view.dtype).view(dtype)
+    else:
+        array = np.frombuffer(data, dtype=dtype).copy()
+    return array.reshape(shape)
+
+def encode_arrays(document, **kwargs):
+    '''
+    Returns a copy of the document with all numpy arrays, including those in
+        nested dictionaries, replaced by binary blobs. Keyword arguments are
+        passed to encode_array.
+    '''
+    encoded = {}
+    for (key, value) in document.items():
+        if isinstance(value, np.ndarray):
+            value = encode_array(value, **kwargs)
+        elif isinstance(value, dict):
+            value = encode_arrays(value, **kwargs)
+        encoded[key] = value
+    return encoded
+
+class ArrayDecoder(TypeDecoder):
+    '''Decodes binary blobs created by encode_array into numpy arrays.'''
+    bson_type = Binary
+    def transform_bson(self, value):
+        if value.subtype == ARRAY_SUBTYPE:
+            return decode_array(value)
+        return value
+
+ARRAY_CODEC_OPTIONS = CodecOptions(type_registry=TypeRegistry([ArrayDecoder()]))
+
+
+# %% Partitions ===============================================================
+
+PARTITION_FORMAT = 'record_%Y_%m' # suffix of the monthly record partitions
+PARTITION_PATTERN = re.compile(r'record_(\d{4})_(\d{2})$')
+PARTITION_CACHE_TIME = 10 # seconds between listings of the partitions
+COLLECTION_NAMES = weakref.WeakKeyDictionary() # client:{database name:(time listed, names)}
+COLLECTION_NAMES_LOCK = threading.Lock()
+
+def list_collection_names(database, max_age=PARTITION_CACHE_TIME):
+    '''
+    Returns the collection names of the database. The names are listed at
+        most once every "max_age" seconds per database and client, so that
+        handlers may be constructed without a round trip to the server each
+        time. Collections created by other processes may not be listed until
+        the listing is refreshed.
+    '''
+    with COLLECTION_NAMES_LOCK:
+        listings = COLLECTION_NAMES.setdefault(database.client, {})
+        (listed, names) = listings.get(database.name, (0, None))
+    if (names is None) or ((time.time() - listed) > max_age):
+        names = database.list_collection_names()
+        with COLLECTION_NAMES_LOCK:
+            COLLECTION_NAMES[database.client][database.name] = (time.time(), names)
+    return names
+
+def forget_collection_names(database):
+    '''
+    Clears the cached collection names of the database, i.e. after creating
+        or dropping collections.
+    '''
+    with COLLECTION_NAMES_LOCK:
+        COLLECTION_NAMES.get(database.client, {}).pop(database.name, None)
+
+def partition_start(timestamp):
+    '''Returns the start of the month that contains the given timestamp.'''
+    return datetime.datetime(timestamp.year, timestamp.month, 1)
+
+def partition_stop(timestamp):
+    '''Returns the start of the month after the one that contains the given
+    timestamp.
+    '''
+    return (partition_start(timestamp) + datetime.timedelta(days=32)).replace(day=1)
+
+def read_archive(path, codec_options=ARRAY_CODEC_OPTIONS):
+    '''
+    Returns an iterator over the documents of a record partition archived by
+        DatabaseMaster.archive_partitions, in ascending time order.
+    '''
+    with gzip.open(path, 'rb') as f:
+        for document in bson.decode_file_iter(f, codec_options=codec_options):
+            yield document
+
+class PartitionCursor():
+    def __init__(self, queries, limit=0):
+        '''
+        Chains the cursors of several record partitions into a single iterable
+            cursor. Each query is a function that returns a cursor given a
+            document limit. A query is only run once the cursor of the
+            previous one is exhausted, and the document limit applies to the
+            total number of documents.
+        '''
+        self.queries = list(queries)
+        self.limit = limit
+        self.count = 0
+        self.alive = True
+        self._batch_size = None
+        self._cursor = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self.alive:
+            if self._cursor is None:
+                if not(len(self.queries)) or (self.limit and (self.count >= self.limit)):
+                    self.alive = False
+                    break
+                self._cursor = self.queries.pop(0)((self.limit - self.count) if self.limit else 0)
+                if self._batch_size is not None:
+                    self._cursor.batch_size(self._batch_size)
+            try:
+                document = next(self._cursor)
+            except StopIteration:
+                self._cursor = None
+            else:
+                self.count += 1
+                return document
+        raise StopIteration
+
+    def next(self):
+        return self.__next__()
+
+    def batch_size(self, batch_size):
+        self._batch_size = batch_size
+        if self._cursor is not None:
+            self._cursor.batch_size(batch_size)
+        return self
+
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+        self.queries = []
+        self.alive = False
+
+
+# %% Write Behind Queue =======================================================
+
+class WriteBehindQueue():
+    def __init__(self, max_queue_size=10000, batch_size=1000, flush_interval=0.1):
+        '''
+        A background writer that batches database writes. Write requests are
+            placed in a bounded queue and written by a single daemon thread
+            with one ordered bulk_write per collection and batch. This
+            decouples the caller from the database latency. One queue may be
+            shared by many DatabaseReadWrite objects, see
+            DatabaseReadWrite.enable_write_behind.
+        If the queue is full, calls to "put" block until there is room
+            (back-pressure). All queued writes are flushed when "close" is
+            called, which is automatically registered to run at interpreter
+            exit. Requests can not be queued once the writer is closed.
+        Failed writes are logged and counted as errors in the metrics, and the
+            writer carries on with the next batch. If a request can not be
+            encoded, i.e. it contains a numpy array, the requests of its batch
+            are retried one at a time so that only the invalid request is
+            dropped.
+
+        **kwargs
+        max_queue_size: int, the maximum number of queued write requests.
+        batch_size: int, the maximum number of requests written per batch.
+        flush_interval: float, the maximum time in seconds that the writer
+            waits for new requests before checking for shutdown.
+        '''
+        self.queue = queue.Queue(maxsize=int(max_queue_size))
+        self.batch_size = int(batch_size)
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.closed = False
+        self._stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='mongo_write_behind', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def put(self, collection, request):
+        '''
+        Queues a pymongo write request (InsertOne, UpdateOne, ...) for the
+            given collection. Blocks if the queue is full. Raises a
+            RuntimeError if the writer has been closed.
+        '''
+        if self.closed or not(self.thread.is_alive()):
+            raise RuntimeError('The write behind queue is closed')
+        self.queue.put((collection, request, time.time()))
+
+    def flush(self):
+        '''Blocks until all queued requests have been written.'''
+        self.queue.join()
+
+    def close(self):
+        '''Flushes all queued requests and stops the writer thread.'''
+        self.closed = True
+        if self.thread.is_alive():
+            self._stop_event.set()
+            self.thread.join()
+
+    def get_metrics(self):
+        '''
+        Returns the write metrics of each collection, keyed by the full
+            collection name::
+
+                {<collection>:{
+                    'written':<number of requests written>,
+                    'batches':<number of bulk writes>,
+                    'errors':<number of failed writes>,
+                    'latency_mean':<mean seconds from queueing to written>,
+                    'latency_max':<maximum seconds from queueing to written>},
+                 ...}
+
+        The current number of queued requests is given under "queue_size".
+        '''
+        with self.lock:
+            metrics = copy.deepcopy(self.metrics)
+        metrics['queue_size'] = self.queue.qsize()
+        return metrics
+
+    def _run(self):
+        while True:
+            items = []
+            try:
+                items.append(self.queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                if self._stop_event.is_set():
+                    break
+                continue
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(items)
+            except Exception:
+                # Keep the writer alive
+                logging.getLogger(__name__).exception('Write behind failed')
+            finally:
+                for item in items:
+                    self.queue.task_done()
+
+    def _write(self, items):
+    # Group requests by collection, preserving order
+        groups = {}
+        for (collection, request, queued_time) in items:
+            if not(collection.full_name in groups):
+                groups[collection.full_name] = (collection, [], [])
+            groups[collection.full_name][1].append(request)
+            groups[collection.full_name][2].append(queued_time)
+    # Write each group
+        for (name, (collection, requests, queued_times)) in groups.items():
+            errors = 0
+            try:
+                collection.bulk_write(requests, ordered=True)
+            except bson.errors.InvalidDocument:
+                # Retry the batch without the requests that can not be encoded
+                logging.getLogger(__name__).exception('Write behind could not encode a request for {:}'.format(name))
+                written = []
+                for (request, queued_time) in zip(requests, queued_times):
+                    try:
+                        collection.bulk_write([request])
+                    except Exception:
+                        errors += 1
+                    else:
+                        written.append(queued_time)
+                queued_times = written
+            except Exception:
+                errors = 1
+                queued_times = []
+                logging.getLogger(__name__).exception('Write behind failed for {:}'.format(name))
+            now = time.time()
+            latencies = [now - queued_time for queued_time in queued_times]
+            with self.lock:
+                if not(name in self.metrics):
+                    self.metrics[name] = {'written':0, 'batches':0, 'errors':0,
+                                          'latency_mean':0., 'latency_max':0.}
+                metrics = self.metrics[name]
+                metrics['errors'] += errors
+                if len(latencies):
+                    written = metrics['written'] + len(latencies)
+                    metrics['latency_mean'] = (metrics['latency_mean']*metrics['written'] + sum(latencies))/written
+                    metrics['latency_max'] = max([metrics['latency_max']] + latencies)
+                    metrics['written'] = written
+                    metrics['batches'] += 1
 
 
 # %% Renewable Cursor =========================================================
 class Cursor():
     def __init__(self, database):
         self.database = database
-        self._cursor = self.database.read_buffer(tailable_cursor=True,
-                                                 no_cursor_timeout=True)
-        self.exhaust_cursor()
+        self.new_cursor()
 
     def read(self):
         '''Returns cursor object that automatically renews itself when it dies.'''
         if not self._cursor.alive:
-            self._cursor = self.database.read_buffer(tailable_cursor=True,
-                                                     no_cursor_timeout=True)
-            self.exhaust_cursor()
+            self.new_cursor()
         return self._cursor
 
+    def is_alive(self):
+        '''Returns if the current tailable cursor is alive.'''
+        return self._cursor.alive
+
+    def new_cursor(self):
+        '''Creates a new tailable cursor positioned at the end of the buffer.
+        The newest document is found with a reverse natural order query, and
+        the cursor is filtered to documents whose "_id" was generated no
+        earlier than the second of that document's "_id". The buffer is not
+        counted or skipped through, and only the documents of that second are
+        transferred. They include the newest document, so the tailable cursor
+        initially returns a result and remains alive. Every later document
+        passes the filter regardless of its "_timestamp". An empty buffer
+        gives an unfiltered cursor, which is renewed on the next read.
+        '''
+        newest = self.database.buffer.find_one(
+                sort=[('$natural', pymongo.DESCENDING)],
+                projection={'_id':True})
+        if newest is None:
+            cursor_filter = None
+        else:
+            # "_id" values are generated by the writers, so only their second
+            # orders documents written by different processes
+            cursor_filter = {'_id':{'$gte':bson.ObjectId.from_datetime(newest['_id'].generation_time)}}
+        self._cursor = self.database.buffer.find(
+                cursor_filter,
+                sort=[('$natural', pymongo.ASCENDING)],
+                cursor_type=pymongo.cursor.CursorType.TAILABLE,
+                no_cursor_timeout=True)
+        self.exhaust_cursor()
 
     # Exhaust a MongoDB Cursor to Queue up the Most Recent Values -------------
     def exhaust_cursor(self):
@@ -113,34 +959,172 @@ class Cursor():
 
 # %% MongoClient ==============================================================
 
+CLIENT_REGISTRY = {} # (process id, host, port, backend):[pymongo.MongoClient, references]
+CLIENT_REGISTRY_LOCK = threading.Lock()
+
 class MongoClient:
-    def __init__(self, host='localhost', port=27017):
+    def __init__(self, host='localhost', port=27017, backend=None):
         '''
         Connects to a mongoDB client, which can then be used to access different
             databases and collections.
+        All MongoClient objects in a process that connect to the same host,
+            port and backend share a single pymongo client and connection pool
+            (see CLIENT_REGISTRY). The pymongo client is closed once every
+            MongoClient that shares it has been closed.
         The "keys" list the hardcoded names of the collections and of the keys
             needed to access records in the documents (documents are returned
             as dictionaries). Items in the record and buffer only contain the
             '_id' and '_timestamp' key by default. The user specifies the other
             keys with the input dictionary. Logs contain all 4 hardcoded
             document keys.
+
+        **kwargs
+        host: str, the host name of the mongoDB server.
+        port: int, the port of the mongoDB server.
+        backend: a callable that returns a pymongo.MongoClient compatible
+            client given the host and port. The default connects to a mongoDB
+            server with pymongo. Use MongoMemory.MemoryClient to keep all
+            databases in the memory of the current process.
         '''
         # Connect to the mongoDB client
-        self.client = pymongo.MongoClient(host=host, port=port, maxPoolSize=None)
-        self.COLLECTION_KEYS = ['record', 'buffer', 'log', 'log_buffer']
+        if backend is None:
+            backend = pymongo.MongoClient
+        self.registry_key = (os.getpid(), host, port, backend)
+        with CLIENT_REGISTRY_LOCK:
+            if not(self.registry_key in CLIENT_REGISTRY):
+                CLIENT_REGISTRY[self.registry_key] = [backend(host=host, port=port, maxPoolSize=None), 0]
+            CLIENT_REGISTRY[self.registry_key][1] += 1
+            self.client = CLIENT_REGISTRY[self.registry_key][0]
+        self.closed = False
+        self.COLLECTION_KEYS = ['record', 'buffer', 'log', 'log_buffer', 'record_bucket']
         self.DOCUMENT_KEYS = ['_id', 'entry', '_timestamp', 'log_level']
 
     def close(self):
         '''
-        Closes the connection to the mongoDB. Any subsequent calls to the client
-            will restart the connection.
+        Releases this object's reference to the shared connection to the
+            mongoDB. The connection is closed once all references within the
+            process have been released. Any subsequent calls to the client will
+            restart the connection.
+        '''
+        with CLIENT_REGISTRY_LOCK:
+            if self.closed:
+                return
+            self.closed = True
+            if self.registry_key in CLIENT_REGISTRY:
+                CLIENT_REGISTRY[self.registry_key][1] -= 1
+                if CLIENT_REGISTRY[self.registry_key][1] <= 0:
+                    CLIENT_REGISTRY.pop(self.registry_key)
+                    self.client.close()
+
+# %% Heartbeat ================================================================
+
+HEARTBEAT_DATABASE = 'heartbeat'
+HEARTBEAT_COLLECTION = 'processes'
+
+class Heartbeat():
+    def __init__(self, mongo_client, name, interval=5., ttl=None):
         '''
-        self.client.close()
+        Publishes the liveness of a process as a single document, identified
+            by the process name, in the HEARTBEAT_DATABASE. A daemon thread
+            replaces the document once per interval, so the cost of liveness
+            is one small write per process regardless of how many state
+            machines or loops the process runs. Additional status, such as the
+            current states of a state machine, is attached with "update" and
+            published with the next beat.
+        The heartbeat field is indexed with a TTL, so that the documents of
+            processes that stop beating are eventually removed by the mongoDB.
+            Use read_heartbeats to check the liveness of processes.
+
+        **kwargs
+        mongo_client: MongoClient, the client to publish to.
+        name: str, the name of the process.
+        interval: float, the number of seconds between beats.
+        ttl: float, the number of seconds after the last beat after which the
+            document expires. The default is 3 intervals. The mongoDB removes
+            expired documents about once per minute.
+        '''
+        self.name = name
+        self.interval = interval
+        if ttl is None:
+            ttl = 3*interval
+        self.collection = mongo_client.client[HEARTBEAT_DATABASE][HEARTBEAT_COLLECTION]
+        try:
+            self.collection.create_index('heartbeat', expireAfterSeconds=int(max(ttl, 1)))
+        except pymongo.errors.OperationFailure:
+            # An index with a different TTL already exists
+            pass
+        self.status = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def update(self, **status):
+        '''Updates the status that is published with the next beat.'''
+        with self.lock:
+            self.status.update(copy.deepcopy(status))
+
+    def beat(self):
+        '''Publishes the heartbeat document.'''
+        with self.lock:
+            document = copy.deepcopy(self.status)
+        document.update({
+            '_id':self.name,
+            'heartbeat':datetime.datetime.utcnow(),
+            'interval':self.interval,
+            'host':socket.gethostname(),
+            'pid':os.getpid()})
+        self.collection.replace_one({'_id':self.name}, document, upsert=True)
+
+    def _run(self):
+        while not(self.stop_event.is_set()):
+            try:
+                self.beat()
+            except pymongo.errors.PyMongoError:
+                # Missed beats are reflected in the age of the heartbeat
+                pass
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        '''Starts publishing heartbeats in a daemon thread.'''
+        if (self.thread is None) or not(self.thread.is_alive()):
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name='heartbeat', daemon=True)
+            self.thread.start()
+
+    def stop(self, remove=True):
+        '''
+        Stops publishing heartbeats. If "remove" is True the heartbeat document
+            is deleted so that the process is immediately reported as stopped.
+        '''
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        if remove:
+            self.collection.delete_one({'_id':self.name})
+
+def read_heartbeats(mongo_client, names=None, max_age=None):
+    '''
+    Returns the heartbeat documents of the named processes, or of all
+        processes if unspecified, as a dictionary keyed by process name. Each
+        document has an "alive" key, which is True if its last beat is more
+        recent than max_age seconds. The default max_age is 3 intervals of the
+        process' heartbeat.
+    '''
+    collection = mongo_client.client[HEARTBEAT_DATABASE][HEARTBEAT_COLLECTION]
+    query = {} if (names is None) else {'_id':{'$in':list(names)}}
+    now = datetime.datetime.utcnow()
+    heartbeats = {}
+    for document in collection.find(query):
+        age = (now - document['heartbeat']).total_seconds()
+        limit = max_age if (max_age is not None) else 3*document['interval']
+        document['alive'] = (age <= limit)
+        heartbeats[document['_id']] = document
+    return heartbeats
 
 # %% DatabaseRead =============================================================
 
 class DatabaseRead():
-    def __init__(self, mongo_client, database):
+    def __init__(self, mongo_client, database, bucketed=None, decode_arrays=True, partitioned=None):
         '''
         The "read only" handler for the database. This subclass is used to form
             a read only connection to a database, without needing to specify
@@ -157,9 +1141,145 @@ class DatabaseRead():
         mongo_client: a MongoClient object
         database: str, the name of the requested database. Use the '/' separator
             to include multiple collections in a single database file.
+
+        **kwargs
+        bucketed: bool, selects whether the record is stored in time buckets.
+            If unspecified, the record is read from time buckets if the bucket
+            collection exists when it is read. See DatabaseReadWrite for
+            details.
+        decode_arrays: bool, selects whether numpy arrays stored as binary
+            blobs are decoded when read. Disable to copy documents without
+            decoding them. See encode_array for details.
+        partitioned: bool, selects whether the record is stored in monthly
+            partitions. If unspecified, the record is read from partitions if
+            any exist when it is read. See DatabaseReadWrite for details.
         '''
     # Initialize
+        self.decode_arrays = decode_arrays
         self.get_collections(mongo_client, database)
+        # The record format is detected on use unless specified
+        self.bucketed_option = bucketed
+        self.partitioned_option = partitioned
+        self.cache = None
+        self.server_version = None
+
+    @property
+    def bucketed(self):
+        '''
+        Whether the record is stored in time buckets. Unless specified when
+            the handler was created, this is decided on each use from the
+            cached collection listing (see list_collection_names), so that a
+            bucketed record created after the handler is still found.
+        '''
+        if self.bucketed_option is None:
+            return (self.record_bucket.name in list_collection_names(self.database))
+        return bool(self.bucketed_option)
+
+    @property
+    def partitioned(self):
+        '''
+        Whether the record is stored in monthly partitions. Partitioning only
+            applies to unbucketed records. Unless specified when the handler
+            was created, this is decided on each use from the cached
+            collection listing, as with "bucketed".
+        '''
+        if self.bucketed:
+            return False
+        if self.partitioned_option is None:
+            return bool(len(self._list_partitions()[1]))
+        return bool(self.partitioned_option)
+
+    def check_server_version(self, minimum, feature):
+        '''
+        Raises a RuntimeError if the MongoDB server is older than the minimum
+            (major, minor) version required by a feature. The server version
+            is only queried once per handler.
+        '''
+        if self.server_version is None:
+            self.server_version = tuple(self.client.server_info()['versionArray'][:2])
+        if self.server_version < tuple(minimum):
+            raise RuntimeError('{:} require MongoDB {:} or newer, the server is version {:}'.format(
+                feature, '.'.join(map(str, minimum)), '.'.join(map(str, self.server_version))))
+
+    def enable_cache(self, max_staleness=0.1):
+        '''
+        Serves requests for the most recent document in the buffer from a
+            process local cache. Only calls to read_buffer that request a
+            single document with the default sort order, and without any
+            filters or projections, are served from the cache.
+        The cache is fed by a single tailable cursor. A cached document is
+            returned if the cache was refreshed within the last
+            "max_staleness" seconds, otherwise only the documents added since
+            the last refresh are read from the cursor. The cursor follows the
+            natural (insertion) order of the buffer without a timestamp
+            filter, so documents written by other processes are cached
+            whatever their "_timestamp". Documents written to the buffer
+            through this object update the cache immediately. See
+            cache_stats for the hit and miss counters.
+
+        **kwargs
+        max_staleness: float, the maximum age in seconds of a cached document.
+        '''
+        self.cache_lock = threading.Lock()
+        cursor = Cursor(self)
+        self.cache = {
+            'cursor':cursor,
+            'document':self.buffer.find_one(sort=[('$natural', pymongo.DESCENDING)]),
+            'updated':time.time(),
+            'max_staleness':max_staleness,
+            'hits':0,
+            'misses':0}
+
+    def disable_cache(self):
+        '''Stops serving read_buffer requests from the cache.'''
+        self.cache = None
+
+    def cache_stats(self):
+        '''
+        Returns the number of read_buffer requests served from the cache
+            ("hits") and the number that required a database round trip
+            ("misses").
+        '''
+        if self.cache is None:
+            return {'hits':0, 'misses':0}
+        with self.cache_lock:
+            return {'hits':self.cache['hits'], 'misses':self.cache['misses']}
+
+    def _read_cache(self, return_single_timestamp):
+        '''
+        A helper function for read_buffer. Returns the most recent document in
+            the buffer, refreshing the cache if it is stale.
+        '''
+        with self.cache_lock:
+            now = time.time()
+            if (now - self.cache['updated']) > self.cache['max_staleness']:
+                self.cache['misses'] += 1
+                cursor = self.cache['cursor']
+                if cursor.is_alive():
+                    for doc in cursor.read():
+                        self.cache['document'] = doc
+                else:
+                    # The renewed cursor starts after the newest document
+                    cursor.read()
+                    self.cache['document'] = self.buffer.find_one(sort=[('$natural', pymongo.DESCENDING)])
+                self.cache['updated'] = now
+            else:
+                self.cache['hits'] += 1
+            document = copy.deepcopy(self.cache['document'])
+        if document is not None:
+            document.pop('_id', None)
+            if not return_single_timestamp:
+                document.pop('_timestamp', None)
+        return document
+
+    def _update_cache(self, document):
+        '''
+        A helper function for the write methods. Places a document written to
+            the buffer into the cache.
+        '''
+        if self.cache is not None:
+            with self.cache_lock:
+                self.cache['document'] = copy.deepcopy(document)
 
     def get_collections(self, mongo_client, database):
     # Get the MongoDB client
@@ -178,14 +1298,75 @@ class DatabaseRead():
         self.database_name = database
         self.collection_name = collection
         self.database = self.client[self.database_name]
+        if self.decode_arrays:
+            codec_options = ARRAY_CODEC_OPTIONS
+        else:
+            codec_options = None
+        self.codec_options = codec_options
     # Get the record
-        self.record = self.database[self.collection_name+'record']
+        self.record = self.database.get_collection(self.collection_name+'record', codec_options=codec_options)
+    # Get the time bucketed record
+        self.record_bucket = self.database.get_collection(self.collection_name+'record_bucket', codec_options=codec_options)
+    # Get the record rollups
+        self.rollup = {}
+        for (resolution, seconds) in ROLLUP_RESOLUTIONS:
+            self.rollup[resolution] = self.database[self.collection_name+'record_'+resolution]
     # Get the buffer
-        self.buffer = self.database[self.collection_name+'buffer']
+        self.buffer = self.database.get_collection(self.collection_name+'buffer', codec_options=codec_options)
+    # Record partitions are parsed from the collection listing on demand
+        self.partitions = None
     # Set constants
         self.COLLECTION_KEYS = [self.collection_name+key for key in self.COLLECTION_KEYS]
 
-    def read_buffer(self, number_of_documents=1, sort_ascending=False, tailable_cursor=False, no_cursor_timeout=False, return_single_timestamp=False):
+    def _parse_partitions(self, names):
+        '''
+        A helper function that finds the record partitions in a list of
+            collection names. Returns whether the unpartitioned record exists,
+            and a dictionary of the partition collections keyed by the start of
+            each month.
+        '''
+        partitions = {}
+        for name in names:
+            if name.startswith(self.collection_name):
+                match = PARTITION_PATTERN.match(name[len(self.collection_name):])
+                if match:
+                    start = datetime.datetime(int(match.group(1)), int(match.group(2)), 1)
+                    partitions[start] = self.database.get_collection(name, codec_options=self.codec_options)
+        return (self.record.name in names, partitions)
+
+    def _list_partitions(self):
+        '''
+        A helper function that returns the parsed partitions of the cached
+            collection listing (see _parse_partitions). The listing is only
+            parsed again once the cache has been refreshed.
+        '''
+        names = list_collection_names(self.database)
+        if (self.partitions is None) or not(self.partitions[0] is names):
+            self.partitions = (names, self._parse_partitions(names))
+        return self.partitions[1]
+
+    def get_record_collections(self, start=None, stop=None):
+        '''
+        Returns the record collections that may contain documents within the
+            query period, in ascending time order. Unless the record is
+            partitioned, this is only the record itself. Otherwise only the
+            monthly partitions that overlap with the query period are returned.
+            Documents written before the record was partitioned remain in the
+            unpartitioned record, which is returned first if it exists.
+        The partitions are listed at most once every PARTITION_CACHE_TIME
+            seconds (see list_collection_names), so a new partition created by
+            another process may not be read until the listing is refreshed.
+        '''
+        if not(self.partitioned):
+            return [self.record]
+        (legacy, partitions) = self._list_partitions()
+        collections = ([self.record] if legacy else [])
+        for month in sorted(partitions):
+            if ((start is None) or (partition_stop(month) > start)) and ((stop is None) or (month <= stop)):
+                collections.append(partitions[month])
+        return collections
+
+    def read_buffer(self, number_of_documents=1, sort_ascending=False, tailable_cursor=False, no_cursor_timeout=False, return_single_timestamp=False, start=None, stop=None, projection=None):
         '''
         Returns an iterable cursor object containing documents from the buffer.
         A tailable cursor remains open after the client exhausts the results in
@@ -213,7 +1394,19 @@ class DatabaseRead():
         no_cursor_timeout: bool, sets action of the cursor timeout
         return_single_timestamp: bool, selects to keep or remove the internal
             `_timestamp` key when only one document is returned.
+        start: a datetime.datetime instance, only documents newer than this
+            are returned. The filter is applied by the server.
+        stop: a datetime.datetime instance, only documents at or older than
+            this are returned. The filter is applied by the server.
+        projection: a list of keys to return, or a dictionary that specifies
+            the included or excluded keys. Array fields may be sliced on the
+            server, i.e. {'key':{'$slice':[skip, limit]}}. The full document is
+            returned if unspecified.
         '''
+    # Cache
+        if (self.cache is not None) and (number_of_documents == 1) and not(sort_ascending or tailable_cursor) \
+                and (start is None) and (stop is None) and (projection is None):
+            return self._read_cache(return_single_timestamp)
     # Tailable cursor
         if tailable_cursor:
             # A tailable cursor only works with ascending sort and unlimited document count
@@ -227,16 +1420,18 @@ class DatabaseRead():
             sort_order = [('$natural', pymongo.ASCENDING)]
         else:
             sort_order = [('$natural', pymongo.DESCENDING)]
+    # Ranged filter
+        ranged_filter = timestamp_filter(start, stop)
     # Cursor
-        cursor = self.buffer.find(limit=number_of_documents, cursor_type=cursor_type, sort=sort_order, no_cursor_timeout=no_cursor_timeout)
+        cursor = self.buffer.find(ranged_filter, projection=projection, limit=number_of_documents, cursor_type=cursor_type, sort=sort_order, no_cursor_timeout=no_cursor_timeout)
         if number_of_documents == 1:
         # Return the object if one exists
             cursor = list(cursor)
             if len(cursor) == 1:
                 cursor = cursor[0]
-                cursor.pop('_id')
+                cursor.pop('_id', None)
                 if not return_single_timestamp:
-                    cursor.pop('_timestamp')
+                    cursor.pop('_timestamp', None)
                 return cursor
             else:
                 return
@@ -244,7 +1439,7 @@ class DatabaseRead():
         # Return the cursor in full
             return cursor
 
-    def read_record(self, start=None, stop=None, number_of_documents=0, sort_ascending=True, return_single_timestamp=False):
+    def read_record(self, start=None, stop=None, number_of_documents=0, sort_ascending=True, return_single_timestamp=False, projection=None, max_points=None):
         '''
         Returns an iterable cursor object containing documents from the record.
         The start and stop times are given as datetime.datetime objects. These
@@ -270,6 +1465,17 @@ class DatabaseRead():
             descending order.
         return_single_timestamp: bool, selects to keep or remove the internal
             `_timestamp` key when only one document is returned.
+        projection: a list of keys to return, or a dictionary that specifies
+            the included or excluded keys. Array fields may be sliced on the
+            server, i.e. {'key':{'$slice':[skip, limit]}}. The full document is
+            returned if unspecified.
+        max_points: int, the maximum number of points that should be returned
+            for the query period. If the record contains more, documents are
+            returned from the finest rollup that satisfies the limit, or from
+            the coarsest rollup if none do. See DatabaseMaster.update_rollups
+            for the format of the rollup documents. Rollups require MongoDB
+            4.4 or newer (see ROLLUP_SERVER_VERSION), a RuntimeError is raised
+            if they are needed on an older server.
         '''
     # Sort order
         if sort_ascending:
@@ -277,24 +1483,34 @@ class DatabaseRead():
         else:
             sort_order = [('_timestamp', pymongo.DESCENDING)]
     # Ranged filter
-        if (start is not None) and (stop is not None):
-            ranged_filter = {'_timestamp':{'$gt':start, '$lte':stop}}
-        elif (start is not None):
-            ranged_filter = {'_timestamp':{'$gt':start}}
-        elif (stop is not None):
-            ranged_filter = {'_timestamp':{'$lte':stop}}
-        else:
-            ranged_filter = None
+        ranged_filter = timestamp_filter(start, stop)
+    # Resolution
+        resolution = None
+        if (max_points is not None):
+            resolution = self.select_resolution(start, stop, max_points)
     # Cursor
-        cursor = self.record.find(ranged_filter, limit=number_of_documents, sort=sort_order)
+        if (resolution is not None):
+            cursor = self.rollup[resolution].find(ranged_filter, projection=projection, limit=number_of_documents, sort=sort_order)
+        elif self.bucketed:
+            pipeline = self._bucket_pipeline(start, stop, number_of_documents, sort_ascending, projection)
+            cursor = self.record_bucket.aggregate(pipeline, allowDiskUse=True)
+        elif self.partitioned:
+            collections = self.get_record_collections(start, stop)
+            if not sort_ascending:
+                collections = collections[::-1]
+            queries = [(lambda limit, collection=collection: collection.find(ranged_filter, projection=projection, limit=limit, sort=sort_order))
+                       for collection in collections]
+            cursor = PartitionCursor(queries, limit=number_of_documents)
+        else:
+            cursor = self.record.find(ranged_filter, projection=projection, limit=number_of_documents, sort=sort_order)
         if number_of_documents == 1:
         # Return the object if one exists
             cursor = list(cursor)
             if len(cursor) == 1:
                 cursor = cursor[0]
-                cursor.pop('_id')
+                cursor.pop('_id', None)
                 if not return_single_timestamp:
-                    cursor.pop('_timestamp')
+                    cursor.pop('_timestamp', None)
                 return cursor
             else:
                 return
@@ -302,6 +1518,322 @@ class DatabaseRead():
         # Return the cursor in full
             return cursor
 
+    def read_record_columns(self, keys, start=None, stop=None, number_of_documents=0, sort_ascending=True, batch_size=10000, as_dataframe=False):
+        '''
+        Returns the requested keys of the documents in the record as columns of
+            numpy arrays. Only the requested keys are transferred, and the
+            results are read as raw BSON batches instead of through a cursor.
+            If all documents of a batch share the same binary layout, as is
+            typical of records of numeric values, the columns are read
+            directly from the batch as strided numpy arrays without decoding
+            the documents (see _decode_uniform_batch). Other batches are
+            decoded with a single call and gathered in Python. The returned
+            dictionary always contains a "_timestamp" column of
+            numpy.datetime64 values. Nested keys may be accessed with the dot
+            notation, i.e. "data.x".
+        Missing values are returned as NaN. Columns with values that are not
+            numeric, including booleans, are returned as object arrays.
+        See read_record for details on the start and stop times.
+
+        *args
+        keys: list of str, the keys to return.
+        start: a datetime.datetime instance marking the start of the query period.
+        stop: a datetime.datetime instance marking the end of the query period.
+
+        **kwargs
+        number_of_documents: int, maximum number of documents returned. A
+            maximum number of "0" is equivalent to an unlimited amount.
+        sort_ascending: bool, selects to sort the columns either by ascending
+            or descending order.
+        batch_size: int, number of documents per raw batch.
+        as_dataframe: bool, selects to return a pandas.DataFrame indexed by
+            "_timestamp" instead of a dictionary.
+        '''
+        keys = [key for key in keys if key != '_timestamp']
+    # Sort order
+        if sort_ascending:
+            sort_order = [('_timestamp', pymongo.ASCENDING)]
+        else:
+            sort_order = [('_timestamp', pymongo.DESCENDING)]
+    # Ranged filter
+        ranged_filter = timestamp_filter(start, stop)
+    # Projection
+        projection = dict([('_id', False), ('_timestamp', True)] + [(key, True) for key in keys])
+    # Raw batches
+        if self.bucketed:
+            pipeline = self._bucket_pipeline(start, stop, number_of_documents, sort_ascending, projection)
+            batches = self.record_bucket.aggregate_raw_batches(pipeline, allowDiskUse=True, batchSize=batch_size)
+        else:
+            collections = self.get_record_collections(start, stop)
+            if not sort_ascending:
+                collections = collections[::-1]
+            # Partitions are only queried once the previous ones are exhausted
+            batches = (batch for collection in collections
+                       for batch in collection.find_raw_batches(ranged_filter, projection=projection, limit=number_of_documents, sort=sort_order, batch_size=batch_size))
+        parts = []
+        count = 0
+        for batch in batches:
+            part = _decode_uniform_batch(batch, keys)
+            if part is None:
+                part = self._decode_batch(batch, keys)
+            parts.append(part)
+            count += len(part['_timestamp'])
+            if number_of_documents and (count >= number_of_documents):
+                break
+    # Join the batches
+        columns = {}
+        for key in ['_timestamp'] + keys:
+            if len(parts):
+                columns[key] = np.concatenate([part[key] for part in parts])
+            else:
+                columns[key] = np.array([], dtype=('datetime64[us]' if (key == '_timestamp') else float))
+            if number_of_documents:
+                columns[key] = columns[key][:number_of_documents]
+        if as_dataframe:
+            import pandas as pd
+            return pd.DataFrame(columns).set_index('_timestamp')
+        else:
+            return columns
+
+    def _decode_batch(self, batch, keys):
+        '''
+        A helper function for read_record_columns. Decodes a raw BSON batch
+            and gathers the requested keys into columns.
+        '''
+        docs = bson.decode_all(batch, self.record_bucket.codec_options)
+        columns = {'_timestamp':np.array([doc['_timestamp'] for doc in docs], dtype='datetime64[us]')}
+        for key in keys:
+            if not('.' in key):
+                columns[key] = _to_array([doc.get(key) for doc in docs])
+                continue
+            path = key.split('.')
+            values = []
+            for doc in docs:
+                value = doc
+                for sub_key in path:
+                    if isinstance(value, dict) and (sub_key in value):
+                        value = value[sub_key]
+                    else:
+                        value = None
+                        break
+                values.append(value)
+            columns[key] = _to_array(values)
+        return columns
+
+    def select_resolution(self, start, stop, max_points):
+        '''
+        Returns the name of the finest rollup resolution that contains no
+            more than max_points documents within the query period, or None if
+            the record itself satisfies the limit. The coarsest resolution is
+            returned if none satisfy the limit.
+        '''
+        max_points = int(max_points)
+        ranged_filter = timestamp_filter(start, stop)
+        if ranged_filter is None:
+            ranged_filter = {}
+    # Raw record
+        if self.bucketed:
+            pipeline = self._bucket_pipeline(start, stop, 0, True, None)[:-1] # drop the sort
+            pipeline += [{'$limit':max_points+1}, {'$count':'count'}]
+            result = list(self.record_bucket.aggregate(pipeline))
+            count = (result[0]['count'] if len(result) else 0)
+        else:
+            count = 0
+            for collection in self.get_record_collections(start, stop):
+                count += collection.count_documents(ranged_filter, limit=max_points+1)
+        if count <= max_points:
+            return None
+    # Rollups
+        self.check_server_version(ROLLUP_SERVER_VERSION, 'Rollups')
+        for (resolution, seconds) in ROLLUP_RESOLUTIONS:
+            count = self.rollup[resolution].count_documents(ranged_filter, limit=max_points+1)
+            if count <= max_points:
+                return resolution
+        return resolution
+
+    def _bucket_pipeline(self, start, stop, number_of_documents, sort_ascending, projection):
+        '''
+        Returns the aggregation pipeline that unwinds the samples of the time
+            buckets that overlap with the query period. The samples are
+            returned in the same format as those of an unbucketed record.
+        '''
+        if sort_ascending:
+            sort_order = pymongo.ASCENDING
+        else:
+            sort_order = pymongo.DESCENDING
+    # Select overlapping buckets
+        bucket_filter = {}
+        if (start is not None):
+            bucket_filter['_timestamp_max'] = {'$gt':start}
+        if (stop is not None):
+            bucket_filter['_timestamp_min'] = {'$lte':stop}
+        if number_of_documents:
+            bucket_filter = self._bucket_cover(bucket_filter, number_of_documents, sort_ascending, start, stop)
+        pipeline = [
+            {'$match':bucket_filter},
+            {'$sort':{'_timestamp_min':sort_order}},
+            {'$unwind':'$samples'},
+            {'$replaceRoot':{'newRoot':'$samples'}}]
+    # Select samples
+        ranged_filter = timestamp_filter(start, stop)
+        if (ranged_filter is not None):
+            pipeline.append({'$match':ranged_filter})
+        pipeline.append({'$sort':{'_timestamp':sort_order}})
+        if number_of_documents:
+            pipeline.append({'$limit':number_of_documents})
+        if (projection is not None):
+            pipeline.append(bucket_projection(projection))
+        return pipeline
+
+    def _bucket_cover(self, bucket_filter, number_of_documents, sort_ascending, start, stop):
+        '''
+        A helper function for _bucket_pipeline. Narrows the bucket filter to
+            the buckets that may hold the first "number_of_documents" samples
+            in the sort order, so that only those buckets are unwound. The
+            bucket headers are scanned from the leading end of the record
+            until the buckets that lie entirely within the query period hold
+            enough samples. Since buckets may overlap in time, every bucket
+            that reaches past the trailing edge of the scanned buckets is
+            also selected. The filter is returned unchanged if the record
+            does not hold enough samples.
+        '''
+        if sort_ascending:
+            (lead, trail, sort_order) = ('_timestamp_min', '_timestamp_max', pymongo.ASCENDING)
+        else:
+            (lead, trail, sort_order) = ('_timestamp_max', '_timestamp_min', pymongo.DESCENDING)
+        headers = self.record_bucket.find(
+            bucket_filter,
+            projection={'_id':False, '_timestamp_min':True, '_timestamp_max':True, 'count':True},
+            sort=[(lead, sort_order)])
+        count = 0
+        boundary = None
+        for header in headers:
+            if boundary is None:
+                boundary = header[trail]
+            elif sort_ascending:
+                boundary = max(boundary, header[trail])
+            else:
+                boundary = min(boundary, header[trail])
+            inside = (((start is None) or (header['_timestamp_min'] > start))
+                      and ((stop is None) or (header['_timestamp_max'] <= stop)))
+            if inside:
+                count += header['count']
+            if count >= number_of_documents:
+                break
+        headers.close()
+        if count < number_of_documents:
+            return bucket_filter
+        if sort_ascending:
+            return {'$and':[bucket_filter, {'_timestamp_min':{'$lte':boundary}}]}
+        else:
+            return {'$and':[bucket_filter, {'_timestamp_max':{'$gte':boundary}}]}
+
+BSON_FIXED_SIZES = {
+    b'\x01':8, # double
+    b'\x07':12, # ObjectId
+    b'\x08':1, # bool
+    b'\x09':8, # UTC datetime
+    b'\x0a':0, # null
+    b'\x10':4, # int32
+    b'\x11':8, # timestamp
+    b'\x12':8, # int64
+    b'\x13':16, # decimal128
+    b'\xff':0, b'\x7f':0} # min and max keys
+BSON_NUMERIC_DTYPES = {b'\x01':'<f8', b'\x10':'<i4', b'\x12':'<i8'}
+
+def _bson_layout(data, offset, prefix, leaves, values):
+    '''
+    A helper function for _decode_uniform_batch. Walks the BSON document at
+        the offset and records the type and value offset of each element by
+        its dotted path in "leaves". The byte ranges of values are recorded
+        in "values", the rest of the document is structural. Returns the end
+        of the document, or None if it contains an unsupported type.
+    '''
+    end = offset + int.from_bytes(data[offset:offset+4], 'little')
+    position = offset + 4
+    while position < end - 1:
+        element_type = data[position:position+1]
+        name_end = data.index(b'\x00', position+1)
+        path = prefix + data[position+1:name_end].decode('utf-8')
+        position = name_end + 1
+        leaves[path] = (element_type, position)
+        if element_type in BSON_FIXED_SIZES:
+            size = BSON_FIXED_SIZES[element_type]
+            values.append((position, position+size))
+            position += size
+        elif element_type in (b'\x02', b'\x0d', b'\x0e'): # strings
+            size = int.from_bytes(data[position:position+4], 'little')
+            values.append((position+4, position+4+size))
+            position += 4 + size
+        elif element_type == b'\x05': # binary
+            size = int.from_bytes(data[position:position+4], 'little')
+            values.append((position+5, position+5+size))
+            position += 5 + size
+        elif element_type in (b'\x03', b'\x04'): # documents and arrays
+            position = _bson_layout(data, position, path+'.', leaves, values)
+            if position is None:
+                return None
+        else:
+            return None
+    return end
+
+def _decode_uniform_batch(batch, keys):
+    '''
+    A helper function for read_record_columns. Reads the requested keys of a
+        raw BSON batch directly into numpy arrays, without decoding the
+        documents, if all documents in the batch have the same length and
+        differ only in the values of their elements. The columns are then
+        strided views of the batch buffer. Returns None if the documents are
+        not uniform or if a requested key holds a value that is not a double,
+        integer, datetime, or null. Missing keys are returned as NaN.
+    '''
+    if not(len(batch)):
+        return None
+    length = int.from_bytes(batch[0:4], 'little')
+    if (length < 5) or (len(batch) % length):
+        return None
+    count = len(batch) // length
+# Layout of the first document
+    leaves = {}
+    values = []
+    if _bson_layout(batch, 0, '', leaves, values) != length:
+        return None
+# Compare the structure of every document to the first
+    rows = np.frombuffer(batch, dtype=np.uint8).reshape(count, length)
+    structure = np.ones(length, dtype=bool)
+    for (start, stop) in values:
+        structure[start:stop] = False
+    if not((rows[:, structure] == rows[0, structure]).all()):
+        return None
+# Read the columns
+    columns = {}
+    for key in ['_timestamp'] + keys:
+        (element_type, offset) = leaves.get(key, (b'\x0a', None))
+        if (element_type == b'\x09'):
+            column = np.ndarray((count,), dtype='<i8', buffer=batch, offset=offset, strides=(length,))
+            column = column.astype('datetime64[ms]').astype('datetime64[us]')
+        elif (element_type in BSON_NUMERIC_DTYPES) and (key != '_timestamp'):
+            column = np.ndarray((count,), dtype=BSON_NUMERIC_DTYPES[element_type], buffer=batch, offset=offset, strides=(length,))
+            column = column.astype(float)
+        elif (element_type == b'\x0a') and (key != '_timestamp'):
+            column = np.full(count, np.nan)
+        else:
+            return None
+        columns[key] = column
+    return columns
+
+def _to_array(values):
+    '''
+    A helper function for read_record_columns. Converts a list of values into
+        a numpy array, replacing missing values with NaN.
+    '''
+    numeric = all([isinstance(value, (int, float)) and not(isinstance(value, bool)) for value in values if value is not None])
+    if numeric:
+        return np.array([np.nan if value is None else value for value in values], dtype=float)
+    else:
+        return np.array([np.nan if value is None else value for value in values], dtype=object)
+
+
 
 # %% LogRead =============================================================
 class LogRead():
@@ -350,7 +1882,7 @@ class LogRead():
     # Set constants
         self.COLLECTION_KEYS = [self.collection_name+key for key in self.COLLECTION_KEYS]
 
-    def read_log(self, start=None, stop=None, number_of_documents=0, log_level=logging.INFO, sort_ascending=True):
+    def read_log(self, start=None, stop=None, number_of_documents=0, log_level=logging.INFO, sort_ascending=True, projection=None):
         '''
         Returns an iterable cursor object containing documents from the log.
         The start and stop times are given as datetime.datetime objects. These
@@ -378,6 +1910,10 @@ class LogRead():
         log_level: int, selects the minimum log level returned.
         sort_ascending: bool, selects to sort the cursor either by ascending or
             descending order.
+        projection: a list of keys to return, or a dictionary that specifies
+            the included or excluded keys. Array fields may be sliced on the
+            server, i.e. {'key':{'$slice':[skip, limit]}}. The full document is
+            returned if unspecified.
         '''
     # Sort order
         if sort_ascending:
@@ -394,13 +1930,13 @@ class LogRead():
         else:
             ranged_filter = None
     # Cursor
-        cursor = self.log.find(ranged_filter, limit=number_of_documents, sort=sort_order)
+        cursor = self.log.find(ranged_filter, projection=projection, limit=number_of_documents, sort=sort_order)
         if number_of_documents == 1:
         # Return the object if one exists
             cursor = list(cursor)
             if len(cursor) == 1:
                 cursor = cursor[0]
-                cursor.pop('_id')
+                cursor.pop('_id', None)
                 return cursor
             else:
                 return
@@ -408,7 +1944,7 @@ class LogRead():
         # Return the cursor in full
             return cursor
 
-    def read_log_buffer(self, number_of_documents=0, sort_ascending=True, log_level=logging.INFO, tailable_cursor=False, no_cursor_timeout=False):
+    def read_log_buffer(self, number_of_documents=0, sort_ascending=True, log_level=logging.INFO, tailable_cursor=False, no_cursor_timeout=False, projection=None):
         '''
         Returns an iterable cursor object containing documents from the log buffer.
         A tailable cursor remains open after the client exhausts the results in
@@ -436,6 +1972,10 @@ class LogRead():
             descending order.
         tailable_cursor: bool, selects whether or not to return a tailable cursor
         no_cursor_timeout: bool, sets action of the cursor timeout
+        projection: a list of keys to return, or a dictionary that specifies
+            the included or excluded keys. Array fields may be sliced on the
+            server, i.e. {'key':{'$slice':[skip, limit]}}. The full document is
+            returned if unspecified.
         '''
     # Tailable cursor
         if tailable_cursor:
@@ -453,13 +1993,13 @@ class LogRead():
     # log filter
         log_filter = {'log_level':{'$gte':log_level}}
     # Cursor
-        cursor = self.log_buffer.find(log_filter, limit=number_of_documents, cursor_type=cursor_type, sort=sort_order, no_cursor_timeout=no_cursor_timeout)
+        cursor = self.log_buffer.find(log_filter, projection=projection, limit=number_of_documents, cursor_type=cursor_type, sort=sort_order, no_cursor_timeout=no_cursor_timeout)
         if number_of_documents == 1:
         # Return the object if one exists
             cursor = list(cursor)
             if len(cursor) == 1:
                 cursor = cursor[0]
-                cursor.pop('_id')
+                cursor.pop('_id', None)
                 return cursor
             else:
                 return
@@ -471,7 +2011,7 @@ class LogRead():
 # %% DatabaseReadWrite ========================================================
 
 class DatabaseReadWrite(DatabaseRead):
-    def __init__(self, mongo_client, database):
+    def __init__(self, mongo_client, database, bucket_size=None, bucket_interval=None, partitioned=None):
         '''
         The "read and write" handler for the database. This subclass is used to
             form a read and write connection to a database, without needing to
@@ -483,13 +2023,214 @@ class DatabaseReadWrite(DatabaseRead):
             'log', 'log_buffer') will be appended to the collection name. Only
             one level is supported, mongoDB does not support nested collections.
 
+        Records of high rate data may optionally be stored in time buckets.
+            Each bucket document holds up to "bucket_size" samples that fall
+            within the same "bucket_interval", along with the minimum and
+            maximum "_timestamp" of its samples. This reduces the number of
+            documents and index entries in the record by the bucket factor.
+            The record methods handle the bucketed format transparently.
+            Bucketing is enabled by specifying either keyword, or automatically
+            if the database already contains a bucketed record. Bucketing
+            should be enabled when a record is created, as unbucketed documents
+            are not read from a bucketed record.
+
+        Unbucketed records may instead be partitioned by month. Each document
+            is written to a "record_YYYY_MM" collection (see PARTITION_FORMAT)
+            chosen by its "_timestamp", and reads only query the partitions
+            that overlap with the requested period. This keeps the index and
+            the range scans of recent data small as the record grows, and
+            allows old partitions to be archived (see
+            DatabaseMaster.archive_partitions). Partitioning is enabled with
+            the "partitioned" keyword, or automatically if the database already
+            contains partitions.
+
         *args
         mongo_client: a MongoClient object
         database: str, the name of the requested database. Use the '/' separator
             to include multiple collections in a single database file.
+
+        **kwargs
+        bucket_size: int, the maximum number of samples per bucket.
+        bucket_interval: float, the time interval in seconds spanned by each
+            bucket.
+        partitioned: bool, selects whether the record is partitioned by month.
         '''
     # Initialize
-        super(DatabaseReadWrite, self).__init__(mongo_client, database)
+        if (bucket_size is not None) or (bucket_interval is not None):
+            bucketed = True
+        else:
+            bucketed = None
+        super(DatabaseReadWrite, self).__init__(mongo_client, database, bucketed=bucketed, partitioned=partitioned)
+        self.bucket_size = int(BUCKET_SIZE if (bucket_size is None) else bucket_size)
+        self.bucket_interval = float(BUCKET_INTERVAL if (bucket_interval is None) else bucket_interval)
+        self.writer = None
+        self.array_encoding = None
+        self.indexed_partitions = set()
+        self.rollup_updates = False
+        self.rollup_keys = None
+
+    def enable_array_encoding(self, dtype=None, compression=None, delta=False):
+        '''
+        Stores numpy arrays given to write_buffer, write_record, and
+            write_record_and_buffer as typed binary blobs instead of lists.
+            This reduces the size of large arrays several fold, especially
+            with float32 data or with compression. The arrays are decoded back
+            into numpy arrays when read. Other values, including lists, are
+            written unchanged. See encode_array for details.
+
+        **kwargs
+        dtype: the dtype stored in the database, i.e. "float32". The dtype of
+            each array is kept if unspecified.
+        compression: None, "zlib", or "zstd". zstd requires the zstandard
+            package.
+        delta: bool, selects to delta encode the array data before compression.
+        '''
+        if (compression == 'zstd') and (zstandard is None):
+            raise ImportError('zstd compression requires the zstandard package')
+        self.array_encoding = {'dtype':dtype, 'compression':compression, 'delta':delta}
+
+    def disable_array_encoding(self):
+        '''Resumes writing numpy arrays unchanged.'''
+        self.array_encoding = None
+
+    def _encode(self, document):
+        '''
+        Returns the document as written to the database, with numpy arrays
+            encoded if array encoding is enabled.
+        '''
+        if self.array_encoding is None:
+            return document
+        return encode_arrays(document, **self.array_encoding)
+
+    def enable_write_behind(self, writer=None, **kwargs):
+        '''
+        Routes the write_* methods through a WriteBehindQueue. Writes then
+            return as soon as the document is queued, and are written to the
+            database in batches by a background thread. Returns the writer.
+        Queued documents are deep copied, so the caller may freely modify
+            them after the write method returns. Documents are not visible to
+            readers until they have been written, use "flush" to wait.
+
+        **kwargs
+        writer: a WriteBehindQueue object to share with other databases. A new
+            one is created if unspecified.
+        Other keyword arguments are passed to the new WriteBehindQueue.
+        '''
+        if writer is None:
+            writer = WriteBehindQueue(**kwargs)
+        self.writer = writer
+        return writer
+
+    def disable_write_behind(self):
+        '''Flushes the write behind queue and resumes synchronous writes.'''
+        if self.writer is not None:
+            self.writer.flush()
+        self.writer = None
+
+    def enable_rollup_updates(self, keys=None):
+        '''
+        Updates the rollups of the record as each document is written by
+            write_record and write_record_and_buffer, instead of aggregating
+            them later with DatabaseMaster.update_rollups. Each write merges
+            the document into the interval of each resolution with a single
+            upsert per rollup (see rollup_merge_stages), which is queued if
+            write behind is enabled. Documents copied in bulk, i.e. with
+            write_documents_to_record, are left to update_rollups.
+        This advances the high-water mark of the rollups, so every writer of
+            the record should enable rollup updates, as documents written by
+            others with older timestamps are no longer aggregated by
+            update_rollups. Requires MongoDB 4.4 or newer.
+
+        **kwargs
+        keys: list of str, the keys to roll up. If unspecified, all top level
+            numeric keys of each document are used.
+        '''
+        self.check_server_version(ROLLUP_SERVER_VERSION, 'Rollups')
+        for (resolution, seconds) in ROLLUP_RESOLUTIONS:
+            self.rollup[resolution].create_index([('_timestamp', pymongo.DESCENDING)], unique=True)
+        self.rollup_updates = True
+        self.rollup_keys = keys
+
+    def disable_rollup_updates(self):
+        '''Stops updating the rollups as documents are written.'''
+        self.rollup_updates = False
+
+    def _update_rollups(self, document):
+        '''
+        Merges a single document into the current interval of each rollup.
+        '''
+        keys = self.rollup_keys
+        if keys is None:
+            keys = [key for (key, value) in document.items()
+                    if isinstance(value, (int, float)) and not(isinstance(value, bool)) and not(key.startswith('_'))]
+        partial = rollup_partial(document, keys)
+        pipeline = rollup_merge_stages(keys, lambda path: {'$literal':partial[path]})
+        for (resolution, seconds) in ROLLUP_RESOLUTIONS:
+            update_filter = {'_timestamp':bucket_start(document['_timestamp'], seconds)}
+            if self.writer is None:
+                self.rollup[resolution].update_one(update_filter, pipeline, upsert=True)
+            else:
+                self.writer.put(self.rollup[resolution], pymongo.UpdateOne(update_filter, pipeline, upsert=True))
+
+    def flush(self):
+        '''Blocks until all queued writes have been written.'''
+        if self.writer is not None:
+            self.writer.flush()
+
+    def _insert(self, collection, document):
+        '''
+        Inserts a document into the collection, or queues the insert if write
+            behind is enabled.
+        '''
+        if self.writer is None:
+            collection.insert_one(document)
+        else:
+            self.writer.put(collection, pymongo.InsertOne(copy.deepcopy(document)))
+
+    def _record_collection(self, document):
+        '''
+        Returns the record collection that the document is written to. New
+            partitions are indexed before their first write.
+        '''
+        if not(self.partitioned):
+            return self.record
+        month = partition_start(document['_timestamp'])
+        collection = self.database.get_collection(self.collection_name+month.strftime(PARTITION_FORMAT), codec_options=self.codec_options)
+        if not(month in self.indexed_partitions):
+            collection.create_index([('_timestamp', pymongo.DESCENDING)])
+            self.indexed_partitions.add(month)
+            self.partitions = None
+            forget_collection_names(self.database)
+        return collection
+
+    def _bucket_update(self, document):
+        '''
+        Returns the filter and update that push a document into the time
+            bucket that contains its timestamp. A new bucket is created if the
+            current one is full.
+        '''
+        timestamp = document['_timestamp']
+        bucket_filter = {
+            '_bucket':bucket_start(timestamp, self.bucket_interval),
+            'count':{'$lt':self.bucket_size}}
+        update = {
+            '$push':{'samples':document},
+            '$min':{'_timestamp_min':timestamp},
+            '$max':{'_timestamp_max':timestamp},
+            '$inc':{'count':1}}
+        return (bucket_filter, update)
+
+    def _write_to_bucket(self, document):
+        '''
+        Writes a single document into the time bucketed record.
+        '''
+        document = copy.copy(document)
+        document.pop('_id', None)
+        if self.writer is None:
+            self.record_bucket.update_one(*self._bucket_update(document), upsert=True)
+        else:
+            document = copy.deepcopy(document)
+            self.writer.put(self.record_bucket, pymongo.UpdateOne(*self._bucket_update(document), upsert=True))
 
     def write_document_to_buffer(self, document):
         '''
@@ -504,7 +2245,8 @@ class DatabaseReadWrite(DatabaseRead):
         document = copy.copy(document)
         if '_id' in document:
             document.pop('_id')
-        self.buffer.insert_one(document)
+        self._insert(self.buffer, document)
+        self._update_cache(document)
 
     def write_document_to_record(self, document):
         '''
@@ -516,10 +2258,88 @@ class DatabaseReadWrite(DatabaseRead):
         *args
         document: a document in the format as given by the read_buffer function.
         '''
+        if self.bucketed:
+            self._write_to_bucket(document)
+            return
         document = copy.copy(document)
         if '_id' in document:
             document.pop('_id')
-        self.record.insert_one(document)
+        self._insert(self._record_collection(document), document)
+
+    def write_documents_to_buffer(self, documents, batch_size=SYNC_BATCH_SIZE, keep_id=False):
+        '''
+        Writes many documents into the buffer using batched, unordered inserts.
+            This is the bulk equivalent of write_document_to_buffer. Documents
+            whose "_id" already exists in the buffer are skipped. Returns the
+            number of documents inserted.
+
+        *args
+        documents: an iterable of documents, such as a read_buffer cursor.
+
+        **kwargs
+        batch_size: int, the maximum number of documents per insert.
+        keep_id: bool, selects to keep or drop the "_id" of the given documents.
+        '''
+        return insert_documents(self.buffer, documents, batch_size=batch_size, keep_id=keep_id)
+
+    def write_documents_to_record(self, documents, batch_size=SYNC_BATCH_SIZE, keep_id=False):
+        '''
+        Writes many documents into the record using batched, unordered inserts.
+            This is the bulk equivalent of write_document_to_record. Documents
+            whose "_id" already exists in the record are skipped. Returns the
+            number of documents inserted.
+
+        *args
+        documents: an iterable of documents, such as a read_record cursor.
+
+        **kwargs
+        batch_size: int, the maximum number of documents per insert.
+        keep_id: bool, selects to keep or drop the "_id" of the given documents.
+            The "_id" is always dropped if the record is bucketed.
+        '''
+        if self.bucketed:
+            inserted = 0
+            requests = []
+            for document in documents:
+                document = copy.copy(document)
+                document.pop('_id', None)
+                requests.append(pymongo.UpdateOne(*self._bucket_update(document), upsert=True))
+                if len(requests) >= batch_size:
+                    self.record_bucket.bulk_write(requests)
+                    inserted += len(requests)
+                    requests = []
+            if len(requests):
+                self.record_bucket.bulk_write(requests)
+                inserted += len(requests)
+            return inserted
+        if self.partitioned:
+            inserted = 0
+            batch = []
+            for document in documents:
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    inserted += self._insert_partitioned(batch, keep_id)
+                    batch = []
+            if len(batch):
+                inserted += self._insert_partitioned(batch, keep_id)
+            return inserted
+        return insert_documents(self.record, documents, batch_size=batch_size, keep_id=keep_id)
+
+    def _insert_partitioned(self, documents, keep_id):
+        '''
+        A helper function for write_documents_to_record. Inserts a batch of
+            documents into their record partitions.
+        '''
+        groups = {}
+        for document in documents:
+            collection = self._record_collection(document)
+            if not(collection.name in groups):
+                groups[collection.name] = (collection, [])
+            groups[collection.name][1].append(document)
+        inserted = 0
+        for (collection, group) in groups.values():
+            inserted += insert_documents(collection, group, batch_size=len(group), keep_id=keep_id)
+        return inserted
 
     def write_buffer(self, entry_dict, timestamp=None):
         '''
@@ -537,7 +2357,8 @@ class DatabaseReadWrite(DatabaseRead):
             entry_dict['_timestamp'] = datetime.datetime.utcnow()
         else:
             entry_dict['_timestamp'] = timestamp
-        self.buffer.insert_one(entry_dict)
+        self._insert(self.buffer, self._encode(entry_dict))
+        self._update_cache(entry_dict)
 
     def write_record(self, entry_dict, timestamp=None):
         '''
@@ -555,7 +2376,13 @@ class DatabaseReadWrite(DatabaseRead):
             entry_dict['_timestamp'] = datetime.datetime.utcnow()
         else:
             entry_dict['_timestamp'] = timestamp
-        self.record.insert_one(entry_dict)
+        document = self._encode(entry_dict)
+        if self.bucketed:
+            self._write_to_bucket(document)
+        else:
+            self._insert(self._record_collection(entry_dict), document)
+        if self.rollup_updates:
+            self._update_rollups(entry_dict)
 
     def write_record_and_buffer(self, entry_dict, timestamp=None):
         '''
@@ -573,8 +2400,15 @@ class DatabaseReadWrite(DatabaseRead):
             entry_dict['_timestamp'] = datetime.datetime.utcnow()
         else:
             entry_dict['_timestamp'] = timestamp
-        self.buffer.insert_one(entry_dict)
-        self.record.insert_one(entry_dict)
+        document = self._encode(entry_dict)
+        self._insert(self.buffer, document)
+        self._update_cache(entry_dict)
+        if self.bucketed:
+            self._write_to_bucket(document)
+        else:
+            self._insert(self._record_collection(entry_dict), document)
+        if self.rollup_updates:
+            self._update_rollups(entry_dict)
 
 
 # %% LogReadWrite ========================================================
@@ -615,6 +2449,22 @@ class LogReadWrite(LogRead):
             document.pop('_id')
         self.log.insert_one(document)
 
+    def write_documents_to_log(self, documents, batch_size=SYNC_BATCH_SIZE, keep_id=False):
+        '''
+        Writes many documents into the log using batched, unordered inserts.
+            This is the bulk equivalent of write_document_to_log. Documents
+            whose "_id" already exists in the log are skipped. Returns the
+            number of documents inserted.
+
+        *args
+        documents: an iterable of documents, such as a read_log cursor.
+
+        **kwargs
+        batch_size: int, the maximum number of documents per insert.
+        keep_id: bool, selects to keep or drop the "_id" of the given documents.
+        '''
+        return insert_documents(self.log, documents, batch_size=batch_size, keep_id=keep_id)
+
     def write_log(self, entry, log_level, timestamp=None):
         '''
         Writes an entry into the log. An entry into the log can be of any type,
@@ -672,11 +2522,35 @@ class LogReadWrite(LogRead):
         self.log.insert_one(document)
         self.log_buffer.insert_one(document)
 
+    def write_log_batch(self, entries):
+        '''
+        Writes many entries into the log with a single insert. This is the
+            batch equivalent of write_log.
+
+        *args
+        entries: a list of (entry, log_level, timestamp) tuples.
+        '''
+        documents = [{'entry':entry, '_timestamp':timestamp, 'log_level':log_level} for (entry, log_level, timestamp) in entries]
+        if len(documents):
+            self.log.insert_many(documents, ordered=True)
+
+    def write_log_buffer_batch(self, entries):
+        '''
+        Writes many entries into the log buffer with a single insert. This is
+            the batch equivalent of write_log_buffer.
+
+        *args
+        entries: a list of (entry, log_level, timestamp) tuples.
+        '''
+        documents = [{'entry':entry, '_timestamp':timestamp, 'log_level':log_level} for (entry, log_level, timestamp) in entries]
+        if len(documents):
+            self.log_buffer.insert_many(documents, ordered=True)
+
 
 # %% DatabaseMaster ===========================================================
 
 class DatabaseMaster(DatabaseReadWrite):
-    def __init__(self, mongo_client, database, capped_collection_size=int(2e6)):
+    def __init__(self, mongo_client, database, capped_collection_size=int(2e6), bucket_size=None, bucket_interval=None, partitioned=None):
         '''
         The "master" handler for the database. This class enforces the database
             settings as given in the kwargs and ensures that the record and log
@@ -696,14 +2570,26 @@ class DatabaseMaster(DatabaseReadWrite):
         **kwargs
         capped_collection_size: int, the size of the capped collection (buffer)
             in bytes.
+        bucket_size: int, the maximum number of samples per record bucket.
+        bucket_interval: float, the time interval in seconds spanned by each
+            record bucket. See DatabaseReadWrite for details on time buckets.
+        partitioned: bool, selects whether the record is partitioned by month.
+            See DatabaseReadWrite for details on partitions.
         '''
-        super(DatabaseMaster, self).__init__(mongo_client, database)
+        super(DatabaseMaster, self).__init__(mongo_client, database, bucket_size=bucket_size, bucket_interval=bucket_interval, partitioned=partitioned)
         self.ensure_compliance(capped_collection_size)
 
     def ensure_compliance(self, capped_collection_size):
     # The record
         # Create a descending index for documents with timestamps in the record
-        self.record.create_index([('_timestamp', pymongo.DESCENDING)])
+        for collection in self.get_record_collections():
+            collection.create_index([('_timestamp', pymongo.DESCENDING)])
+    # The time bucketed record
+        if self.bucketed:
+            # Index the bucket intervals and the time span of each bucket
+            self.record_bucket.create_index([('_bucket', pymongo.DESCENDING)])
+            self.record_bucket.create_index([('_timestamp_min', pymongo.DESCENDING), ('_timestamp_max', pymongo.DESCENDING)])
+            self.record_bucket.create_index([('_timestamp_max', pymongo.DESCENDING)])
     # The record buffer
         # Check that the buffer is as specified in the initialization options
         buffer_options = self.buffer.options()
@@ -713,6 +2599,150 @@ class DatabaseMaster(DatabaseReadWrite):
         elif (not buffer_options['capped']) or (buffer_options['size'] != capped_collection_size):
             # Convert the collection if it is not capped or if it is the wrong size
             self.database.command({'convertToCapped':self.COLLECTION_KEYS[1], 'size':capped_collection_size})
+    # Collections may have been created
+        forget_collection_names(self.database)
+
+    def update_rollups(self, keys=None, stop=None):
+        '''
+        Incrementally updates the rollup collections of the record. Each
+            rollup summarizes the numeric keys of the record over fixed
+            intervals of time (see ROLLUP_RESOLUTIONS). Each rollup records
+            the newest "_timestamp" it has aggregated as a high-water mark
+            ("_timestamp_max" of its most recent interval). Only the documents
+            newer than the mark are aggregated, and their statistics are
+            merged into the existing intervals (see rollup_merge_stages), so
+            this may be called periodically at low cost, i.e. with
+            start_rollup_compactor. Documents written with a timestamp older
+            than the mark are not rolled up. The aggregation is performed by
+            the server, which must be MongoDB 4.4 or newer (see
+            ROLLUP_SERVER_VERSION). A RuntimeError is raised on older servers
+            before anything is written.
+        Rollups may instead be updated as documents are written, see
+            DatabaseReadWrite.enable_rollup_updates.
+        Rollup documents have the same format as the record, with the mean of
+            each key over the interval and a "_timestamp" that marks the start
+            of the interval. The remaining statistics are given in "_stats"::
+
+                {'_timestamp':<interval start>,
+                 <key>:<mean>,
+                 '_stats':{<key>:{'count':, 'sum':, 'sum_sq':, 'min':, 'max':, 'std':}, ...},
+                 '_count':<number of documents in the interval>,
+                 '_timestamp_max':<newest timestamp in the interval>}
+
+        **kwargs
+        keys: list of str, the keys to roll up. If unspecified, all top level
+            numeric keys of the most recent document in the record are used.
+        stop: a datetime.datetime instance, the end of the update period.
+        '''
+        self.check_server_version(ROLLUP_SERVER_VERSION, 'Rollups')
+    # Keys
+        if keys is None:
+            last = self.read_record(number_of_documents=1, sort_ascending=False)
+            if last is None:
+                return
+            keys = [key for (key, value) in last.items()
+                    if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        if not len(keys):
+            return
+    # Aggregate each resolution
+        for (resolution, seconds) in ROLLUP_RESOLUTIONS:
+            rollup = self.rollup[resolution]
+            rollup.create_index([('_timestamp', pymongo.DESCENDING)], unique=True)
+            # Aggregate the documents newer than the high-water mark
+            last = rollup.find_one(sort=[('_timestamp', pymongo.DESCENDING)], projection=['_timestamp', '_timestamp_max'])
+            if last is None:
+                start = None
+            elif ('_timestamp_max' in last):
+                start = last['_timestamp_max']
+            else:
+                # Rollups without a mark are rebuilt from their last interval
+                rollup.delete_one({'_timestamp':last['_timestamp']})
+                start = last['_timestamp'] - datetime.timedelta(milliseconds=1) # include the interval start
+            if self.bucketed:
+                source = self.record_bucket
+                pipeline = self._bucket_pipeline(start, stop, 0, True, None)[:-1] # drop the sort
+            else:
+                collections = self.get_record_collections(start, stop)
+                if not len(collections):
+                    continue
+                ranged_filter = timestamp_filter(start, stop)
+                match = ([{'$match':ranged_filter}] if (ranged_filter is not None) else [])
+                # The legacy record and a partition may hold documents of the
+                # same interval, so all are aggregated together
+                source = collections[0]
+                pipeline = list(match)
+                for collection in collections[1:]:
+                    pipeline.append({'$unionWith':{'coll':collection.name, 'pipeline':match}})
+            milliseconds = int(seconds*1e3)
+            interval = {'$toDate':{'$subtract':[
+                {'$toLong':'$_timestamp'},
+                {'$mod':[{'$toLong':'$_timestamp'}, milliseconds]}]}}
+            group = {'_id':interval, '_count':{'$sum':1}, '_timestamp_max':{'$max':'$_timestamp'}}
+            project = {'_id':False, '_timestamp':'$_id', '_count':True, '_timestamp_max':True}
+            for (idx, key) in enumerate(keys):
+                field = '$'+key
+                group['mean_{:}'.format(idx)] = {'$avg':field}
+                group['count_{:}'.format(idx)] = {'$sum':{'$cond':[{'$isNumber':field}, 1, 0]}}
+                group['sum_{:}'.format(idx)] = {'$sum':field}
+                group['sum_sq_{:}'.format(idx)] = {'$sum':{'$cond':[{'$isNumber':field}, {'$multiply':[field, field]}, 0]}}
+                group['min_{:}'.format(idx)] = {'$min':field}
+                group['max_{:}'.format(idx)] = {'$max':field}
+                group['std_{:}'.format(idx)] = {'$stdDevPop':field}
+                project[key] = '$mean_{:}'.format(idx)
+                project['_stats.'+key] = {
+                    'count':'$count_{:}'.format(idx),
+                    'sum':'$sum_{:}'.format(idx),
+                    'sum_sq':'$sum_sq_{:}'.format(idx),
+                    'min':'$min_{:}'.format(idx),
+                    'max':'$max_{:}'.format(idx),
+                    'std':'$std_{:}'.format(idx)}
+            # Partial intervals are combined with the existing ones
+            pipeline += [
+                {'$group':group},
+                {'$project':project},
+                {'$merge':{'into':rollup.name, 'on':'_timestamp',
+                           'whenMatched':rollup_merge_stages(keys, lambda path: '$$new.'+path),
+                           'whenNotMatched':'insert'}}]
+            source.aggregate(pipeline, allowDiskUse=True)
+
+    def archive_partitions(self, directory, before):
+        '''
+        Moves the record partitions that end at or before the given time out
+            of the database. Each partition is exported to a gzip compressed
+            file of BSON documents, named "<database>.<partition>.bson.gz", in
+            the given directory, and is then dropped. Use read_archive to read
+            the documents of an archived partition. Returns the paths of the
+            new files.
+        Archived documents are no longer returned by read_record. Rollups
+            are kept, so archived periods may still be read at reduced
+            resolution with the "max_points" keyword of read_record.
+
+        *args
+        directory: str, the directory of the archive.
+        before: a datetime.datetime instance, partitions that end after this
+            time are kept.
+        '''
+        if not(self.partitioned):
+            return []
+        if not(os.path.exists(directory)):
+            os.makedirs(directory)
+        paths = []
+        (legacy, partitions) = self._parse_partitions(self.database.list_collection_names())
+        for month in sorted(partitions):
+            if partition_stop(month) > before:
+                continue
+            collection = partitions[month]
+            path = os.path.join(directory, '{:}.{:}.bson.gz'.format(self.database_name, collection.name))
+            with gzip.open(path+'.tmp', 'wb') as f:
+                for batch in collection.find_raw_batches(sort=[('_timestamp', pymongo.ASCENDING)]):
+                    f.write(batch)
+            os.replace(path+'.tmp', path)
+            collection.drop()
+            self.indexed_partitions.discard(month)
+            paths.append(path)
+        self.partitions = None
+        forget_collection_names(self.database)
+        return paths
 
 
 # %% LogMaster ===========================================================
@@ -778,6 +2808,7 @@ class MongoLogBufferHandler(logging.Handler):
             raise TypeError('A LogMaster or LogReadWrite object must be specified. A {:} was specified instead'.format(type(database)))
         self.database_name = database.database_name
         self.write_log_buffer = database.write_log_buffer
+        self.write_log_buffer_batch = database.write_log_buffer_batch
 
     def emit(self, record):
         """
@@ -791,6 +2822,19 @@ class MongoLogBufferHandler(logging.Handler):
         except Exception:
             self.handleError(record)
 
+    def emit_batch(self, records):
+        """
+        Writes a list of records to the log buffer with a single insert. The
+            handler's level and filters are applied to each record, and the
+            timestamps are taken from the record creation times.
+        """
+        try:
+            entries = [(self.format(record), record.levelno, datetime.datetime.utcfromtimestamp(record.created))
+                       for record in records if (record.levelno >= self.level) and self.filter(record)]
+            self.write_log_buffer_batch(entries)
+        except Exception:
+            self.handleError(records[-1])
+
 class MongoLogHandler(logging.Handler):
     """
     A handler class which writes logging records, appropriately formatted,
@@ -808,6 +2852,7 @@ class MongoLogHandler(logging.Handler):
             raise TypeError('A LogMaster or LogReadWrite object must be specified. A {:} was specified instead'.format(type(database)))
         self.database_name = database.database_name
         self.write_log = database.write_log
+        self.write_log_batch = database.write_log_batch
 
     def emit(self, record):
         """
@@ -821,7 +2866,155 @@ class MongoLogHandler(logging.Handler):
         except Exception:
             self.handleError(record)
 
-def MongoLogger(database, name=None, logger_level=logging.DEBUG, log_buffer_handler_level=logging.DEBUG, log_handler_level=logging.WARNING, format_str=None, remove_all_handlers=True):
+    def emit_batch(self, records):
+        """
+        Writes a list of records to the log with a single insert. The
+            handler's level and filters are applied to each record, and the
+            timestamps are taken from the record creation times.
+        """
+        try:
+            entries = [(self.format(record), record.levelno, datetime.datetime.utcfromtimestamp(record.created))
+                       for record in records if (record.levelno >= self.level) and self.filter(record)]
+            self.write_log_batch(entries)
+        except Exception:
+            self.handleError(records[-1])
+
+class MongoLogListener():
+    """
+    Writes logging records from a queue to the Mongo log handlers in batches.
+        Records are collected by a MongoLogQueueHandler and written by a
+        daemon thread once "batch_size" records have accumulated or
+        "flush_interval" seconds have passed. Records at or above the
+        "flush_level" are written as soon as they are received, so that
+        warnings and errors are not lost if the process crashes. This keeps
+        database round trips out of the threads that emit log records.
+    Consecutive duplicate records within a batch are written once, with the
+        number of repetitions appended to the message. If the queue is full,
+        new records are dropped and counted by message. A summary of the
+        dropped messages is written with the next batch.
+    """
+    def __init__(self, handlers, max_queue_size=10000, batch_size=100, flush_interval=1., flush_level=logging.WARNING):
+        """
+        handlers: a list of handlers with an "emit_batch" method, i.e.
+            MongoLogBufferHandler and MongoLogHandler.
+        max_queue_size: int, the maximum number of queued records.
+        batch_size: int, the number of records that triggers a write.
+        flush_interval: float, the maximum time in seconds between writes.
+        flush_level: int, the minimum level of records that trigger an
+            immediate write.
+        """
+        self.handlers = handlers
+        self.queue = queue.Queue(maxsize=int(max_queue_size))
+        self.batch_size = int(batch_size)
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+        self.dropped = {}
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._monitor, name='mongo_log_listener', daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def enqueue(self, record):
+        """
+        Queues a record without blocking. Records are dropped and counted if
+            the queue is full.
+        """
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            key = (record.name, record.levelno, record.getMessage())
+            with self.lock:
+                self.dropped[key] = self.dropped.get(key, 0) + 1
+
+    def stop(self):
+        """Writes all queued records and stops the listener thread."""
+        atexit.unregister(self.stop)
+        if self.thread.is_alive():
+            self._stop_event.set()
+            self.thread.join()
+
+    def _monitor(self):
+        batch = []
+        last_flush = time.time()
+        while True:
+            timeout = self.flush_interval - (time.time() - last_flush)
+            urgent = False
+            try:
+                record = self.queue.get(timeout=max(timeout, 0))
+                batch.append(record)
+                urgent = (record.levelno >= self.flush_level)
+                empty = False
+            except queue.Empty:
+                empty = True
+            stopping = self._stop_event.is_set()
+            if urgent or (len(batch) >= self.batch_size) or (time.time() - last_flush >= self.flush_interval) or (stopping and empty):
+                self._flush(batch)
+                batch = []
+                last_flush = time.time()
+            if stopping and empty:
+                break
+
+    def _flush(self, batch):
+    # Aggregate consecutive duplicates
+        aggregated = []
+        for record in batch:
+            if len(aggregated):
+                (last, count) = aggregated[-1]
+                if (last.name, last.levelno, last.getMessage()) == (record.name, record.levelno, record.getMessage()):
+                    aggregated[-1] = (last, count+1)
+                    continue
+            aggregated.append((record, 1))
+        records = []
+        for (record, count) in aggregated:
+            if count > 1:
+                record.msg = '{:} [repeated {:} times]'.format(record.getMessage(), count)
+                record.args = None
+            records.append(record)
+    # Summarize dropped records
+        with self.lock:
+            dropped = self.dropped
+            self.dropped = {}
+        for ((name, levelno, msg), count) in dropped.items():
+            records.append(logging.makeLogRecord({
+                'name':name, 'levelno':levelno, 'levelname':logging.getLevelName(levelno),
+                'msg':'{:} [dropped {:} times, log queue full]'.format(msg, count)}))
+    # Write
+        if len(records):
+            for handler in self.handlers:
+                handler.emit_batch(records)
+
+class MongoLogQueueHandler(logging.handlers.QueueHandler):
+    """
+    A handler that passes logging records to a MongoLogListener without
+        blocking on the database. The resulting handler object will have a
+        'database_name' attribute that can be used to identify the handler's
+        destination.
+    """
+    def __init__(self, listener, database_name):
+        logging.handlers.QueueHandler.__init__(self, listener.queue)
+        self.listener = listener
+        self.database_name = database_name
+
+    def prepare(self, record):
+        """
+        Merges the message arguments into a copy of the record. Unlike the
+            base class, the record is not formatted here, as the Mongo
+            handlers format it when it is written.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        self.listener.enqueue(record)
+
+    def close(self):
+        self.listener.stop()
+        logging.handlers.QueueHandler.close(self)
+
+def MongoLogger(database, name=None, logger_level=logging.DEBUG, log_buffer_handler_level=logging.DEBUG, log_handler_level=logging.WARNING, format_str=None, remove_all_handlers=True, queued=False, batch_size=100, flush_interval=1.):
     '''
     Returns a logger instance whose handler writes to the given database's log
         buffer. This is a helper function used to simplify logger setup.
@@ -836,6 +3029,11 @@ def MongoLogger(database, name=None, logger_level=logging.DEBUG, log_buffer_hand
     The logger_level and handler_level respectively specify the minimum log
         level sent to the handler from the logger and from the handler to the
         database.
+    Records are written as they are emitted unless "queued" is selected, in
+        which case they are written in batches by a MongoLogListener so that
+        logging calls do not wait on the database. Each queued logger starts
+        its own listener thread. Records below WARNING may be lost if the
+        process crashes before they are written.
     See the logging documentation for details on the format string.
 
     *args
@@ -848,6 +3046,11 @@ def MongoLogger(database, name=None, logger_level=logging.DEBUG, log_buffer_hand
     handler_level: int, minimum logging level that the handler will log
     format_str: str, used to specify custom message formating
     remove_all_handlers: bool, remove all handlers before adding the new ones
+    queued: bool, selects to write records in batches from a background
+        thread instead of writing each record as it is emitted. WARNING and
+        higher records are written immediately.
+    batch_size: int, the number of queued records that triggers a write
+    flush_interval: float, the maximum time in seconds between queued writes
     '''
 # Create logger
     logger = logging.getLogger(name)
@@ -866,18 +3069,29 @@ def MongoLogger(database, name=None, logger_level=logging.DEBUG, log_buffer_hand
         mongo_log_handler.setFormatter(formatter)
 # Remove redundant or old handlers
     old_handlers = logger.handlers
-    for handler in old_handlers:
+    for handler in list(old_handlers):
         if remove_all_handlers:
             logger.removeHandler(handler)
+            if isinstance(handler, MongoLogQueueHandler):
+                handler.close()
         else:
             try:
                 if handler.database_name == database.database_name:
                     logger.removeHandler(handler)
+                    if isinstance(handler, MongoLogQueueHandler):
+                        handler.close()
             except:
                 pass
 # Add handlers to logger
-    logger.addHandler(mongo_log_buffer_handler)
-    logger.addHandler(mongo_log_handler)
+    if queued:
+        listener = MongoLogListener([mongo_log_buffer_handler, mongo_log_handler],
+                                    batch_size=batch_size, flush_interval=flush_interval)
+        queue_handler = MongoLogQueueHandler(listener, database.database_name)
+        queue_handler.setLevel(min(log_buffer_handler_level, log_handler_level))
+        logger.addHandler(queue_handler)
+    else:
+        logger.addHandler(mongo_log_buffer_handler)
+        logger.addHandler(mongo_log_handler)
 # Return logger object
     return logger
 
@@ -0,0 +1,569 @@
+# -*- coding: utf-8 -*-
+"""
+An in-memory backend for the MongoDB module. Use it to run and benchmark the
+database classes without a running mongod.
+"""
+# %% Modules ==================================================================
+
+import pymongo
+import pymongo.errors
+import pymongo.results
+import bson
+import bson.codec_options
+import bisect
+import copy
+import threading
+
+from Drivers.Database.MongoDB import DUPLICATE_KEY_ERROR
+
+
+# %% In-Memory Backend ========================================================
+
+COMPARISON_OPERATORS = {
+    '$gt':lambda value, arg: value > arg,
+    '$gte':lambda value, arg: value >= arg,
+    '$lt':lambda value, arg: value < arg,
+    '$lte':lambda value, arg: value <= arg,
+    '$eq':lambda value, arg: value == arg,
+    '$ne':lambda value, arg: value != arg,
+    '$in':lambda value, arg: value in arg,
+    '$nin':lambda value, arg: not(value in arg),
+    }
+
+class MemoryClient():
+    def __init__(self, host='localhost', port=27017, **kwargs):
+        '''
+        An in-process stand-in for the subset of the pymongo client used by the
+            MongoDB module. All databases are kept in the memory of the current
+            process. Pass MemoryClient as the "backend" of a MongoClient to run
+            the database classes without a mongod, i.e.
+            MongoDB.MongoClient(backend=MongoMemory.MemoryClient)
+        The backend supports capped collections, tailable cursors, single field
+            indexes (used for "_timestamp" range queries), insert_one,
+            insert_many, bulk writes of InsertOne requests, replace_one,
+            delete_one, and find_raw_batches.
+            Filters support equality and the $gt, $gte, $lt, $lte, $eq, $ne,
+            $in, $nin and $exists operators. TTL indexes do not expire
+            documents. Aggregation pipelines, update operators and
+            change streams are not supported, so time bucketed records,
+            rollups and live replication still require a mongod.
+        The host, port and any other keyword arguments are accepted for
+            compatibility and ignored.
+        '''
+        self.lock = threading.RLock()
+        self.databases = {}
+
+    def __getitem__(self, name):
+        with self.lock:
+            if not(name in self.databases):
+                self.databases[name] = MemoryDatabase(self, name)
+            return self.databases[name]
+
+    def list_database_names(self):
+        with self.lock:
+            return [name for (name, database) in self.databases.items() if len(database.collections)]
+
+    def drop_database(self, name):
+        with self.lock:
+            self.databases.pop(getattr(name, 'name', name), None)
+
+    def server_info(self):
+        '''Reports version 0.0, as the backend supports no version dependent
+        server features.'''
+        return {'version':'0.0.0', 'versionArray':[0, 0, 0, 0]}
+
+    def close(self):
+        pass
+
+class MemoryDatabase():
+    def __init__(self, client, name):
+        '''A pymongo.database.Database compatible container of collections.'''
+        self.client = client
+        self.name = name
+        self.lock = threading.RLock()
+        self.collections = {}
+        self.handles = {}
+
+    def __getitem__(self, name):
+        with self.lock:
+            if not(name in self.handles):
+                self.handles[name] = MemoryCollection(self, name)
+            return self.handles[name]
+
+    def get_collection(self, name, codec_options=None, **kwargs):
+        '''
+        Returns a handle to the collection. Documents read through the handle
+            are decoded with the codec options, if given.
+        '''
+        if codec_options is None:
+            return self[name]
+        return MemoryCollection(self, name, codec_options=codec_options)
+
+    def _storage(self, name, create=True):
+        '''
+        A helper function for MemoryCollection. Collections are created on
+            first write, as in MongoDB.
+        '''
+        with self.lock:
+            if create and not(name in self.collections):
+                self.collections[name] = Storage()
+            return self.collections.get(name)
+
+    def list_collection_names(self, filter=None):
+        with self.lock:
+            names = list(self.collections.keys())
+        if (filter is not None) and ('name' in filter):
+            names = [name for name in names if _match({'name':name}, {'name':filter['name']})]
+        return names
+
+    def create_collection(self, name, capped=False, size=None, max=None, **kwargs):
+        with self.lock:
+            if name in self.collections:
+                raise pymongo.errors.CollectionInvalid('collection {:} already exists'.format(name))
+            self.collections[name] = Storage(capped=capped, size=size, max=max)
+        return self[name]
+
+    def drop_collection(self, name):
+        with self.lock:
+            self.collections.pop(getattr(name, 'name', name), None)
+
+    def command(self, command):
+        if 'convertToCapped' in command:
+            storage = self._storage(command['convertToCapped'])
+            with storage.lock:
+                storage.capped = True
+                storage.size = command['size']
+                for (sequence, document) in storage.documents.items():
+                    storage.sizes[sequence] = len(bson.BSON.encode(document))
+                storage.total_size = sum(storage.sizes.values())
+                storage.evict()
+            return {'ok':1.}
+        raise NotImplementedError('command {:} is not supported'.format(list(command)[0]))
+
+class Storage():
+    def __init__(self, capped=False, size=None, max=None):
+        '''
+        A helper class for MemoryCollection that holds the documents of one
+            collection. Documents are kept in natural (insertion) order and
+            are identified by an incrementing sequence number. The sequence
+            numbers are used by tailable cursors to find new documents.
+        '''
+        self.lock = threading.RLock()
+        self.capped = capped
+        self.size = size
+        self.max = max
+        self.documents = {} # sequence:document
+        self.sizes = {} # sequence:bytes
+        self.total_size = 0
+        self.ids = {} # _id:sequence
+        self.indexes = {} # key:[(value, sequence), ...]
+        self.unique = set()
+        self.sequence = 0
+
+    def insert(self, document):
+        '''Inserts a copy of the document. The caller must hold the lock.'''
+        if document['_id'] in self.ids:
+            raise pymongo.errors.DuplicateKeyError('E11000 duplicate key error _id: {:}'.format(document['_id']), DUPLICATE_KEY_ERROR)
+        for key in self.unique:
+            if key in document:
+                index = self.indexes[key]
+                position = bisect.bisect_left(index, (document[key],))
+                if (position < len(index)) and (index[position][0] == document[key]):
+                    raise pymongo.errors.DuplicateKeyError('E11000 duplicate key error {:}: {:}'.format(key, document[key]), DUPLICATE_KEY_ERROR)
+        self.sequence += 1
+        self.documents[self.sequence] = copy.deepcopy(document)
+        self.ids[document['_id']] = self.sequence
+        for (key, index) in self.indexes.items():
+            if key in document:
+                bisect.insort(index, (document[key], self.sequence))
+        if self.capped:
+            self.sizes[self.sequence] = len(bson.BSON.encode(document))
+            self.total_size += self.sizes[self.sequence]
+            self.evict()
+
+    def evict(self):
+        '''Removes the oldest documents from a full capped collection.'''
+        while len(self.documents) > 1 and (
+                ((self.size is not None) and (self.total_size > self.size)) or
+                ((self.max is not None) and (len(self.documents) > self.max))):
+            self.remove(next(iter(self.documents)))
+
+    def remove(self, sequence):
+        '''Removes a document. The caller must hold the lock.'''
+        document = self.documents.pop(sequence)
+        self.total_size -= self.sizes.pop(sequence, 0)
+        self.ids.pop(document['_id'], None)
+        for (key, index) in self.indexes.items():
+            if key in document:
+                position = bisect.bisect_left(index, (document[key], sequence))
+                if (position < len(index)) and (index[position][1] == sequence):
+                    index.pop(position)
+
+    def create_index(self, key, unique=False):
+        if not(key in self.indexes):
+            index = [(document[key], sequence) for (sequence, document) in self.documents.items() if key in document]
+            index.sort()
+            self.indexes[key] = index
+        if unique:
+            self.unique.add(key)
+
+    def index_range(self, key, condition):
+        '''
+        Returns the (low, high) positions in the index of the given key that
+            bound the values satisfying the condition.
+        '''
+        index = self.indexes[key]
+        (low, high) = (0, len(index))
+        if not(isinstance(condition, dict)):
+            condition = {'$eq':condition}
+        for (operator, arg) in condition.items():
+            if operator in ['$gte', '$eq']:
+                low = max(low, bisect.bisect_left(index, (arg,)))
+            if operator == '$gt':
+                low = max(low, bisect.bisect_right(index, (arg, float('inf'))))
+            if operator in ['$lte', '$eq']:
+                high = min(high, bisect.bisect_right(index, (arg, float('inf'))))
+            if operator == '$lt':
+                high = min(high, bisect.bisect_left(index, (arg,)))
+        return (low, high)
+
+    def scan(self, query, sort=None):
+        '''
+        Returns an iterator over the sequence numbers of the documents that may
+            match the query, and whether the iterator is already in sort order.
+            An index is used if the query constrains an indexed key, or if the
+            results are sorted by a single indexed key. The caller must hold
+            the lock while iterating.
+        '''
+        query = query or {}
+        sort = sort or [('$natural', pymongo.ASCENDING)]
+        (sort_key, direction) = sort[0]
+        descending = (direction == pymongo.DESCENDING)
+        ordered = (len(sort) == 1)
+    # Select an index
+        index_key = None
+        for key in query:
+            if key in self.indexes:
+                index_key = key
+                break
+        if ordered and (sort_key in self.indexes) and ((sort_key in query) or (len(self.indexes[sort_key]) == len(self.documents))):
+            # Documents without the key are not in the index
+            index_key = sort_key
+    # Natural order
+        if index_key is None:
+            if ordered and (sort_key == '$natural'):
+                return ((reversed(self.documents) if descending else iter(self.documents)), True)
+            return (iter(self.documents), False)
+    # Index order
+        index = self.indexes[index_key]
+        (low, high) = self.index_range(index_key, query.get(index_key, {}))
+        positions = range(high-1, low-1, -1) if descending else range(low, high)
+        if ordered and (sort_key == index_key):
+            return ((index[position][1] for position in positions), True)
+        sequences = sorted(index[position][1] for position in positions)
+        if ordered and (sort_key == '$natural'):
+            return ((reversed(sequences) if descending else iter(sequences)), True)
+        return (iter(sequences), False)
+
+    def tail(self, after):
+        '''
+        Returns the sequence numbers of the documents inserted after the given
+            sequence number, in natural order.
+        '''
+        sequences = []
+        for sequence in reversed(self.documents):
+            if sequence <= after:
+                break
+            sequences.append(sequence)
+        return sequences[::-1]
+
+class MemoryCollection():
+    def __init__(self, database, name, codec_options=None):
+        '''
+        A pymongo.collection.Collection compatible handle to a collection. If
+            codec options are given, returned documents are round tripped
+            through BSON so that custom type decoders are applied.
+        '''
+        self.database = database
+        self.name = name
+        self.full_name = '{:}.{:}'.format(database.name, name)
+        self.decode = (codec_options is not None)
+        if codec_options is None:
+            codec_options = bson.codec_options.DEFAULT_CODEC_OPTIONS
+        self.codec_options = codec_options
+
+    def _storage(self, create=True):
+        return self.database._storage(self.name, create=create)
+
+    def _decode(self, document):
+        if self.decode:
+            return bson.decode(bson.encode(document), codec_options=self.codec_options)
+        return document
+
+    def options(self):
+        storage = self._storage(create=False)
+        if (storage is None) or not(storage.capped):
+            return {}
+        options = {'capped':True, 'size':storage.size}
+        if storage.max is not None:
+            options['max'] = storage.max
+        return options
+
+    def create_index(self, keys, unique=False, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, pymongo.ASCENDING)]
+        storage = self._storage()
+        with storage.lock:
+            # Only the first key of a compound index is used for lookups
+            storage.create_index(keys[0][0], unique=(unique and (len(keys) == 1)))
+        return '_'.join('{:}_{:}'.format(*key) for key in keys)
+
+    def drop(self):
+        self.database.drop_collection(self.name)
+
+    def insert_one(self, document, **kwargs):
+        if not('_id' in document):
+            document['_id'] = bson.ObjectId()
+        storage = self._storage()
+        with storage.lock:
+            storage.insert(document)
+        return pymongo.results.InsertOneResult(document['_id'], True)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        storage = self._storage()
+        inserted_ids = []
+        write_errors = []
+        with storage.lock:
+            for (index, document) in enumerate(documents):
+                if not('_id' in document):
+                    document['_id'] = bson.ObjectId()
+                try:
+                    storage.insert(document)
+                except pymongo.errors.DuplicateKeyError as error:
+                    write_errors.append({'index':index, 'code':DUPLICATE_KEY_ERROR, 'errmsg':str(error), 'op':document})
+                    if ordered:
+                        break
+                else:
+                    inserted_ids.append(document['_id'])
+        if write_errors:
+            raise pymongo.errors.BulkWriteError({
+                'writeErrors':write_errors, 'writeConcernErrors':[],
+                'nInserted':len(inserted_ids), 'nUpserted':0, 'nMatched':0,
+                'nModified':0, 'nRemoved':0, 'upserted':[]})
+        return pymongo.results.InsertManyResult(inserted_ids, True)
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        documents = []
+        for request in requests:
+            if not(isinstance(request, pymongo.InsertOne)):
+                raise NotImplementedError('only InsertOne requests are supported')
+            documents.append(request._doc)
+        self.insert_many(documents, ordered=ordered)
+
+    def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        '''
+        Replaces the first document that matches the filter. The replacement
+            is moved to the end of the natural order.
+        '''
+        storage = self._storage()
+        with storage.lock:
+            (sequences, ordered) = storage.scan(filter)
+            sequence = next((sequence for sequence in sequences if _match(storage.documents[sequence], filter)), None)
+            if (sequence is None) and not(upsert):
+                return pymongo.results.UpdateResult({'n':0, 'nModified':0}, True)
+            replacement = dict(replacement)
+            if sequence is not None:
+                replacement['_id'] = storage.documents[sequence]['_id']
+                storage.remove(sequence)
+                storage.insert(replacement)
+                return pymongo.results.UpdateResult({'n':1, 'nModified':1}, True)
+            if not('_id' in replacement):
+                replacement['_id'] = filter['_id'] if ('_id' in (filter or {})) else bson.ObjectId()
+            storage.insert(replacement)
+            return pymongo.results.UpdateResult({'n':1, 'nModified':0, 'upserted':replacement['_id']}, True)
+
+    def delete_one(self, filter, **kwargs):
+        storage = self._storage()
+        with storage.lock:
+            (sequences, ordered) = storage.scan(filter)
+            sequence = next((sequence for sequence in sequences if _match(storage.documents[sequence], filter)), None)
+            if sequence is not None:
+                storage.remove(sequence)
+        return pymongo.results.DeleteResult({'n':int(sequence is not None)}, True)
+
+    def find(self, filter=None, projection=None, skip=0, limit=0, sort=None, cursor_type=pymongo.cursor.CursorType.NON_TAILABLE, batch_size=0, **kwargs):
+        return MemoryCursor(self, filter, projection, skip, limit, sort,
+                            tailable=(cursor_type != pymongo.cursor.CursorType.NON_TAILABLE))
+
+    def find_raw_batches(self, filter=None, projection=None, skip=0, limit=0, sort=None, batch_size=0, **kwargs):
+        '''Yields the results of find as batches of concatenated BSON documents.'''
+        batch = []
+        for document in self.find(filter, projection=projection, skip=skip, limit=limit, sort=sort):
+            batch.append(bson.encode(document))
+            if batch_size and (len(batch) >= batch_size):
+                yield b''.join(batch)
+                batch = []
+        if len(batch):
+            yield b''.join(batch)
+
+    def find_one(self, filter=None, *args, **kwargs):
+        kwargs['limit'] = 1
+        return next(self.find(filter, *args, **kwargs), None)
+
+    def estimated_document_count(self, **kwargs):
+        storage = self._storage(create=False)
+        return 0 if (storage is None) else len(storage.documents)
+
+    def count_documents(self, filter, skip=0, limit=0, **kwargs):
+        count = len(list(self.find(filter, projection=['_id'], skip=skip, limit=limit)))
+        return count
+
+class MemoryCursor():
+    def __init__(self, collection, filter, projection, skip, limit, sort, tailable):
+        '''
+        A pymongo.cursor.Cursor compatible cursor. Results are evaluated on
+            the first call to next. A tailable cursor remains alive after it
+            is exhausted, and subsequent iterations return documents inserted
+            after the last returned document. As in MongoDB, a tailable cursor
+            dies if its initial query has no results, or if the last returned
+            document is removed from a capped collection.
+        '''
+        self.collection = collection
+        self.filter = filter
+        self.projection = projection
+        self.skip = skip
+        self.limit = limit
+        self.sort = sort
+        self.tailable = tailable
+        self.alive = True
+        self.results = None
+        self.last_sequence = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.results is None:
+            self.results = self._query()
+            if not(self.results):
+                self.alive = False
+        elif self.tailable and self.alive and not(self.results):
+            self.results = self._tail()
+        if self.results:
+            (sequence, document) = self.results.pop(0)
+            self.last_sequence = sequence
+            return document
+        if not(self.tailable):
+            self.alive = False
+        raise StopIteration
+
+    def next(self):
+        return self.__next__()
+
+    def batch_size(self, batch_size):
+        return self
+
+    def close(self):
+        self.alive = False
+        self.results = []
+
+    def _query(self):
+        storage = self.collection._storage(create=False)
+        if storage is None:
+            return []
+        count = (self.skip + abs(self.limit)) if self.limit else None
+        with storage.lock:
+            (sequences, ordered) = storage.scan(self.filter, self.sort)
+            results = []
+            for sequence in sequences:
+                document = storage.documents[sequence]
+                if _match(document, self.filter):
+                    results.append((sequence, document))
+                    if ordered and (count is not None) and (len(results) >= count):
+                        break
+        if not(ordered):
+            results = _sort(results, self.sort)
+        results = results[self.skip:]
+        if count is not None:
+            results = results[:abs(self.limit)]
+        return [(sequence, self.collection._decode(_project(document, self.projection))) for (sequence, document) in results]
+
+    def _tail(self):
+        storage = self.collection._storage(create=False)
+        if storage is None:
+            self.alive = False
+            return []
+        with storage.lock:
+            if (self.last_sequence is not None) and not(self.last_sequence in storage.documents):
+                # The position of the cursor was overwritten
+                self.alive = False
+                return []
+            results = [(sequence, storage.documents[sequence]) for sequence in storage.tail(self.last_sequence or 0)]
+            results = [(sequence, document) for (sequence, document) in results if _match(document, self.filter)]
+        return [(sequence, self.collection._decode(_project(document, self.projection))) for (sequence, document) in results]
+
+
+# %% Helper Functions =========================================================
+
+def _match(document, query):
+    '''Returns if the document satisfies the query.'''
+    for (key, condition) in (query or {}).items():
+        exists = key in document
+        value = document.get(key)
+        if isinstance(condition, dict) and condition and all(operator.startswith('$') for operator in condition):
+            for (operator, arg) in condition.items():
+                if operator == '$exists':
+                    if exists != bool(arg):
+                        return False
+                elif operator in COMPARISON_OPERATORS:
+                    if not(exists) and not(operator in ['$ne', '$nin']):
+                        return False
+                    try:
+                        if not(COMPARISON_OPERATORS[operator](value, arg)):
+                            return False
+                    except TypeError:
+                        return False
+                else:
+                    raise NotImplementedError('query operator {:} is not supported'.format(operator))
+        elif not(exists and (value == condition)):
+            return False
+    return True
+
+def _sort(results, sort):
+    '''Sorts (sequence, document) pairs by the given sort specification.'''
+    for (key, direction) in reversed(sort or []):
+        reverse = (direction == pymongo.DESCENDING)
+        if key == '$natural':
+            results = sorted(results, key=lambda result: result[0], reverse=reverse)
+        else:
+            # Documents without the key sort before all others
+            results = sorted(results, key=lambda result: (key in result[1], result[1].get(key)), reverse=reverse)
+    return results
+
+def _project(document, projection):
+    '''Returns a copy of the document that only includes the projected keys.'''
+    document = copy.deepcopy(document)
+    if projection is None:
+        return document
+    if not(isinstance(projection, dict)):
+        projection = {key:True for key in projection}
+    include_id = projection.get('_id', True)
+    fields = {key:value for (key, value) in projection.items() if key != '_id'}
+    slices = {key:value['$slice'] for (key, value) in fields.items() if isinstance(value, dict)}
+    inclusion = [key for (key, value) in fields.items() if not(isinstance(value, dict)) and value]
+    exclusion = [key for (key, value) in fields.items() if not(isinstance(value, dict)) and not(value)]
+    if inclusion:
+        document = {key:value for (key, value) in document.items() if (key in inclusion) or (key in slices) or (key == '_id')}
+    for key in exclusion:
+        document.pop(key, None)
+    for (key, value) in slices.items():
+        if isinstance(document.get(key), list):
+            if isinstance(value, list):
+                document[key] = document[key][value[0]:][:value[1]]
+            elif value >= 0:
+                document[key] = document[key][:value]
+            else:
+                document[key] = document[key][value:]
+    if not(include_id):
+        document.pop('_id', None)
+    return document
@@ -13,15 +13,27 @@ import datetime
 import sys
 import traceback
 import gc
+import copy
 
 import threading
+import concurrent.futures
+import itertools
+import queue
+import heapq
+import bisect
+import json
+import os
 from functools import wraps
 
 import logging
 from Drivers.Logging import EventLog as log
 
 from Drivers.Database import MongoDB
-from Drivers.Database import CouchbaseDB
+from Drivers.Database import LocalQueue
+try:
+    from Drivers.Database import CouchbaseDB
+except ImportError:
+    CouchbaseDB = None
 
 
 # %% Helper Functions =========================================================
@@ -30,13 +42,91 @@ from Drivers.Database import CouchbaseDB
     this script.'''
 
 
+# %% Worker Pool
+WORKER_IDLE_TIME = 60. # seconds before an idle worker exits
+class WorkerPool():
+    def __init__(self, idle_time=WORKER_IDLE_TIME):
+        '''A pool of daemon worker threads that execute the routines of pooled
+        ThreadFactory objects. A submitted routine runs on an idle worker if
+        there is one, otherwise a new worker is started, so routines never
+        wait for each other and a routine that blocks, i.e. on a hung device
+        read, only holds its own worker. Workers are reused by later routines
+        and exit once they have been idle for "idle_time" seconds. As with
+        daemon threads, running routines do not delay the exit of the
+        interpreter.
+        '''
+        self.idle_time = idle_time
+        self.tasks = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.idle = 0 # idle workers less the queued tasks
+        self.workers = 0
+        self.counter = itertools.count(1)
+
+    def submit(self, func, *args, **kwargs):
+        '''Executes the function on a worker and returns its future.'''
+        future = concurrent.futures.Future()
+        with self.lock:
+            self.tasks.put((future, func, args, kwargs))
+            if self.idle > 0:
+                self.idle -= 1
+            else:
+                self.workers += 1
+                thread = threading.Thread(target=self._work, name='worker-{:}'.format(next(self.counter)), daemon=True)
+                thread.start()
+        return future
+
+    def _work(self):
+        while True:
+            try:
+                (future, func, args, kwargs) = self.tasks.get(timeout=self.idle_time)
+            except queue.Empty:
+                with self.lock:
+                    # Tasks submitted while timing out are still served
+                    if self.tasks.empty():
+                        self.idle -= 1
+                        self.workers -= 1
+                        return
+                continue
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = func(*args, **kwargs)
+                except BaseException as error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            # Release references before idling
+            del future, func, args, kwargs
+            result = error = None
+            with self.lock:
+                self.idle += 1
+
+_executor = None
+_executor_lock = threading.Lock()
+def get_executor():
+    '''Returns the worker pool shared by all pooled ThreadFactory objects, see
+    `WorkerPool`. The pool is created on first use.
+    '''
+    global _executor
+    with _executor_lock:
+        if (_executor is None):
+            _executor = WorkerPool()
+        return _executor
+
+
 # %% Threading Error Handling
 class ThreadFactory():
     @log.log_this()
-    def __init__(self, group=None, target=None, name=None, args=[], kwargs={}, daemon=True):
+    def __init__(self, group=None, target=None, name=None, args=[], kwargs={}, daemon=True, pooled=True):
         '''The ThreadFactory works similarly to a standard threading.Thread(),
         but with added routines to catch thread errors and start new threads
         without having to reinitialize a new object.
+
+        By default the target executes as a future on the shared pool of
+        daemon worker threads (see "WorkerPool") each time the factory is
+        started, which avoids creating a thread per execution. Set "pooled"
+        to False to run the target on a new dedicated thread instead. The
+        "group", "name", and "daemon" arguments only apply to dedicated
+        threads.
         '''
         self.group = group
         self.target = target
@@ -44,6 +134,9 @@ class ThreadFactory():
         self.args = args
         self.kwargs = kwargs
         self.daemon = daemon
+        self.pooled = pooled
+        self.future = None
+        self.handled = None
         self.result = None
         self.error = None
         self.lock = threading.Lock()
@@ -78,11 +171,32 @@ class ThreadFactory():
                         self.error = None
         return handle_thread
 
+    def _handle_future(self, future):
+        '''Records the result or error of a pooled execution. Only the most
+        recent future is recorded, and each future is only recorded once.
+        '''
+        with self.lock:
+            if (future is self.future) and not(future is self.handled) and future.done() and not(future.cancelled()):
+                self.handled = future
+                error = future.exception()
+                if (error != None):
+                    self.result = None
+                    self.error = (type(error), error, error.__traceback__)
+                else:
+                    self.result = future.result()
+                    self.error = None
+
     @log.log_this()
     def new_thread(self):
         '''Initialzes a new threading.Thread() object
         '''
         with self.lock:
+            if self.pooled:
+                self.thread = None
+                self.future = None
+                self.result = None
+                self.error = None
+                return
             self.thread = threading.Thread(group=self.group,
                                            target=self._handle_thread(self.target),
                                            name=self.name,
@@ -96,6 +210,15 @@ class ThreadFactory():
     def start(self):
         '''Starts a new thread, creating one if need be.
         '''
+        if self.pooled:
+        # Submit to the worker pool
+            with self.lock:
+                self.result = None
+                self.error = None
+                self.future = get_executor().submit(self.target, *self.args, **self.kwargs)
+                future = self.future
+            future.add_done_callback(self._handle_future)
+            return
     # Check for old thread
         if (self.thread.ident != None):
         # Initialize new thread
@@ -106,11 +229,21 @@ class ThreadFactory():
     @log.log_this()
     def join(self):
         '''Blocks until the most recent thread has completed execution.'''
-        self.thread.join()
+        if self.pooled:
+            future = self.future
+            if (future != None):
+                concurrent.futures.wait([future])
+                # Done callbacks may not have run yet
+                self._handle_future(future)
+        else:
+            self.thread.join()
 
     @log.log_this()
     def is_alive(self):
         '''Returns if the most recent thread is alive'''
+        if self.pooled:
+            future = self.future
+            return (future != None) and not(future.done())
         return self.thread.is_alive()
 
     @log.log_this()
@@ -120,6 +253,8 @@ class ThreadFactory():
         using this method.
         '''
         alive = self.is_alive()
+        if self.pooled and not(alive) and (self.future != None):
+            self._handle_future(self.future)
         error = self.error
         if (error != None):
         # Remove Error
@@ -128,6 +263,319 @@ class ThreadFactory():
         return (alive, error)
 
 
+# %% Scheduler
+class Scheduler():
+    def __init__(self):
+        '''The Scheduler paces the loops of the state machine. Each loop is
+        identified by a key and waits on the scheduler until its next timer is
+        due, or until it is woken early by a call to "wake", i.e. after a new
+        control message. Timers are kept in a priority queue ordered by the
+        monotonic clock, which is served by a single daemon thread, so waiting
+        loops use no CPU and are unaffected by changes to the system clock.
+        '''
+        self.condition = threading.Condition()
+        self.timers = [] # heap of (due time, key)
+        self.due = {} # key:due time
+        self.events = {} # key:threading.Event
+        self.thread = threading.Thread(target=self._dispatch, name='scheduler', daemon=True)
+        self.thread.start()
+
+    def _event(self, key):
+        with self.condition:
+            if not(key in self.events):
+                self.events[key] = threading.Event()
+            return self.events[key]
+
+    def schedule(self, key, interval):
+        '''Schedules the next timer of the key one interval after its previous
+        timer. A timer that is still pending, because the loop was woken early,
+        is kept. If the next timer would already be overdue it is set to fire
+        immediately, and the time by which the loop has fallen behind is
+        returned. Otherwise 0 is returned.
+        '''
+        now = time.monotonic()
+        lag = 0
+        with self.condition:
+            due = self.due.get(key, None)
+            if (due is None):
+                due = now + interval
+            elif (due > now):
+                return lag
+            else:
+                due += interval
+                if due <= now:
+                    lag = now - due
+                    due = now
+            self.due[key] = due
+            heapq.heappush(self.timers, (due, key))
+            self.condition.notify()
+        return lag
+
+    def wait(self, key):
+        '''Blocks until the timer of the key is due or the key is woken.'''
+        event = self._event(key)
+        event.wait()
+        event.clear()
+
+    def wake(self, keys=None):
+        '''Wakes the loops of the given keys, or of all keys if unspecified.'''
+        with self.condition:
+            if keys is None:
+                keys = list(self.events.keys())
+        for key in keys:
+            self._event(key).set()
+
+    def _dispatch(self):
+        '''Fires the timers in order of their due times.'''
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                while len(self.timers) and (self.timers[0][0] <= now):
+                    (due, key) = heapq.heappop(self.timers)
+                    # Skip timers that have been superseded
+                    if self.due.get(key, None) == due:
+                        self._event(key).set()
+                if len(self.timers):
+                    self.condition.wait(self.timers[0][0] - now)
+                else:
+                    self.condition.wait()
+
+
+# %% Ring Buffer
+class RingBuffer():
+    def __init__(self, length, dtype=float, shape=()):
+        '''A fixed capacity rolling buffer for monitors. The storage is
+        preallocated with the given dtype and the shape of a single sample.
+
+        Each sample is written twice, one capacity apart, so that the ordered
+        contents are always a contiguous slice of the storage. Pushing a sample
+        is therefore O(1) and "view" returns the ordered samples without
+        copying. The mean and variance of the buffered samples are maintained
+        incrementally as samples are added and evicted.
+
+        The buffer supports len, indexing, slicing and iteration like a list,
+        and can be passed directly to numpy functions.
+        '''
+        self.length = int(length)
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.storage = np.zeros((2*self.length,)+self.shape, dtype=self.dtype)
+        self.clear()
+
+    def clear(self):
+        '''Removes all samples from the buffer.'''
+        self.start = 0
+        self.size = 0
+        self._mean = np.zeros(self.shape)
+        self._m2 = np.zeros(self.shape)
+
+    def _add(self, value):
+        '''Adds a sample to the running statistics (Welford's algorithm).'''
+        self.size += 1
+        delta = value - self._mean
+        self._mean = self._mean + delta/self.size
+        self._m2 = self._m2 + delta*(value - self._mean)
+
+    def _remove(self, value):
+        '''Removes a sample from the running statistics.'''
+        self.size -= 1
+        if self.size == 0:
+            self._mean = np.zeros(self.shape)
+            self._m2 = np.zeros(self.shape)
+        else:
+            delta = value - self._mean
+            self._mean = self._mean - delta/self.size
+            self._m2 = self._m2 - delta*(value - self._mean)
+
+    def push(self, value):
+        '''Appends a single sample, evicting the oldest sample if full.'''
+        value = np.asarray(value, dtype=self.dtype)
+        if self.size == self.length:
+            self._remove(self.storage[self.start].astype(float))
+            self.start = (self.start + 1) % self.length
+        index = (self.start + self.size) % self.length
+        self.storage[index] = value
+        self.storage[index + self.length] = value
+        self._add(value.astype(float))
+
+    def _combine(self, values, sign):
+        '''Adds (sign=1) or removes (sign=-1) a batch of samples from the
+        running statistics (Chan's parallel algorithm).
+        '''
+        count = len(values)
+        if count == 0:
+            return
+        values = values.astype(float)
+        batch_mean = values.mean(axis=0)
+        batch_m2 = ((values - batch_mean)**2).sum(axis=0)
+        size = self.size + sign*count
+        if size == 0:
+            self.size = 0
+            self._mean = np.zeros(self.shape)
+            self._m2 = np.zeros(self.shape)
+        elif sign > 0:
+            delta = batch_mean - self._mean
+            self._mean = self._mean + delta*count/size
+            self._m2 = self._m2 + batch_m2 + delta**2*self.size*count/size
+            self.size = size
+        else:
+            mean = (self.size*self._mean - count*batch_mean)/size
+            delta = batch_mean - mean
+            self._m2 = self._m2 - batch_m2 - delta**2*size*count/self.size
+            self._mean = mean
+            self.size = size
+
+    def extend(self, values):
+        '''Appends multiple samples in order, evicting the oldest samples as
+        necessary. Only the newest samples that fit within the capacity are
+        kept.
+        '''
+        values = np.asarray(values, dtype=self.dtype).reshape((-1,)+self.shape)[-self.length:]
+        count = len(values)
+        evict = max(0, self.size + count - self.length)
+        self._combine(self.view()[:evict], -1)
+        self.start = (self.start + evict) % self.length
+        index = (self.start + self.size + np.arange(count)) % self.length
+        self.storage[index] = values
+        self.storage[index + self.length] = values
+        self._combine(values, 1)
+
+    def view(self):
+        '''Returns the samples from oldest to newest without copying.'''
+        view = self.storage[self.start:self.start + self.size]
+        view.flags.writeable = False
+        return view
+
+    def mean(self, axis=None, **kwargs):
+        '''The mean of the buffered samples. Any other arguments are passed to
+        numpy, which computes the mean from the samples.
+        '''
+        if (axis != None) or any([(value != None) for value in kwargs.values()]):
+            return self.view().mean(axis=axis, **kwargs)
+        if self.size == 0:
+            return np.full(self.shape, np.nan)[()]
+        return self._mean[()]
+
+    def var(self, axis=None, ddof=0, **kwargs):
+        '''The variance of the buffered samples. Any other arguments are
+        passed to numpy, which computes the variance from the samples.
+        '''
+        if (axis != None) or any([(value != None) for value in kwargs.values()]):
+            return self.view().var(axis=axis, ddof=ddof, **kwargs)
+        if self.size <= ddof:
+            return np.full(self.shape, np.nan)[()]
+        return np.maximum(self._m2, 0)[()]/(self.size - ddof)
+
+    def std(self, axis=None, ddof=0, **kwargs):
+        '''The standard deviation of the buffered samples.'''
+        return np.sqrt(self.var(axis=axis, ddof=ddof, **kwargs))
+
+    def tolist(self):
+        return self.view().tolist()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        return self.view()[key]
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def __array__(self, dtype=None, copy=None):
+        if (dtype == None):
+            return self.view()
+        return self.view().astype(dtype)
+
+    def __repr__(self):
+        return 'RingBuffer({:})'.format(self.tolist())
+
+
+# %% Loop Timings
+METRICS_DATABASE = 'metrics'
+METRICS_TTL = 30*24*60*60 # seconds that exported loop timings are kept
+TIMING_BUCKETS = [10**(exponent/10) for exponent in range(-60, 31)] # 1us to 1000s
+
+class LoopTimings():
+    def __init__(self):
+        '''Collects histograms of execution times, keyed by a name (i.e. the
+        state db) and a phase of its loop (i.e. "monitor" or the name of a
+        routine). Each histogram counts the times that fall within
+        logarithmically spaced buckets (10 per decade), so recording a time is
+        a bisection and an increment regardless of the number of samples.
+        '''
+        self.lock = threading.Lock()
+        self.histograms = {} # name:{phase:histogram}
+
+    def record(self, name, phase, seconds):
+        '''Adds an execution time to the histogram of the name and phase.'''
+        with self.lock:
+            if not(name in self.histograms):
+                self.histograms[name] = {}
+            if not(phase in self.histograms[name]):
+                self.histograms[name][phase] = {
+                    'counts':[0]*(len(TIMING_BUCKETS)+1),
+                    'n':0, 'sum':0., 'max':0.}
+            histogram = self.histograms[name][phase]
+            histogram['counts'][bisect.bisect_left(TIMING_BUCKETS, seconds)] += 1
+            histogram['n'] += 1
+            histogram['sum'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+
+    def lap(self, name, phase, start, routine=None):
+        '''Records the time elapsed since the start of a phase, and returns
+        the current time so that it can be used as the start of the next
+        phase. If a routine is given the time is also recorded under the name
+        of the routine.
+        '''
+        now = time.perf_counter()
+        self.record(name, phase, now - start)
+        if (routine != None):
+            self.record(name, 'routine:'+getattr(routine, '__name__', str(routine)), now - start)
+        return now
+
+    @staticmethod
+    def percentile(histogram, percent):
+        '''Returns the upper bound of the bucket that contains the percentile.'''
+        target = percent/100*histogram['n']
+        total = 0
+        for (index, count) in enumerate(histogram['counts']):
+            total += count
+            if (total >= target) and count:
+                return TIMING_BUCKETS[index] if (index < len(TIMING_BUCKETS)) else histogram['max']
+        return histogram['max']
+
+    def summary(self, name=None, buckets=False):
+        '''Returns the count, mean, maximum and 50th, 90th and 99th percentile
+        times of each phase, for a single name or all names. If "buckets" is
+        True the nonzero histogram buckets are included as a list of
+        [upper bound, count] pairs.
+        '''
+        with self.lock:
+            names = list(self.histograms) if (name == None) else [name]
+            summary = {}
+            for name in names:
+                summary[name] = {}
+                for (phase, histogram) in self.histograms.get(name, {}).items():
+                    stats = {
+                        'n':histogram['n'],
+                        'mean':histogram['sum']/histogram['n'],
+                        'max':histogram['max'],
+                        'p50':self.percentile(histogram, 50),
+                        'p90':self.percentile(histogram, 90),
+                        'p99':self.percentile(histogram, 99)}
+                    if buckets:
+                        bounds = TIMING_BUCKETS+[histogram['max']]
+                        stats['buckets'] = [[bounds[index], count] for (index, count) in enumerate(histogram['counts']) if count]
+                    summary[name][phase] = stats
+        return summary
+
+    def reset(self):
+        '''Removes all histograms.'''
+        with self.lock:
+            self.histograms = {}
+
+
 # %% State Machine ============================================================
 class Machine():
     '''Initialize the machine.
@@ -138,6 +586,21 @@ class Machine():
         The number of seconds to wait before logging the same error. A larger
         value prevents the logs from being continously flooded by a recurring
         error.
+    recovery_interval
+        The number of seconds to wait before the first attempt to recover a
+        faulty device. The wait doubles after each failed attempt.
+    max_recovery_interval
+        The maximum number of seconds to wait between attempts to recover a
+        faulty device.
+    queue_backend
+        A callable that returns a queue given its name, used for the
+        communications queue and to arbitrate access to the devices. The
+        default is `CouchbaseDB.PriorityQueue`. Use `LocalQueue.LocalQueue`
+        to arbitrate within a single process, or bind it to the address of a
+        `LocalQueue` server to arbitrate between the processes of a single
+        host without a Couchbase server. If the queues provide
+        `wait_for_push`, new messages wake the communications loop as soon
+        as they are pushed.
 
     Notes
     -----
@@ -155,13 +618,25 @@ class Machine():
     '''
     #--- Initialization Functions ---------------------------------------------
     @log.log_this()
-    def __init__(self, log_error_interval=100, log_warning_interval=100):
+    def __init__(self, log_error_interval=100, log_warning_interval=100,
+                 recovery_interval=1, max_recovery_interval=300, queue_backend=None):
+        if (queue_backend == None):
+            if (CouchbaseDB == None):
+                raise ImportError('couchbase is not installed, use a LocalQueue queue_backend')
+            queue_backend = CouchbaseDB.PriorityQueue
+        self.queue_backend = queue_backend
         self.timer = {}
         self.thread = {}
         self.event = {}
         self.error = {}
+        self.health = {}
+        self.timings = LoopTimings()
+        self.metrics_indexed = False
+        self.scheduler = Scheduler()
         self.error_interval = log_error_interval # seconds
         self.warning_interval = log_warning_interval # seconds
+        self.recovery_interval = recovery_interval # seconds
+        self.max_recovery_interval = max_recovery_interval # seconds
 
     # Communications queue ----------------------------------------------------
     @log.log_this()
@@ -183,7 +658,7 @@ class Machine():
         log_str = " Initializing comms"
         print(log_str)
         self.COMMS = COMMS
-        self.comms = CouchbaseDB.PriorityQueue(self.COMMS)
+        self.comms = self.queue_backend(self.COMMS)
 
     # Internal database names -------------------------------------------------
     @log.log_this()
@@ -301,11 +776,16 @@ class Machine():
               state).
             - The "heartbeat" parameter is a datetime.datetime utc timestamp
               that indicates when the control script last checked the state.
-              Every time the control script finishes a loop it writes the
-              state db to the buffer with a new heartbeat value. This is useful
-              to determine if the current state in the database is "stale". The
-              heartbeat is only incidentally updated in the record as items are
-              written to it in the coarse of normal control script operation.
+              The control script updates the heartbeat every loop, but only
+              writes the state db to the buffer when the rest of the state has
+              changed or once per heartbeat interval. The buffered heartbeat
+              is therefore at most one heartbeat interval old while the
+              control script is running, and determines if the current state
+              in the database is "stale". The liveness of the control script
+              is also published by its `MongoDB.Heartbeat`. The heartbeat is
+              only incidentally updated in the
+              record as items are written to it in the coarse of normal control
+              script operation.
 
         DEVICE_SETTINGS : dict of dict
             - Include all settings that need to be tracked in the databases::
@@ -461,70 +941,96 @@ class Machine():
         for device_db in self.DEVICE_DBs:
             log_str = " Initializing device {:}".format(device_db)
             log.log_info(mod_name, func_name, log_str)
-        # Release Old References
-            if (device_db in self.dev):
-                if ('driver' in self.dev[device_db]):
-                    if hasattr(self.dev[device_db]['driver'],'_release'):
-                        getattr(self.dev[device_db]['driver'],'_release')()
-        # Create New Object
-            queue = CouchbaseDB.PriorityQueue(self.DEVICE_SETTINGS[device_db]['queue'])
-            queue.queue_and_wait()
-            driver = self.send_args(self.DEVICE_SETTINGS[device_db]['driver'],
-                                    self.DEVICE_SETTINGS[device_db]['__init__'])
-            queue.remove()
-            self.dev[device_db] = {
-                    'driver':driver,
-                    'queue':queue}
+            self._init_device(device_db)
         gc.collect() # garbage collect old references
     # Settings
         self.local_settings = local_settings
         for database in self.SETTINGS:
             log_str = " Initializing database {:}".format(database)
             log.log_info(mod_name, func_name, log_str)
-            device_db_condition = (database in self.DEVICE_DBs)
-            control_db_condition = (database in self.CONTROL_DB)
-            self.local_settings[database] = self.db[database].read_buffer()
-        # Check all SETTINGS
-            db_initialized = True
-            settings_list = []
-            for setting in self.SETTINGS[database]:
-                update_device_condition = (device_db_condition and (setting != 'driver') and (setting != 'queue') and (setting != '__init__'))
-            # Check that there is anything at all
-                if (self.local_settings[database]==None):
-                    self.local_settings[database]={}
-            # Check that the key exists in the database
-                if not(setting in self.local_settings[database]):
-                    db_initialized = False
-                    if device_db_condition:
-                        if setting == 'driver':
-                            self.local_settings[database][setting] = str(self.SETTINGS[database][setting])
-                        else:
-                            self.local_settings[database][setting] = self.SETTINGS[database][setting]
-                        if update_device_condition:
-                            settings_list.append({setting:self.SETTINGS[database][setting]})
+            self._init_settings(database)
+    # Device Health
+        for device_db in self.DEVICE_DBs:
+            self.health[device_db] = {
+                    'healthy':True,
+                    'failures':0,
+                    'retry':None,
+                    'recovering':False,
+                    'dependents':set()}
+
+    def _init_device(self, device_db):
+        '''Initializes the driver and queue of a single device, releasing the
+        references to the old driver if it exists. A faulty driver may fail to
+        release its resources, the error is logged and the new driver is
+        initialized regardless.
+        '''
+    # Release Old References
+        if (device_db in self.dev):
+            if ('driver' in self.dev[device_db]):
+                if hasattr(self.dev[device_db]['driver'],'_release'):
+                    try:
+                        getattr(self.dev[device_db]['driver'],'_release')()
+                    except:
+                        log.log_exception_info(self._init_device.__module__, self._init_device.__name__, sys.exc_info())
+    # Create New Object
+        queue = self.queue_backend(self.DEVICE_SETTINGS[device_db]['queue'])
+        queue.queue_and_wait()
+        driver = self.send_args(self.DEVICE_SETTINGS[device_db]['driver'],
+                                self.DEVICE_SETTINGS[device_db]['__init__'])
+        queue.remove()
+        self.dev[device_db] = {
+                'driver':driver,
+                'queue':queue}
+
+    def _init_settings(self, database):
+        '''Checks that all settings of a single database exist, populating any
+        missing settings with their default values. Device settings are
+        propogated to or read from the device.
+        '''
+        device_db_condition = (database in self.DEVICE_DBs)
+        control_db_condition = (database in self.CONTROL_DB)
+        self.local_settings[database] = self.db[database].read_buffer()
+    # Check all SETTINGS
+        db_initialized = True
+        settings_list = []
+        for setting in self.SETTINGS[database]:
+            update_device_condition = (device_db_condition and (setting != 'driver') and (setting != 'queue') and (setting != '__init__'))
+        # Check that there is anything at all
+            if (self.local_settings[database]==None):
+                self.local_settings[database]={}
+        # Check that the key exists in the database
+            if not(setting in self.local_settings[database]):
+                db_initialized = False
+                if device_db_condition:
+                    if setting == 'driver':
+                        self.local_settings[database][setting] = str(self.SETTINGS[database][setting])
                     else:
                         self.local_settings[database][setting] = self.SETTINGS[database][setting]
-                elif (update_device_condition):
-                    settings_list.append({setting:None})
-                if (control_db_condition and setting == 'main_loop'):
-                    if self.local_settings[database][setting]['value'] !=True:
+                    if update_device_condition:
+                        settings_list.append({setting:self.SETTINGS[database][setting]})
+                else:
+                    self.local_settings[database][setting] = self.SETTINGS[database][setting]
+            elif (update_device_condition):
+                settings_list.append({setting:None})
+            if (control_db_condition and setting == 'main_loop'):
+                if self.local_settings[database][setting]['value'] !=True:
+                    db_initialized = False
+                    self.local_settings[database][setting]['value'] = True
+            if ((setting == 'driver') or (setting == 'queue') or (setting == '__init__')):
+                if setting == 'driver':
+                    if self.local_settings[database][setting] != str(self.SETTINGS[database][setting]):
                         db_initialized = False
-                        self.local_settings[database][setting]['value'] = True
-                if ((setting == 'driver') or (setting == 'queue') or (setting == '__init__')):
-                    if setting == 'driver':
-                        if self.local_settings[database][setting] != str(self.SETTINGS[database][setting]):
-                            db_initialized = False
-                            self.local_settings[database][setting] = str(self.SETTINGS[database][setting])
-                    else:
-                        if self.local_settings[database][setting] != self.SETTINGS[database][setting]:
-                            db_initialized = False
-                            self.local_settings[database][setting] = self.SETTINGS[database][setting]
-            if device_db_condition:
-            # Update the device values
-                self.update_device_settings(database, settings_list)
-            elif not(db_initialized):
-            # Update the database values if necessary
-                self.db[database].write_record_and_buffer(self.local_settings[database])
+                        self.local_settings[database][setting] = str(self.SETTINGS[database][setting])
+                else:
+                    if self.local_settings[database][setting] != self.SETTINGS[database][setting]:
+                        db_initialized = False
+                        self.local_settings[database][setting] = self.SETTINGS[database][setting]
+        if device_db_condition:
+        # Update the device values
+            self.update_device_settings(database, settings_list)
+        elif not(db_initialized):
+        # Update the database values if necessary
+            self.db[database].write_record_and_buffer(self.local_settings[database])
 
     @log.log_this()
     def init_device_drivers_and_settings(self, dev={}, local_settings={}):
@@ -557,7 +1063,7 @@ class Machine():
 
     # Initialize Local Copy of Monitors ---------------------------------------
     @log.log_this()
-    def init_monitors(self, mon={}):
+    def init_monitors(self, mon={}, ring_buffers={}):
         '''Initialize the local copy of the monitor objects.
 
         Monitors should associate the monitor databases with the local buffers
@@ -580,6 +1086,15 @@ class Machine():
                 'new':<bool>,
             ...}
 
+        - Monitors listed in ring_buffers are initialized with a RingBuffer
+          instead of a list. The entries are the RingBuffer arguments::
+
+            {<database path>:{
+                'length':<int>,
+                'dtype':<numpy dtype>,
+                'shape':<tuple>},
+            ...}
+
         Notes
         -----
         - The monitors are initialized with an empty list.
@@ -589,17 +1104,18 @@ class Machine():
         log_str = " Initializing monitor data structures"
         log.log_info(mod_name, func_name, log_str)
         self.mon = mon
+        new_buffer = lambda database: RingBuffer(**ring_buffers[database]) if (database in ring_buffers) else []
         # Internal Master Databases ---------------------
         for database in self.MONITOR_DBs:
             if not database in self.mon:
                 self.mon[database] = {
-                    'data':[],
+                    'data':new_buffer(database),
                     'new':False}
         # External Read Databases------------------------
         for database in self.R_MONITOR_DBs:
             cursor = MongoDB.Cursor(self.db[database])
             self.mon[database] = {
-                    'data':[],
+                    'data':new_buffer(database),
                     'cursor':cursor,
                     'new':False}
 
@@ -856,11 +1372,41 @@ class Machine():
 
     # Run the main loop -------------------------------------------------------
     @log.log_this()
-    def operate_machine(self, current_state={}, main_loop_interval=0.5):
+    def operate_machine(self, current_state={}, main_loop_interval=0.5, heartbeat_interval=5., timing_export_interval=60.):
         mod_name = self.operate_machine.__module__
         func_name = self.operate_machine.__name__
         log_str = " Operating state machine"
         log.log_info(mod_name, func_name, log_str)
+        #--- Heartbeat --------------------------------------------------------
+        '''The liveness of this process is published once per heartbeat
+        interval under the name of the communications queue. The state dbs are
+        written to their buffers when their states change, and otherwise once
+        per heartbeat interval so that the buffered heartbeat stays current.
+        '''
+        self.heartbeat_interval = heartbeat_interval
+        self.written_state = {}
+        self.state_written = {}
+        self.heartbeat = MongoDB.Heartbeat(self.mongo_client, self.COMMS, interval=heartbeat_interval)
+        self.heartbeat.start()
+        #--- Loop Timings -----------------------------------------------------
+        '''The loop timing histograms are exported to the metrics database once
+        per export interval. See `Machine.export_timings`.
+        '''
+        self.timing_export_interval = timing_export_interval
+        self.timings_exported = time.monotonic()
+        #--- Device Users -----------------------------------------------------
+        '''The state dbs whose states apply settings to a device are paused
+        while that device is recovered, together with any state db whose
+        thread failed on the device. See `Machine.pause_dependents`.
+        '''
+        self.device_users = {device_db:set() for device_db in self.DEVICE_DBs}
+        for state_db in self.STATE_DBs:
+            for state in self.STATES[state_db]:
+                if isinstance(self.STATES[state_db][state], dict) and ('settings' in self.STATES[state_db][state]):
+                    for database in self.STATES[state_db][state]['settings']:
+                        if (database in self.device_users):
+                            self.device_users[database].add(state_db)
+        self.paused = {} # state_db:deinitialized
         #--- Current State ----------------------------------------------------
         self.current_state = current_state
         for state_db in self.STATE_DBs:
@@ -896,22 +1442,22 @@ class Machine():
         '''The main loop timers are used to coordinate the threads of the main
         loop. Threads are expected to execute within this time interval. This
         is also the interval in which the main loop checks on its threads.
+        Each loop waits on the scheduler, which wakes it when its next timer
+        is due or when a new message has been parsed. The communications loop
+        is also woken when a message is pushed into its queue, see
+        `Machine.watch_for_messages`.
         '''
         self.loop_interval = {}
-        self.loop_timer = {}
         # Main Loop
         self.loop_interval['main'] = main_loop_interval # seconds
-        self.loop_timer['main'] = self.get_lap(self.loop_interval['main'])+1
         # State Machines
         for state_db in self.STATE_DBs:
             if 'loop_interval' in self.STATES[state_db]:
                 self.loop_interval[state_db] = self.STATES[state_db]['loop_interval']
             else:
                 self.loop_interval[state_db] = main_loop_interval
-            self.loop_timer[state_db] = self.get_lap(self.loop_interval[state_db])+1
         # Communications
         self.loop_interval['check_for_messages'] = main_loop_interval
-        self.loop_timer['check_for_messages'] = self.get_lap(self.loop_interval['check_for_messages'])+1
         #--- Initialize Thread Events -----------------------------------------
         for state_db in self.STATE_DBs:
             self.event[state_db] = threading.Event()
@@ -920,41 +1466,66 @@ class Machine():
         for state_db in self.STATE_DBs:
             self.thread[state_db] = ThreadFactory(target=self.state_machine, args=[state_db])
         self.thread[self.COMMS] = ThreadFactory(target=self.check_for_messages)
+        self.comms_threads = [self.COMMS]
+        for device_db in self.DEVICE_DBs:
+            self.thread['recover_device:'+device_db] = ThreadFactory(target=self._recover_device, args=[device_db])
+        if hasattr(self.comms, 'wait_for_push'):
+            self.thread['watch_for_messages'] = ThreadFactory(target=self.watch_for_messages)
+            self.comms_threads.append('watch_for_messages')
         #--- Main Loop --------------------------------------------------------
         while self.local_settings[self.CONTROL_DB]['main_loop']['value']:
+            #--- Recover Faulty Devices ---------------------------------------
+            for device_db in self.DEVICE_DBs:
+                self.recover_device(device_db)
             #--- Maintain Threads ---------------------------------------------
-            errors = []
+            errors = {}
             for state_db in self.STATE_DBs:
-                errors.append(self.maintain_thread(state_db))
-            errors.append(self.maintain_thread(self.COMMS))
+                # Threads that depend on a faulty device wait for its recovery
+                if (state_db in self.paused):
+                    self.maintain_paused_state(state_db)
+                else:
+                    errors[state_db] = self.maintain_thread(state_db)
+            for thread_name in self.comms_threads:
+                errors[thread_name] = self.maintain_thread(thread_name)
             #--- Check for Errors ---------------------------------------------
-            error_caught = bool(len([error for error in errors if (error!=None)]))
-            if error_caught:
-                error_str = [''.join(traceback.format_exception_only(error[0], error[1])).strip() for error in errors if (error!=None)]
+            errors = {thread_name:error for (thread_name, error) in errors.items() if (error!=None)}
+            faulty_devices = {thread_name:self.faulty_devices(error) for (thread_name, error) in errors.items()}
+            isolated = bool(len(errors)) and all(faulty_devices.values())
+            if isolated:
+            # Only recover the faulty devices, healthy devices and the threads
+            # that did not fail continue to operate
+                error_str = [''.join(traceback.format_exception_only(error[0], error[1])).strip() for error in errors.values()]
+                devices = sorted(set().union(*faulty_devices.values()))
+                log_str = '\n'.join([" Device fault detected, recovering {:}.".format(', '.join(devices)),*error_str])
+                log.log_info(mod_name, func_name, log_str)
+                for (thread_name, device_dbs) in faulty_devices.items():
+                    for device_db in device_dbs:
+                        if self.health[device_db]['healthy']:
+                            self.health[device_db]['healthy'] = False
+                            self.health[device_db]['retry'] = time.monotonic()
+                        if (thread_name in self.STATE_DBs):
+                            self.health[device_db]['dependents'].add(thread_name)
+                        self.pause_dependents(device_db)
+            elif len(errors):
+                error_str = [''.join(traceback.format_exception_only(error[0], error[1])).strip() for error in errors.values()]
                 log_str = '\n'.join([" Exeception detected, reinitializing threads.",*error_str])
                 log.log_info(mod_name, func_name, log_str)
             # Trigger shutdown events
                 for state_db in self.STATE_DBs:
                     self.event[state_db].set()
                 self.event[self.COMMS].set()
+                self.scheduler.wake()
             # Join all threads
                 for state_db in self.STATE_DBs:
                     self.thread[state_db].join()
-                self.thread[self.COMMS].join()
+                for thread_name in self.comms_threads:
+                    self.thread[thread_name].join()
+                for device_db in self.DEVICE_DBs:
+                    self.thread['recover_device:'+device_db].join()
             # Update the state variables
                 for state_db in self.STATE_DBs:
-                    with self.lock[state_db]:
-                        # Check for gaps in the last recorded state and the buffer
-                        last_state = self.db[state_db].read_record(number_of_documents=1, sort_ascending=False, return_single_timestamp=True)
-                        if last_state['_timestamp'] < self.current_state[state_db]['heartbeat']:
-                            # Transfer the last know state into the record
-                            self.db[state_db].write_record(
-                                self.current_state[state_db],
-                                timestamp=self.current_state[state_db]['heartbeat'])
-                        # Update to uninitialized state
-                        if self.current_state[state_db]['initialized'] != False:
-                            self.current_state[state_db]['initialized'] = False
-                            self.db[state_db].write_record_and_buffer(self.current_state[state_db])
+                    self.deinitialize_state(state_db)
+                self.paused = {}
             # Reinitialize the devices and settings
                 self.init_device_drivers_and_settings(dev=self.dev, local_settings=self.local_settings)
             # Reset shutdown trigger
@@ -964,15 +1535,14 @@ class Machine():
             # Update log
                 log_str = " Operating state machine"
                 log.log_info(mod_name, func_name, log_str)
+            #--- Export Loop Timings ------------------------------------------
+            if (time.monotonic() - self.timings_exported) > self.timing_export_interval:
+                try:
+                    self.export_timings()
+                except:
+                    log.log_exception_info(mod_name, func_name, sys.exc_info())
             #--- Pause --------------------------------------------------------
-            pause = (self.loop_timer['main']+1)*self.loop_interval['main'] - time.time()
-            if pause > 0:
-                time.sleep(pause)
-                self.loop_timer['main'] += 1
-            else:
-                log_str = " Execution time exceeded the set loop interval {:}s by {:.2g}s".format(self.loop_interval['main'], abs(pause))
-                log.log_info(mod_name, func_name, log_str)
-                self.loop_timer['main'] = self.get_lap(self.loop_interval['main'])+1
+            self.pause('main', mod_name, func_name)
         #--- Main Loop has exited ---------------------------------------------
         log_str = " Shut down command accepted. Exiting the control script."
         log.log_info(mod_name, func_name, log_str)
@@ -980,10 +1550,15 @@ class Machine():
         for state_db in self.STATE_DBs:
             self.event[state_db].set()
         self.event[self.COMMS].set()
+        self.scheduler.wake()
         # Join all threads
         for state_db in self.STATE_DBs:
             self.thread[state_db].join()
-        self.thread[self.COMMS].join()
+        for thread_name in self.comms_threads:
+            self.thread[thread_name].join()
+        for device_db in self.DEVICE_DBs:
+            self.thread['recover_device:'+device_db].join()
+        self.heartbeat.stop()
         log_str = " Shutdown complete."
         log.log_info(mod_name, func_name, log_str)
 
@@ -999,11 +1574,15 @@ class Machine():
         log.log_info(mod_name, func_name, log_str)
         #--- Main Loop --------------------------------------------------------
         while not(self.event[state_db].is_set()):
+            loop_start = lap = time.perf_counter()
+            # Each database is read at most once per loop, when its first
+            # prerequisite is checked
+            snapshot = {}
             #--- Check the Critical Prerequisites -----------------------------
             critical_pass = self.check_prereqs(
                     state_db,
                     self.current_state[state_db]['state'],
-                    'critical', log_all_failures=True)
+                    'critical', log_all_failures=True, snapshot=snapshot)
             # Place into safe state if critical prereqs fail
             if not critical_pass:
                 # Update the state variable
@@ -1011,9 +1590,12 @@ class Machine():
                     self.current_state[state_db]['prerequisites']['critical'] = critical_pass
                     self.db[state_db].write_record_and_buffer(self.current_state[state_db])
                 self.setup_state(state_db, 'safe')
+            lap = self.timings.lap(state_db, 'critical', lap)
 
             #--- Monitor the Current State ------------------------------------
-            self.STATES[state_db][self.current_state[state_db]['state']]['routines']['monitor'](state_db)
+            routine = self.STATES[state_db][self.current_state[state_db]['state']]['routines']['monitor']
+            routine(state_db)
+            lap = self.timings.lap(state_db, 'monitor', lap, routine)
 
             #--- Maintain the Current State -----------------------------------
             # If compliant,
@@ -1023,25 +1605,27 @@ class Machine():
                     optional_pass = self.check_prereqs(
                         state_db,
                         self.current_state[state_db]['state'],
-                        'optional')
+                        'optional', snapshot=snapshot)
                     if optional_pass == True:
                     # Update the state variable
                         with self.lock[state_db]:
                             self.current_state[state_db]['prerequisites']['optional'] = optional_pass
                             self.db[state_db].write_record_and_buffer(self.current_state[state_db])
             # Maintain compliance
-                self.STATES[state_db][self.current_state[state_db]['state']]['routines']['maintain'](state_db)
+                routine = self.STATES[state_db][self.current_state[state_db]['state']]['routines']['maintain']
+                routine(state_db)
+                lap = self.timings.lap(state_db, 'maintain', lap, routine)
             # If out of compliance,
             else:
             # Check necessary and optional prerequisites
                 necessary_pass = self.check_prereqs(
                         state_db,
                         self.current_state[state_db]['state'],
-                        'necessary')
+                        'necessary', snapshot=snapshot)
                 optional_pass = self.check_prereqs(
                         state_db,
                         self.current_state[state_db]['state'],
-                        'optional')
+                        'optional', snapshot=snapshot)
                 necessary_prereq_changed = (self.current_state[state_db]['prerequisites']['necessary'] != necessary_pass)
                 optional_prereq_changed = (self.current_state[state_db]['prerequisites']['optional'] != optional_pass)
                 if (necessary_prereq_changed or optional_prereq_changed):
@@ -1052,7 +1636,11 @@ class Machine():
                         self.db[state_db].write_record_and_buffer(self.current_state[state_db])
             # Search for the compliant state
                 if necessary_pass:
-                    self.STATES[state_db][self.current_state[state_db]['state']]['routines']['search'](state_db)
+                    routine = self.STATES[state_db][self.current_state[state_db]['state']]['routines']['search']
+                    routine(state_db)
+                    lap = self.timings.lap(state_db, 'search', lap, routine)
+                else:
+                    lap = self.timings.lap(state_db, 'search', lap)
 
             #--- State initialized --------------------------------------------
             with self.lock[state_db]:
@@ -1064,9 +1652,13 @@ class Machine():
             #--- Operate the Current State ------------------------------------
             # If compliant,
             if self.current_state[state_db]['compliance'] == True:
-                self.STATES[state_db][self.current_state[state_db]['state']]['routines']['operate'](state_db)
+                lap = time.perf_counter()
+                routine = self.STATES[state_db][self.current_state[state_db]['state']]['routines']['operate']
+                routine(state_db)
+                lap = self.timings.lap(state_db, 'operate', lap, routine)
 
             #--- Check Desired State ------------------------------------------
+            lap = time.perf_counter()
             state = self.current_state[state_db]['state']
             desired_state = self.current_state[state_db]['desired_state']
             if state != desired_state:
@@ -1077,21 +1669,21 @@ class Machine():
                     critical_pass = self.check_prereqs(
                             state_db,
                             desired_state,
-                            'critical')
+                            'critical', snapshot=snapshot)
                 else:
                     critical_pass = True
                 if 'necessary' in self.STATES[state_db][desired_state]['prerequisites']:
                     necessary_pass = self.check_prereqs(
                             state_db,
                             desired_state,
-                            'necessary')
+                            'necessary', snapshot=snapshot)
                 else:
                     necessary_pass = True
                 if 'optional' in self.STATES[state_db][desired_state]['prerequisites']:
                     optional_pass = self.check_prereqs(
                             state_db,
                             desired_state,
-                            'optional')
+                            'optional', snapshot=snapshot)
                 else:
                     optional_pass = True
             # Check the "exit" prerequisites of the current state
@@ -1099,7 +1691,7 @@ class Machine():
                     exit_pass = self.check_prereqs(
                             state_db,
                             state,
-                            'exit')
+                            'exit', snapshot=snapshot)
                 else:
                     exit_pass = True
             # Update the current state
@@ -1112,30 +1704,35 @@ class Machine():
                             necessary=necessary_pass,
                             optional=optional_pass)
 
-            #--- Write Heartbeat to Buffer ------------------------------------
+            lap = self.timings.lap(state_db, 'transition', lap)
+
+            #--- Write State Changes to Buffer --------------------------------
             with self.lock[state_db]:
                 self.current_state[state_db]['heartbeat'] = datetime.datetime.utcnow()
-                self.db[state_db].write_buffer(self.current_state[state_db])
+                self.write_state_changes(state_db)
+            self.timings.lap(state_db, 'write', lap)
+            self.timings.lap(state_db, 'loop', loop_start)
 
             #--- Pause --------------------------------------------------------
-            pause = (self.loop_timer[state_db]+1)*self.loop_interval[state_db] - time.time()
-            if pause > 0:
-                time.sleep(pause)
-                self.loop_timer[state_db] += 1
-            else:
-                log_str = " Execution time exceeded the set loop interval {:}s by {:.2g}s".format(self.loop_interval[state_db], abs(pause))
-                log.log_info(mod_name, func_name, log_str)
-                self.loop_timer[state_db] = self.get_lap(self.loop_interval[state_db])+1
+            self.pause(state_db, mod_name, func_name)
 
     # Check the Prerequisites of a Given State --------------------------------
     @log.log_this()
-    def check_prereqs(self, state_db, state, level, log_all_failures=None):
+    def check_prereqs(self, state_db, state, level, log_all_failures=None, snapshot=None):
         '''A helper function to automate the process of checking prerequisites.
+        If a "snapshot" dictionary is given, the buffer of each database is
+        only read if it is not already in the snapshot. The values read are
+        added to the snapshot, so that all prerequisites checked against the
+        same snapshot see one read of each database.
         '''
+        if snapshot is None:
+            snapshot = {}
         prereqs_pass = True
         if level in self.STATES[state_db][state]['prerequisites']:
             for prereq in self.STATES[state_db][state]['prerequisites'][level]:
-                prereq_value = self.from_keys(self.db[prereq['db']].read_buffer(),prereq['key'])
+                if not(prereq['db'] in snapshot):
+                    snapshot[prereq['db']] = self.db[prereq['db']].read_buffer()
+                prereq_value = self.from_keys(snapshot[prereq['db']],prereq['key'])
                 prereq_status = prereq['test'](prereq_value)
                 if not(prereq_status):
                     if log_all_failures == None:
@@ -1264,18 +1861,59 @@ class Machine():
         func_name = self.check_for_messages.__name__
         while not(self.event[self.COMMS].is_set()):
         # Parse the message ---------------------------------------------------
-            for message in range(len(self.comms.get_queue())):
+            messages = len(self.comms.get_queue())
+            for message in range(messages):
                 message = self.comms.pop()
                 self.parse_message(message)
+            if messages:
+            # Let the state machines and the main loop act on the messages
+                self.scheduler.wake(self.STATE_DBs+['main'])
         # Pause ---------------------------------------------------------------
-            pause = (self.loop_timer['check_for_messages']+1)*self.loop_interval['check_for_messages'] - time.time()
-            if pause > 0:
-                time.sleep(pause)
-                self.loop_timer['check_for_messages'] += 1
+            self.pause('check_for_messages', mod_name, func_name)
+
+    # Watch the Communications Queue ------------------------------------------
+    @log.log_this()
+    def watch_for_messages(self):
+        '''Wakes the communications loop as soon as an item is pushed into the
+        communications queue, so that messages are parsed without waiting for
+        the next interval of `Machine.check_for_messages`. The queue must
+        provide `wait_for_push`. Errors from the queue are logged and the
+        queue is then only checked at the loop interval until it recovers.
+        '''
+        mod_name = self.watch_for_messages.__module__
+        func_name = self.watch_for_messages.__name__
+        interval = self.loop_interval['check_for_messages']
+        count = None
+        while not(self.event[self.COMMS].is_set()):
+            try:
+                new_count = self.comms.wait_for_push(count, interval)
+            except:
+                log.log_exception_info(mod_name, func_name, sys.exc_info())
+                self.event[self.COMMS].wait(interval)
+                count = None
             else:
-                log_str = " Execution time exceeded the set loop interval {:}s by {:.2g}s".format(self.loop_interval['check_for_messages'], abs(pause))
-                log.log_info(mod_name, func_name, log_str)
-                self.loop_timer['check_for_messages'] = self.get_lap(self.loop_interval['check_for_messages'])+1
+                if (count != None) and (new_count != count):
+                    self.scheduler.wake(['check_for_messages'])
+                count = new_count
+
+    # Pause Until the Next Loop -----------------------------------------------
+    def pause(self, key, mod_name, func_name):
+        '''A helper function that blocks until the next iteration of the loop
+        given by the key is due, or until the loop is woken by the scheduler.
+        '''
+        lag = self.scheduler.schedule(key, self.loop_interval[key])
+        if lag > 0:
+            log_str = " Execution time exceeded the set loop interval {:}s by {:.2g}s".format(self.loop_interval[key], lag)
+            log.log_info(mod_name, func_name, log_str)
+        self.scheduler.wait(key)
+
+    # Wake the Loops ----------------------------------------------------------
+    def wake(self, keys=None):
+        '''Wakes the given state machine loops (by state database), or all
+        loops if unspecified, so that they run without waiting for their next
+        interval. Routines may call this after updating a monitor.
+        '''
+        self.scheduler.wake(keys)
 
     # Parse Messages from the Communications Queue ----------------------------
     @log.log_this()
@@ -1306,6 +1944,11 @@ class Machine():
                                   <parameter name>:<value>,
                                   ...}}
 
+            Requesting an export of the loop timings, to the metrics
+            database or to a JSON file (see `Machine.export_timings`)::
+
+                    message = {"timings":<None or file path>}
+
         - Commands are sent into the queue by setting the "message" keyword
           argument within the CouchbaseDB queue.push() method.
         - Commands are read from the queue with the queue.pop() method.
@@ -1348,6 +1991,13 @@ class Machine():
                                     self.current_state[state_db]['compliance'] = False
                                     self.db[state_db].write_record_and_buffer(self.current_state[state_db])
 
+        # If requesting the loop timings,
+            if ('timings' in message):
+                try:
+                    self.export_timings(path=message['timings'])
+                except:
+                    result_str = ' Could not export the loop timings to {:}\n {:}'.format(message['timings'], repr(sys.exc_info()[1]))
+                    log.log_info(mod_name, func_name, result_str)
         # If requesting to change device settings,
             if ('device_setting' in message):
                 for device_db in message['device_setting']:
@@ -1440,6 +2090,188 @@ class Machine():
             self.thread[thread_name].start()
         return error
 
+    # Export the Loop Timings -------------------------------------------------
+    @log.log_this()
+    def export_timings(self, path=None):
+        '''Exports the loop timing histograms of all state dbs. The timings are
+        inserted into the collection of this machine (named after the
+        communications queue) in the metrics database, or written as JSON to
+        the given file path. Exports in the metrics database expire after
+        METRICS_TTL seconds. The timings may also be read directly from
+        `Machine.timings.summary()`.
+        '''
+        document = {
+            '_timestamp':datetime.datetime.utcnow(),
+            'process':self.COMMS,
+            'timings':self.timings.summary(buckets=True)}
+        if (path == None):
+            collection = self.mongo_client.client[METRICS_DATABASE][self.COMMS]
+            if not(self.metrics_indexed):
+                # Expire old exports
+                collection.create_index('_timestamp', expireAfterSeconds=METRICS_TTL)
+                self.metrics_indexed = True
+            collection.insert_one(document)
+        else:
+            document['_timestamp'] = document['_timestamp'].isoformat()
+            with open(path+'.tmp', 'w') as f:
+                json.dump(document, f, indent=1)
+            os.replace(path+'.tmp', path)
+        self.timings_exported = time.monotonic()
+
+    # Write the State if Changed ----------------------------------------------
+    def write_state_changes(self, state_db):
+        '''A helper function that writes the current state to the buffer if it
+        differs from the last state written by this function, ignoring the
+        heartbeat, or if it has not been written within the heartbeat
+        interval. The process heartbeat is updated with new states. The caller
+        must hold the state db's lock.
+        '''
+        state = {key:value for (key, value) in self.current_state[state_db].items() if (key != 'heartbeat')}
+        changed = (state != self.written_state.get(state_db, None))
+        stale = ((time.monotonic() - self.state_written.get(state_db, 0)) >= self.heartbeat_interval)
+        if changed or stale:
+            self.db[state_db].write_buffer(self.current_state[state_db])
+            self.state_written[state_db] = time.monotonic()
+        if changed:
+            self.written_state[state_db] = copy.deepcopy(state)
+            self.heartbeat.update(**{state_db:state})
+
+    #--- Fault Recovery Functions ---------------------------------------------
+    def faulty_devices(self, error):
+        '''A helper function that returns the device databases whose drivers
+        raised the given error, as found in the frames of its traceback. An
+        empty set is returned if the error did not originate from a driver.
+        '''
+        drivers = {id(self.dev[device_db]['driver']):device_db for device_db in self.dev if ('driver' in self.dev[device_db])}
+        device_dbs = set()
+        tb = error[2]
+        while (tb != None):
+            obj = tb.tb_frame.f_locals.get('self', None)
+            if (id(obj) in drivers) and (obj is self.dev[drivers[id(obj)]]['driver']):
+                device_dbs.add(drivers[id(obj)])
+            tb = tb.tb_next
+        return device_dbs
+
+    def dependencies_healthy(self, state_db):
+        '''A helper function that returns whether all devices that the
+        state_db depends on, or has failed on, have been recovered.
+        '''
+        for device_db in self.health:
+            if (state_db in self.health[device_db]['dependents']):
+                if not(self.health[device_db]['healthy']):
+                    return False
+        return True
+
+    @log.log_this()
+    def recover_device(self, device_db):
+        '''Re-initializes the driver and settings of a faulty device once its
+        retry time has passed and the states that depend on it have stopped.
+        The recovery runs on its own thread, so that the main loop and the
+        states that do not depend on the device keep operating, and this
+        method only starts it and collects its outcome.
+        Failed attempts are retried with an exponential backoff, starting from
+        the "recovery_interval" and up to the "max_recovery_interval". Returns
+        whether the device is healthy.
+        '''
+        health = self.health.get(device_db, None)
+        if (health == None) or health['healthy']:
+            return True
+        mod_name = self.recover_device.__module__
+        func_name = self.recover_device.__name__
+        thread_name = 'recover_device:'+device_db
+        if health['recovering']:
+            (alive, error) = self.thread[thread_name].check_thread()
+            if alive:
+                return False
+            health['recovering'] = False
+            if (error != None):
+                health['failures'] += 1
+                backoff = min(self.recovery_interval*2**(health['failures']-1), self.max_recovery_interval)
+                health['retry'] = time.monotonic() + backoff
+                log_str = " Recovery of {:} failed, retrying in {:}s".format(device_db, backoff)
+                log.log_exception_info(mod_name, func_name, error, log_str=log_str)
+                return False
+            else:
+                log_str = " Recovered {:} after {:} failed attempts".format(device_db, health['failures'])
+                log.log_info(mod_name, func_name, log_str)
+                health['healthy'] = True
+                health['failures'] = 0
+                health['retry'] = None
+                health['dependents'] = set()
+                return True
+        # The driver is only replaced once its dependents have stopped
+        stopped = not(any([self.thread[state_db].is_alive() for state_db in health['dependents']]))
+        if stopped and (time.monotonic() >= health['retry']):
+            health['recovering'] = True
+            self.thread[thread_name].start()
+        return False
+
+    def _recover_device(self, device_db):
+        '''A helper function that re-initializes the driver and settings of a
+        device, see `Machine.recover_device`.
+        '''
+        self._init_device(device_db)
+        self._init_settings(device_db)
+
+    def pause_dependents(self, device_db):
+        '''A helper function that stops the state machines that depend on a
+        faulty device until it has been recovered. These are the state dbs
+        whose states apply settings to the device, and those whose threads
+        have failed on it. See `Machine.maintain_paused_state`.
+        '''
+        mod_name = self.pause_dependents.__module__
+        func_name = self.pause_dependents.__name__
+        dependents = self.health[device_db]['dependents'] | self.device_users[device_db]
+        self.health[device_db]['dependents'] = dependents
+        for state_db in sorted(dependents):
+            if not(state_db in self.paused):
+                log_str = " Pausing {:} until {:} has recovered".format(state_db, device_db)
+                log.log_info(mod_name, func_name, log_str)
+                self.paused[state_db] = False
+                self.event[state_db].set()
+                self.scheduler.wake([state_db])
+
+    def maintain_paused_state(self, state_db):
+        '''A helper function for the main loop that deinitializes a paused
+        state machine once its thread has stopped, and resumes it once all of
+        the devices that it depends on have been recovered.
+        '''
+        (alive, error) = self.thread[state_db].check_thread()
+        if (error != None):
+            # The state was stopped by the device fault
+            log.log_exception_info(self.state_machine.__module__, '.'.join([self.state_machine.__name__, state_db]), error)
+        if alive:
+            return
+        if not(self.paused[state_db]):
+            self.deinitialize_state(state_db)
+            self.paused[state_db] = True
+        if self.dependencies_healthy(state_db):
+            mod_name = self.maintain_paused_state.__module__
+            func_name = self.maintain_paused_state.__name__
+            log_str = " Resuming {:}".format(state_db)
+            log.log_info(mod_name, func_name, log_str)
+            self.paused.pop(state_db)
+            self.event[state_db].clear()
+            self.thread[state_db].start()
+
+    @log.log_this()
+    def deinitialize_state(self, state_db):
+        '''A helper function that records the last known state of a stopped
+        state machine and marks it as uninitialized.
+        '''
+        with self.lock[state_db]:
+            # Check for gaps in the last recorded state and the buffer
+            last_state = self.db[state_db].read_record(number_of_documents=1, sort_ascending=False, return_single_timestamp=True)
+            if last_state['_timestamp'] < self.current_state[state_db]['heartbeat']:
+                # Transfer the last know state into the record
+                self.db[state_db].write_record(
+                    self.current_state[state_db],
+                    timestamp=self.current_state[state_db]['heartbeat'])
+            # Update to uninitialized state
+            if self.current_state[state_db]['initialized'] != False:
+                self.current_state[state_db]['initialized'] = False
+                self.db[state_db].write_record_and_buffer(self.current_state[state_db])
+
     #--- Helper Functions -----------------------------------------------------
 
     # Parse and Send Arguments to Functions -----------------------------------
@@ -1515,7 +2347,14 @@ class Machine():
     def update_buffer(buffer, new_data, length, extend=False):
         '''Use this function to update a rolling buffer, as typically found in
         the monitors. Set `extend` to true if adding multiple values at once.
+        RingBuffer objects are updated in place and keep their own capacity.
         '''
+        if isinstance(buffer, RingBuffer):
+            if extend:
+                buffer.extend(new_data)
+            else:
+                buffer.push(new_data)
+            return buffer
         length = int(length)
         if extend:
             buffer.extend(new_data)
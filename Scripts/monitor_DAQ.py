@@ -13,8 +13,8 @@ import time
 import datetime
 import logging
 
-import threading
 import queue
+from functools import partial
 
 import os
 import sys
@@ -362,19 +362,23 @@ def queue_worker(queue_name):
         except queue.Empty:
             loop = False
         else:
-            item.start()
-            item.join()
-            fifo_q[queue_name].task_done()
+        # Execute in order on this worker, without spawning a thread per item
+            try:
+                item()
+            except:
+                log.log_exception_info(__name__, item.func.__name__, sys.exc_info())
+            finally:
+                fifo_q[queue_name].task_done()
 # Analog In
 fifo_q['daq:ai_buffer'] = queue.Queue()
-thread['daq:ai_buffer'] = ThreadFactory(target=queue_worker, args=['daq:ai_buffer'])
+thread['daq:ai_buffer'] = ThreadFactory(target=queue_worker, args=['daq:ai_buffer'], pooled=True)
 fifo_q['daq:ai_record'] = queue.Queue()
-thread['daq:ai_record'] = ThreadFactory(target=queue_worker, args=['daq:ai_record'])
+thread['daq:ai_record'] = ThreadFactory(target=queue_worker, args=['daq:ai_record'], pooled=True)
 # Digital In
 fifo_q['daq:di_buffer'] = queue.Queue()
-thread['daq:di_buffer'] = ThreadFactory(target=queue_worker, args=['daq:di_buffer'])
+thread['daq:di_buffer'] = ThreadFactory(target=queue_worker, args=['daq:di_buffer'], pooled=True)
 fifo_q['daq:di_record'] = queue.Queue()
-thread['daq:di_record'] = ThreadFactory(target=queue_worker, args=['daq:di_record'])
+thread['daq:di_record'] = ThreadFactory(target=queue_worker, args=['daq:di_record'], pooled=True)
 
 # Buffer Ai -------------------------------------------------------------------
 def buffer_ai(monitor_db, data_mean, data_std, data_n, timestamp, channel_identifiers=None):
@@ -475,11 +479,11 @@ def read_ai_DAQ(state_db):
             args = [monitor_db, multi_channel_mean[channel_index],
                     multi_channel_std[channel_index], multi_channel_n,
                     timestamp]
-            item = threading.Thread(target=buffer_ai, args=args, daemon=True)
+            item = partial(buffer_ai, *args)
             fifo_q['daq:ai_buffer'].put(item, block=False)
             # Update record
             args = [monitor_db, data, timestamp, write_record, channel]
-            item = threading.Thread(target=record_ai, args=args, daemon=True)
+            item = partial(record_ai, *args)
             fifo_q['daq:ai_record'].put(item, block=False)
         # ai1, 'filter_cavity/DAQ_error_signal' ---------------
             channel = 'daq:ai1'
@@ -490,11 +494,11 @@ def read_ai_DAQ(state_db):
             args = [monitor_db, multi_channel_mean[channel_index],
                     multi_channel_std[channel_index], multi_channel_n,
                     timestamp]
-            item = threading.Thread(target=buffer_ai, args=args, daemon=True)
+            item = partial(buffer_ai, *args)
             fifo_q['daq:ai_buffer'].put(item, block=False)
             # Update record
             args = [monitor_db, data, timestamp, write_record, channel]
-            item = threading.Thread(target=record_ai, args=args, daemon=True)
+            item = partial(record_ai, *args)
             fifo_q['daq:ai_record'].put(item, block=False)
         # ai2, V_set, 'filter_cavity/heater_temperature' ------
         # ai3, V_act, 'filter_cavity/heater_temperature' ------
@@ -511,12 +515,12 @@ def read_ai_DAQ(state_db):
                     multi_channel_std[channel_indicies], multi_channel_n,
                     timestamp]
             kwargs = {'channel_identifiers':['set', 'act']}
-            item = threading.Thread(target=buffer_ai, args=args, kwargs=kwargs, daemon=True)
+            item = partial(buffer_ai, *args, **kwargs)
             fifo_q['daq:ai_buffer'].put(item, block=False)
             # Update record
             args = [monitor_db, data, timestamp, write_record, channels]
             kwargs = {'channel_identifiers':['set', 'act']}
-            item = threading.Thread(target=record_ai, args=args, kwargs=kwargs, daemon=True)
+            item = partial(record_ai, *args, **kwargs)
             fifo_q['daq:ai_record'].put(item, block=False)
         # ai4, 'ambience/box_temperature_0' -------------------
             channel = 'daq:ai4'
@@ -527,11 +531,11 @@ def read_ai_DAQ(state_db):
             args = [monitor_db, multi_channel_mean[channel_index],
                     multi_channel_std[channel_index], multi_channel_n,
                     timestamp]
-            item = threading.Thread(target=buffer_ai, args=args, daemon=True)
+            item = partial(buffer_ai, *args)
             fifo_q['daq:ai_buffer'].put(item, block=False)
             # Update record
             args = [monitor_db, data, timestamp, write_record, channel]
-            item = threading.Thread(target=record_ai, args=args, daemon=True)
+            item = partial(record_ai, *args)
             fifo_q['daq:ai_record'].put(item, block=False)
         # ai5, 'ambience/box_temperature_1' -------------------
             channel = 'daq:ai5'
@@ -542,11 +546,11 @@ def read_ai_DAQ(state_db):
             args = [monitor_db, multi_channel_mean[channel_index],
                     multi_channel_std[channel_index], multi_channel_n,
                     timestamp]
-            item = threading.Thread(target=buffer_ai, args=args, daemon=True)
+            item = partial(buffer_ai, *args)
             fifo_q['daq:ai_buffer'].put(item, block=False)
             # Update record
             args = [monitor_db, data, timestamp, write_record, channel]
-            item = threading.Thread(target=record_ai, args=args, daemon=True)
+            item = partial(record_ai, *args)
             fifo_q['daq:ai_record'].put(item, block=False)
         # ai6, 'ambience/rack_temperature_0' ------------------
             channel = 'daq:ai6'
@@ -557,11 +561,11 @@ def read_ai_DAQ(state_db):
             args = [monitor_db, multi_channel_mean[channel_index],
                     multi_channel_std[channel_index], multi_channel_n,
                     timestamp]
-            item = threading.Thread(target=buffer_ai, args=args, daemon=True)
+            item = partial(buffer_ai, *args)
             fifo_q['daq:ai_buffer'].put(item, block=False)
             # Update record
             args = [monitor_db, data, timestamp, write_record, channel]
-            item = threading.Thread(target=record_ai, args=args, daemon=True)
+            item = partial(record_ai, *args)
             fifo_q['daq:ai_record'].put(item, block=False)
         # Check threads ---------------------------------------------
             thread_name = 'daq:ai_buffer'
@@ -665,11 +669,11 @@ def read_di_DAQ(state_db):
         flips = int(np.sum(np.diff(data)))
         # Update buffer
         args = [monitor_db, last_value[monitor_db], flips, timestamp]
-        item = threading.Thread(target=buffer_di, args=args, daemon=True)
+        item = partial(buffer_di, *args)
         fifo_q['daq:di_buffer'].put(item, block=False)
         # Update record
         args = [monitor_db, data, timestamp, write_record, channel]
-        item = threading.Thread(target=record_di, args=args, daemon=True)
+        item = partial(record_di, *args)
         fifo_q['daq:di_record'].put(item, block=False)
     # port0/line1, 'rf_oscillators/100MHz_phase_lock' ----------------------
         channel = 'daq:port0/line1'
@@ -680,11 +684,11 @@ def read_di_DAQ(state_db):
         flips = int(np.sum(np.diff(data)))
         # Update buffer
         args = [monitor_db, last_value[monitor_db], flips, timestamp]
-        item = threading.Thread(target=buffer_di, args=args, daemon=True)
+        item = partial(buffer_di, *args)
         fifo_q['daq:di_buffer'].put(item, block=False)
         # Update record
         args = [monitor_db, data, timestamp, write_record, channel]
-        item = threading.Thread(target=record_di, args=args, daemon=True)
+        item = partial(record_di, *args)
         fifo_q['daq:di_record'].put(item, block=False)
     # Check threads ---------------------------------------------
         thread_name = 'daq:di_buffer'
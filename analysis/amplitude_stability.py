@@ -62,7 +62,7 @@ try:
     spc_data['mask'] = []
     database = 'spectral_shaper/mask'
     db = MongoDB.DatabaseRead(mongo_client, database)
-    cursor = db.read_record(start_time, stop_time)
+    cursor = db.read_record(start_time, stop_time, projection=['_timestamp', 'path'])
     for doc in cursor:
         spc_data['mask'].append({'mask':'top' in doc['path'], 'time':doc['_timestamp']})
     spc_data['mask'] = pd.DataFrame(spc_data['mask'])
@@ -85,7 +85,7 @@ try:
     spc_data['DW'] = []
     database = 'spectral_shaper/DW'
     db = MongoDB.DatabaseRead(mongo_client, database)
-    cursor = db.read_record(start_time, stop_time)
+    cursor = db.read_record(start_time, stop_time, projection=['_timestamp', 'dBm', 'std', 'dBm_std'])
     for doc in cursor:
         spc_data['DW'].append({'dBm':doc['dBm'], 'std':(doc['std'] if "std" in doc else doc["dBm_std"]), 'time':doc['_timestamp']})
     spc_data['DW'] = pd.DataFrame(spc_data['DW'])
@@ -58,7 +58,8 @@ try:
     mongo_client = MongoDB.MongoClient()
     db_err = MongoDB.DatabaseRead(mongo_client,
                                       'rf_oscillators/Rb_time_tag')
-    cursor = db_err.read_record(start=start_time, stop=stop_time)
+    cursor = db_err.read_record(start=start_time, stop=stop_time,
+                                projection=['_timestamp', 'ns', 'std'])
     for doc in cursor:
         data[0].append(
             [doc['_timestamp'],
@@ -187,7 +188,8 @@ try:
     mongo_client = MongoDB.MongoClient()
     db_err = MongoDB.DatabaseRead(mongo_client,
                                       'mll_fR/DAQ_error_signal')
-    cursor = db_err.read_record(start=start_time, stop=stop_time)
+    cursor = db_err.read_record(start=start_time, stop=stop_time,
+                                projection=['_timestamp', 'V', 'std'])
     for doc in cursor:
         data[0].append(
             [doc['_timestamp'],
@@ -308,7 +310,8 @@ try:
     mongo_client = MongoDB.MongoClient()
     db_err = MongoDB.DatabaseRead(mongo_client,
                                       'mll_f0/freq_err')
-    cursor = db_err.read_record(start=start_time, stop=stop_time)
+    cursor = db_err.read_record(start=start_time, stop=stop_time,
+                                projection=['_timestamp', 'Hz', 'std'])
     for doc in cursor:
         data[0].append(
             [doc['_timestamp'],
@@ -423,7 +426,8 @@ try:
     mongo_client = MongoDB.MongoClient()
     db_err = MongoDB.DatabaseRead(mongo_client,
                                       'cw_laser/freq_err')
-    cursor = db_err.read_record(start=start_time, stop=stop_time)
+    cursor = db_err.read_record(start=start_time, stop=stop_time,
+                                projection=['_timestamp', 'Hz', 'std'])
     for doc in cursor:
         data[0].append(
             [doc['_timestamp'],
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the number of Couchbase requests that a process makes while it waits
+for a device queue, and the hand-off latency between processes. Each waiter
+runs in its own process, so releases reach it through the release datagrams
+of CouchbaseDB or by polling. A Couchbase server must be running at "host".
+"""
+# %% Modules
+
+import multiprocessing
+import time
+from Drivers.Database import CouchbaseDB
+
+# %% Settings
+
+host = 'localhost'
+processes = 4
+holds = [0.005, 0.05, 0.5] # s
+acquisitions = 10
+
+# %% Helper Functions
+
+class CountingBucket():
+    '''Counts the requests made through a Couchbase bucket.'''
+    def __init__(self, cb):
+        self.cb = cb
+        self.requests = 0
+
+    def __getattr__(self, name):
+        self.requests += 1
+        return getattr(self.cb, name)
+
+def waiter(hold, start):
+    '''Acquires the queue repeatedly, holding it for the given time. Returns
+    the requests made while waiting for each acquisition, and the times of
+    each acquisition and release.'''
+    queue = CouchbaseDB.PriorityQueue('benchmark', host=host)
+    queue.cb = CountingBucket(queue.cb)
+    time.sleep(max(start - time.time(), 0))
+    (requests, acquired, released) = ([], [], [])
+    for x in range(acquisitions):
+        count = queue.cb.requests
+        queue.queue_and_wait()
+        acquired.append(time.time())
+        requests.append(queue.cb.requests - count)
+        time.sleep(hold)
+        released.append(time.time())
+        queue.remove()
+    return (requests, acquired, released)
+
+def benchmark_waiters(hold):
+    '''Prints the mean number of requests per acquisition, excluding the first
+    acquisition of each process, and the mean hand-off latency.'''
+    start = time.time() + 2
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.starmap(waiter, [(hold, start)]*processes)
+    requests = [count for result in results for count in result[0][1:]]
+    events = sorted([(t, 'acquired') for result in results for t in result[1]]
+                    + [(t, 'released') for result in results for t in result[2]])
+    handoffs = [b[0] - a[0] for (a, b) in zip(events, events[1:]) if (a[1], b[1]) == ('released', 'acquired')]
+    print('{:>6.0f} ms hold {:>10.1f} requests/acquisition {:>10.2f} ms/handoff'.format(
+        hold*1e3, sum(requests)/len(requests), sum(handoffs)/len(handoffs)*1e3))
+
+# %% Benchmarks
+
+if __name__ == '__main__':
+    print('{:} processes waiting on one queue --------------------------'.format(processes))
+    for hold in holds:
+        benchmark_waiters(hold)
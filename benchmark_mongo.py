@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the write throughput, read latency and sync cost of the database
+layer. The benchmarks run against the in-memory backend by default, so no
+mongoDB server is required. Set "backend" to None to benchmark a local server
+instead. Only run against a server with the test databases below, these are
+dropped before each run.
+"""
+# %% Modules
+
+import datetime
+import logging
+import time
+import numpy as np
+from Drivers.Database import MongoDB
+from Drivers.Database import MongoMemory
+
+# %% Settings
+
+backend = MongoMemory.MemoryClient
+iterations = int(1e4)
+database_name = 'benchmark/test'
+remote_database_name = 'benchmark/remote'
+
+# %% Helper Functions
+
+def benchmark(name, function, iterations=iterations):
+    '''Prints the mean time per call and the number of calls per second.'''
+    start = time.perf_counter()
+    for x in range(iterations):
+        function(x)
+    elapsed = time.perf_counter() - start
+    print('{:<36} {:>10.1f} us/call {:>12.0f} calls/s'.format(name, elapsed/iterations*1e6, iterations/elapsed))
+
+# %% Benchmarks
+
+local_client = MongoDB.MongoClient(backend=backend)
+remote_client = MongoDB.MongoClient(port=27018, backend=backend)
+try:
+    local_client.client.drop_database('benchmark')
+    remote_client.client.drop_database('benchmark')
+    db = MongoDB.DatabaseMaster(local_client, database_name)
+    log_db = MongoDB.LogMaster(local_client, database_name)
+    print('Write throughput -----------------------------------------------')
+    benchmark('write_buffer', lambda x: db.write_buffer({'value':float(x)}))
+    benchmark('write_record', lambda x: db.write_record({'value':float(x)}))
+    benchmark('write_record_and_buffer', lambda x: db.write_record_and_buffer({'value':float(x)}))
+    benchmark('write_buffer (array)', lambda x: db.write_buffer({'value':np.arange(1000.).tolist()}), iterations=iterations//10)
+    db.enable_write_behind()
+    benchmark('write_buffer (write behind)', lambda x: db.write_buffer({'value':float(x)}))
+    db.flush()
+    db.disable_write_behind()
+    logger = MongoDB.MongoLogger(log_db, name='benchmark')
+    benchmark('MongoLogger.info', lambda x: logger.info('benchmark {:}'.format(x)))
+    logger = MongoDB.MongoLogger(log_db, name='benchmark', queued=True)
+    benchmark('MongoLogger.info (queued)', lambda x: logger.info('benchmark {:}'.format(x)))
+    logging.shutdown()
+
+    print('Read latency ---------------------------------------------------')
+    stop = datetime.datetime.utcnow()
+    start = stop - datetime.timedelta(seconds=1)
+    benchmark('read_buffer', lambda x: db.read_buffer())
+    benchmark('read_buffer (10 documents)', lambda x: list(db.read_buffer(number_of_documents=10)))
+    benchmark('read_record (1 s range)', lambda x: list(db.read_record(start, stop)), iterations=iterations//10)
+    db.enable_cache()
+    benchmark('read_buffer (cached)', lambda x: db.read_buffer())
+    db.disable_cache()
+    cursor = MongoDB.Cursor(db)
+    def tail(x):
+        db.write_buffer({'value':float(x)})
+        for doc in cursor.read():
+            pass
+    benchmark('write_buffer and tail', tail)
+
+    print('Sync cost ------------------------------------------------------')
+    remote = MongoDB.DatabaseMaster(remote_client, remote_database_name)
+    remote.write_documents_to_record([{'value':float(x), '_timestamp':datetime.datetime.utcnow()} for x in range(iterations)])
+    remote_log = MongoDB.LogMaster(remote_client, remote_database_name)
+    remote_log.write_log_batch([('benchmark {:}'.format(x), logging.INFO, datetime.datetime.utcnow()) for x in range(iterations)])
+    sync_start = time.perf_counter()
+    MongoDB.sync_to_local(local_client, remote_client, records=[remote_database_name], logs=[remote_database_name])
+    elapsed = time.perf_counter() - sync_start
+    print('{:<36} {:>10.1f} us/doc'.format('sync_to_local (record and log)', elapsed/(2*iterations)*1e6))
+finally:
+    try:
+        remote_client.close()
+    finally:
+        local_client.close()
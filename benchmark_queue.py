@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the hand-off latency and ordering of the device arbitration queues.
+The benchmarks run against the in-process queues and a local queue server, so
+no Couchbase server is required.
+"""
+# %% Modules
+
+import os
+import tempfile
+import threading
+import time
+from functools import partial
+from Drivers.Database import LocalQueue
+
+# %% Settings
+
+iterations = int(1e3)
+waiters = 4
+address = os.path.join(tempfile.gettempdir(), 'benchmark_queues.sock')
+
+# %% Helper Functions
+
+def benchmark_handoff(name, queue_backend):
+    '''Passes the queue between threads and prints the mean time from one
+    thread's release to the next thread's acquisition.'''
+    handoffs = []
+    released = [None]
+    lock = threading.Lock()
+    def worker():
+        queue = queue_backend('benchmark')
+        for x in range(iterations//waiters):
+            queue.queue_and_wait()
+            acquired = time.perf_counter()
+            with lock:
+                if released[0] is not None:
+                    handoffs.append(acquired - released[0])
+                released[0] = time.perf_counter()
+            queue.remove()
+    threads = [threading.Thread(target=worker) for x in range(waiters)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print('{:<36} {:>10.1f} us/handoff'.format(name, sum(handoffs)/len(handoffs)*1e6))
+
+def check_priority(name, queue_backend):
+    '''Prints the order in which waiting threads acquire the queue. Priority
+    items should be served first, and items of equal priority in order.'''
+    holder = queue_backend('priority')
+    holder.queue_and_wait()
+    order = []
+    def worker(index, priority):
+        queue = queue_backend('priority')
+        queue.push(priority=priority)
+        queue.queue_and_wait()
+        order.append((index, priority))
+        queue.remove()
+    threads = [threading.Thread(target=worker, args=[index, (index % 2 == 1)]) for index in range(6)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    holder.remove()
+    for thread in threads:
+        thread.join()
+    print('{:<36} {:}'.format(name, order))
+
+# %% Benchmarks
+
+print('Hand-off latency -----------------------------------------------')
+benchmark_handoff('LocalQueue (in-process)', LocalQueue.LocalQueue)
+manager = LocalQueue.start_server(address)
+try:
+    benchmark_handoff('LocalQueue (server)', partial(LocalQueue.LocalQueue, address=address))
+    print('Priority order (index, priority) -------------------------------')
+    check_priority('LocalQueue (in-process)', LocalQueue.LocalQueue)
+    check_priority('LocalQueue (server)', partial(LocalQueue.LocalQueue, address=address))
+finally:
+    manager.shutdown()
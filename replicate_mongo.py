@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Continuously mirror new documents from the remote database into the local
+database. This is the live counterpart to "sync_mongo.py". The remote server
+must be run as a replica set in order to provide a change stream. The first
+run, without a resume token file, backfills the existing data as "sync_mongo.py"
+does before following the stream.
+"""
+# %% Modules
+
+import datetime
+import logging
+from Drivers.Database import MongoDB
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+# %% Databases
+
+database_names = [
+    'ambience',
+    'broadening_stage',
+    'comb_generator',
+    'cw_laser',
+    'filter_cavity',
+    'mll_f0',
+    'mll_fR',
+    'monitor_DAQ',
+    'rf_oscillators',
+    'spectral_shaper',
+    ]
+
+# %% Connect to database and replicate
+
+resume_token_file = 'replicate_mongo.token'
+print('Starting replication', datetime.datetime.now())
+try:
+    local_client = MongoDB.MongoClient()
+    remote_client = MongoDB.MongoClient(port=27018) # this port must point to remote
+    MongoDB.replicate_to_local(local_client, remote_client,
+                               database_names=database_names,
+                               resume_token_file=resume_token_file)
+except KeyboardInterrupt:
+    pass
+finally:
+    try:
+        remote_client.close()
+    finally:
+        local_client.close()
+print('Replication stopped', datetime.datetime.now())
@@ -7,8 +7,12 @@ Created on Mon Aug 27 14:34:48 2018
 # %% Modules
 
 import datetime
+import logging
 from Drivers.Database import MongoDB
 
+# Report the progress of the sync
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
 # %% Records
 
 records = [
@@ -191,18 +195,16 @@ logs = [
 
 # %% Connect to database and pull results
 
+checkpoint_file = 'sync_mongo.checkpoint'
 sync_start_time = datetime.datetime.utcnow()
 print('Starting sync', datetime.datetime.now())
 try:
     local_client = MongoDB.MongoClient()
     remote_client = MongoDB.MongoClient(port=27018) # this port must point to remote
-    for database in records:
-        print('Syncing {:},'.format(database), 'Elapsed Time =',(datetime.datetime.utcnow()-sync_start_time))
-        MongoDB.sync_to_local_record(local_client, remote_client, database, sync_stop_time=sync_start_time)
-        #MongoDB.sync_to_local_buffer(local_client, remote_client, database, sync_stop_time=start_time)
-    for database in logs:
-        print('Syncing {:},'.format(database), 'Elapsed Time =',(datetime.datetime.utcnow()-sync_start_time))
-        MongoDB.sync_to_local_log(local_client, remote_client, database, sync_stop_time=sync_start_time)
+    MongoDB.sync_to_local(local_client, remote_client,
+                          records=records, logs=logs,
+                          sync_stop_time=sync_start_time,
+                          checkpoint_file=checkpoint_file)
 finally:
     try:
         remote_client.close()